@@ -0,0 +1,125 @@
+# bench/contact_cards.py
+#
+# Микробенчмарк разбора карточек диалогов (client.contact_card_parser)
+# на синтетическом корпусе, без браузера:
+#
+#     python -m bench.contact_cards --cards 5000 --repeat 3
+#
+# Сравнивает:
+#   - по одной карточке через html.parser (как раньше _parse_thread_element),
+#   - пакетный разбор каждым доступным бэкендом (lxml — если установлен),
+#   - раунды скролла с перекрытием: без пропуска и с пропуском по card_key.
+
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from client.contact_card_parser import CARD_BACKENDS, ContactCardParser
+
+_CARD_TEMPLATE = (
+    '<div role="button" tabindex="0" class="x1i10hfl x1qjc9v5 xjbqb8w">'
+    '<a href="/direct/t/{thread_id}/" role="link" tabindex="-1" class="x1i10hfl">'
+    '<div class="x9f619 x78zum5"><div class="x1n2onr6">'
+    '<img alt="Фото профиля {username}" src="https://cdn.example/p/{i}.jpg" height="56" width="56">'
+    "</div>"
+    '<div class="x9f619 x1n2onr6 x1ja2u2z">'
+    '<span class="x1lliihq x193iq5w" dir="auto"><span title="{username}" class="xlyipyv">{username}</span></span>'
+    '<div class="x1cy8zhl"><span class="x1lliihq x1plvlek" dir="auto">'
+    '<span class="x1lliihq">{preview}</span></span>'
+    '<span aria-hidden="true"> · </span>'
+    '<abbr aria-label="{ago} нед." class="x1iorvi4"><span>{ago} нед.</span></abbr>'
+    "</div></div></div></a></div>"
+)
+
+_WORDS = "привет как дела ок спасибо завтра созвонимся фото видео ссылка встреча да нет".split()
+
+
+def make_corpus(count: int, seed: int = 42) -> List[str]:
+    rnd = random.Random(seed)
+    cards = []
+    for i in range(count):
+        cards.append(
+            _CARD_TEMPLATE.format(
+                i=i,
+                thread_id=340282366841710300949128000000000000 + i,
+                username=f"user_{i:05d}",
+                preview=" ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(2, 12))),
+                ago=rnd.randint(1, 52),
+            )
+        )
+    return cards
+
+
+def scroll_rounds(cards: List[str], window: int = 40, step: int = 12) -> List[List[str]]:
+    """
+    Как видит карточки fetch_contacts: окно из window карточек сдвигается
+    на step за раунд, остальное — уже разобранные карточки.
+    """
+    return [cards[start:start + window] for start in range(0, len(cards), step)]
+
+
+def timed(fn: Callable[[], int], repeat: int) -> tuple[float, int]:
+    times = []
+    result = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарк разбора карточек диалогов")
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    cards = make_corpus(args.cards)
+    rounds = scroll_rounds(cards)
+    scraped_at = datetime.now(timezone.utc)
+    print(
+        f"[BENCH] Карточек: {len(cards)}, раундов скролла: {len(rounds)}, "
+        f"карточек во всех раундах: {sum(len(r) for r in rounds)}, бэкенды: {', '.join(CARD_BACKENDS)}"
+    )
+
+    results = []
+
+    single = ContactCardParser("html.parser")
+    results.append((
+        "html.parser, по одной",
+        *timed(lambda: sum(len(single.parse_cards([h], scraped_at)) for h in cards), args.repeat),
+    ))
+
+    for backend in CARD_BACKENDS:
+        p = ContactCardParser(backend)
+        results.append((
+            f"{backend}, пакетом",
+            *timed(lambda: len(p.parse_cards(cards, scraped_at)), args.repeat),
+        ))
+        results.append((
+            f"{backend}, раунды без пропуска",
+            *timed(lambda: sum(len(p.parse_cards(r, scraped_at)) for r in rounds), args.repeat),
+        ))
+
+        def with_skip() -> int:
+            seen: set[str] = set()
+            return sum(len(p.parse_cards(r, scraped_at, seen)) for r in rounds)
+
+        results.append((f"{backend}, раунды с пропуском", *timed(with_skip, args.repeat)))
+
+    print("=" * 72)
+    baseline = results[0][1]
+    for name, seconds, parsed in results:
+        print(
+            f"{name:>34}: {seconds * 1000:8.1f} мс, {seconds / len(cards) * 1e6:6.1f} мкс/карточку, "
+            f"x{baseline / seconds:5.1f}, снимков: {parsed}"
+        )
+
+
+if __name__ == "__main__":
+    main()
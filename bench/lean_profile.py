@@ -0,0 +1,107 @@
+# bench/lean_profile.py
+#
+# Сравнение обычного и лёгкого профиля Chrome (create_driver(lean=True)):
+# время загрузки inbox/чатов и память процессов Chrome.
+#
+#     python -m bench.lean_profile --rounds 5 --chats 5
+#
+# Нужны сохранённые cookies (после любого sync-скрипта) и, для чатов,
+# контакты с thread_id в БД. RSS считается через psutil, если он установлен.
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from typing import List, Optional
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+from client.driver_factory import create_driver
+from client.selenium_direct import BUBBLE_SELECTOR, THREAD_CARD_SELECTOR, InstagramDirectClient
+from db.contact_repository import ContactRepository
+
+try:
+    import psutil
+except ImportError:  # psutil не обязателен — без него просто не будет RSS
+    psutil = None
+
+
+def chrome_rss_mb(driver) -> Optional[float]:
+    """
+    Суммарный RSS chromedriver + всех процессов Chrome, в МБ.
+    """
+    if psutil is None:
+        return None
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        procs = [root] + root.children(recursive=True)
+        return sum(p.memory_info().rss for p in procs) / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def timed_get(driver, url: str, ready_selector: str, timeout: int = 60) -> float:
+    """
+    Время от driver.get до появления ready_selector, в секундах.
+    """
+    started = time.perf_counter()
+    driver.get(url)
+    WebDriverWait(driver, timeout).until(lambda d: d.find_elements(By.CSS_SELECTOR, ready_selector))
+    return time.perf_counter() - started
+
+
+def run_profile(lean: bool, rounds: int, thread_ids: List[str], headless: bool) -> dict:
+    driver = create_driver(headless=headless, lean=lean)
+    client = InstagramDirectClient(driver)
+    base_url = "https://www.instagram.com"
+    try:
+        client._open_direct()
+
+        inbox_times = [
+            timed_get(driver, f"{base_url}/direct/inbox/", THREAD_CARD_SELECTOR)
+            for _ in range(rounds)
+        ]
+        chat_times = [
+            timed_get(driver, f"{base_url}/direct/t/{thread_id}/", BUBBLE_SELECTOR)
+            for thread_id in thread_ids
+        ]
+        return {
+            "inbox": inbox_times,
+            "chat": chat_times,
+            "rss_mb": chrome_rss_mb(driver),
+        }
+    finally:
+        client.close()
+
+
+def _fmt(values: List[float]) -> str:
+    if not values:
+        return "—"
+    return f"медиана {statistics.median(values):.2f} c, среднее {statistics.mean(values):.2f} c"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк лёгкого профиля Chrome")
+    parser.add_argument("--rounds", type=int, default=5, help="сколько раз грузить inbox")
+    parser.add_argument("--chats", type=int, default=5, help="сколько чатов по thread_id открыть")
+    parser.add_argument("--headless", action="store_true")
+    args = parser.parse_args(argv)
+
+    thread_ids = [c.thread_id for c in ContactRepository().list_all() if c.thread_id][: args.chats]
+
+    results = {}
+    for lean in (False, True):
+        name = "lean" if lean else "обычный"
+        print(f"[BENCH] Профиль: {name}")
+        results[name] = run_profile(lean, args.rounds, thread_ids, args.headless)
+
+    print("=" * 60)
+    for name, r in results.items():
+        rss = f"{r['rss_mb']:.0f} МБ" if r["rss_mb"] is not None else "n/a (нет psutil)"
+        print(f"{name:>8}: inbox {_fmt(r['inbox'])}; чат {_fmt(r['chat'])}; RSS {rss}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# bench/message_schema.py
+#
+# Размер файла и задержки запросов: старая раскладка messages
+# (contact_username / sender / ISO-время в каждой строке, схема версии 6)
+# против компактной (contact_id, sender_id, epoch-мс — миграция 7)
+# на синтетической БД:
+#
+#     python -m bench.message_schema --messages 5000000 --contacts 2000
+#
+# Старая БД заполняется и индексируется как после миграций 1–6, затем её
+# копия переводится миграцией 7, обе сжимаются VACUUM. Запросы — SQL, который
+# выполняет MessageRepository (для старой раскладки — в последней её версии);
+# watermarks в компактной БД — сам MessageRepository.load_watermarks.
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from db.connection import DB_PATH_ENV, close_connections, get_connection
+from db.contact_repository import ContactRepository
+from db.message_repository import MessageRepository, to_epoch_ms
+from db.migrations import apply_migrations
+
+_WORDS = "привет как дела ок спасибо завтра созвонимся фото видео ссылка встреча да нет".split()
+_SENDERS = ("me", "contact", "contact", "unknown")
+
+# messages до миграции 7 (как её создавали init_schema + миграции 1–6)
+_LEGACY_MESSAGES = """
+    CREATE TABLE messages (
+        id               INTEGER PRIMARY KEY AUTOINCREMENT,
+        contact_username TEXT NOT NULL,
+        sender           TEXT NOT NULL,
+        text             TEXT NOT NULL,
+        timestamp_utc    TEXT NULL,
+        scraped_at_utc   TEXT NOT NULL,
+        msg_hash         TEXT NULL,
+        seq              INTEGER NULL
+    )
+"""
+
+_LEGACY_QUERIES = {
+    "последнее сообщение": (
+        """
+        SELECT contact_username, sender, text, timestamp_utc
+        FROM messages WHERE contact_username = ? ORDER BY seq DESC LIMIT 1
+        """
+    ),
+    "последние 50": (
+        """
+        SELECT sender, text, timestamp_utc, scraped_at_utc, msg_hash
+        FROM (
+            SELECT * FROM messages WHERE contact_username = ? ORDER BY seq DESC LIMIT 50
+        ) ORDER BY seq
+        """
+    ),
+    "за неделю (COUNT)": (
+        """
+        SELECT COUNT(*) FROM messages
+        WHERE contact_username = ? AND timestamp_utc >= ? AND timestamp_utc < ?
+        """
+    ),
+}
+
+# те же запросы в компактной раскладке (как их выполняет MessageRepository)
+_COMPACT_QUERIES = {
+    "последнее сообщение": (
+        """
+        SELECT c.username AS contact_username, s.name AS sender, m.text,
+               strftime('%Y-%m-%dT%H:%M:%f+00:00', m.timestamp_ms / 1000.0, 'unixepoch') AS timestamp_utc
+        FROM contacts c
+        JOIN messages m ON m.contact_id = c.id
+        JOIN senders s  ON s.id = m.sender_id
+        WHERE c.username = ?
+        ORDER BY m.seq DESC
+        LIMIT 1
+        """
+    ),
+    "последние 50": (
+        """
+        SELECT s.name AS sender, m.text, m.timestamp_ms, m.scraped_at_ms, m.msg_hash
+        FROM (
+            SELECT m.* FROM contacts c JOIN messages m ON m.contact_id = c.id
+            WHERE c.username = ? ORDER BY m.seq DESC LIMIT 50
+        ) m
+        JOIN senders s ON s.id = m.sender_id
+        ORDER BY m.seq
+        """
+    ),
+    "за неделю (COUNT)": (
+        """
+        SELECT COUNT(*) FROM contacts c JOIN messages m ON m.contact_id = c.id
+        WHERE c.username = ? AND m.timestamp_ms >= ? AND m.timestamp_ms < ?
+        """
+    ),
+}
+
+_LEGACY_WATERMARKS = """
+    SELECT contact_username, text
+    FROM (
+        SELECT seq, contact_username, text,
+               ROW_NUMBER() OVER (PARTITION BY contact_username ORDER BY seq DESC) AS rn
+        FROM messages
+    )
+    WHERE rn <= 3
+    ORDER BY contact_username, seq
+"""
+
+
+def use_db(path: str) -> None:
+    close_connections()
+    os.environ[DB_PATH_ENV] = path
+
+
+def file_size(path: str) -> int:
+    with get_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+
+def table_sizes() -> List[Tuple[str, int]]:
+    """
+    Размер таблиц и индексов по dbstat (если SQLite собран без него — пусто).
+    """
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(
+                "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC"
+            ).fetchall()
+    except Exception:
+        return []
+    return [(r[0], r[1]) for r in rows if r[0].startswith(("messages", "ux_messages", "idx_messages", "senders"))]
+
+
+def legacy_rows(count: int, contacts: int, seed: int = 42) -> Iterator[tuple]:
+    rnd = random.Random(seed)
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    scraped_at = datetime.now(timezone.utc).isoformat()
+    step = timedelta(days=4 * 365) / count
+    for i in range(count):
+        # у активных контактов переписка длиннее
+        contact = min(int(rnd.paretovariate(1.2)) - 1, contacts - 1)
+        yield (
+            f"user_{contact:05d}",
+            rnd.choice(_SENDERS),
+            " ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(1, 12))),
+            (start + step * i).isoformat(),
+            scraped_at,
+            f"{rnd.getrandbits(96):024x}:0",
+            i + 1,
+        )
+
+
+def build_legacy(path: str, messages: int, contacts: int) -> None:
+    use_db(path)
+    ContactRepository().init_schema()
+    with get_connection() as conn:
+        conn.execute(_LEGACY_MESSAGES)
+        conn.executemany(
+            """
+            INSERT INTO messages (contact_username, sender, text, timestamp_utc, scraped_at_utc, msg_hash, seq)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            legacy_rows(messages, contacts),
+        )
+        conn.commit()
+    apply_migrations(target=6)
+
+
+def timed(fn: Callable[[], object], repeat: int) -> Tuple[float, float]:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95) - 1 if len(times) > 1 else 0]
+
+
+def run_queries(
+    queries: dict,
+    usernames: List[str],
+    week: Tuple[object, object],
+    watermarks: Callable[[], object],
+) -> dict:
+    """
+    Каждый запрос — по разу на контакт из usernames; watermarks — 3 раза.
+    """
+    results = {}
+    with get_connection() as conn:
+        for name, sql in queries.items():
+            samples = iter(usernames)
+            if "неделю" in name:
+                run = lambda: conn.execute(sql, (next(samples), *week)).fetchall()
+            else:
+                run = lambda: conn.execute(sql, (next(samples),)).fetchall()
+            results[name] = timed(run, len(usernames))
+    results["watermarks (вся БД)"] = timed(watermarks, 3)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Старая и компактная раскладка messages: размер и задержки")
+    parser.add_argument("--messages", type=int, default=5_000_000)
+    parser.add_argument("--contacts", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=500, help="запросов каждого вида (случайные контакты)")
+    parser.add_argument("--dir", default=None, help="куда класть БД (по умолчанию — временная папка)")
+    parser.add_argument("--keep", action="store_true", help="не удалять БД после замеров")
+    args = parser.parse_args(argv)
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="mygram-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    legacy_path = os.path.join(workdir, "legacy.db")
+    compact_path = os.path.join(workdir, "compact.db")
+    for path in (legacy_path, compact_path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f"[BENCH] Сообщений: {args.messages}, контактов: {args.contacts}, папка: {workdir}")
+    started = time.perf_counter()
+    build_legacy(legacy_path, args.messages, args.contacts)
+    with get_connection() as conn:
+        conn.execute("VACUUM")
+    legacy_size = file_size(legacy_path)
+    legacy_tables = table_sizes()
+    print(f"[BENCH] Старая БД собрана за {time.perf_counter() - started:.1f} с")
+
+    close_connections()
+    shutil.copyfile(legacy_path, compact_path)
+    use_db(compact_path)
+    started = time.perf_counter()
+    apply_migrations()
+    migrate_seconds = time.perf_counter() - started
+    with get_connection() as conn:
+        vacuum_started = time.perf_counter()
+        conn.execute("VACUUM")
+        vacuum_seconds = time.perf_counter() - vacuum_started
+    compact_size = file_size(compact_path)
+    compact_tables = table_sizes()
+    print(f"[BENCH] Миграция 7: {migrate_seconds:.1f} с, VACUUM: {vacuum_seconds:.1f} с")
+
+    with get_connection() as conn:
+        usernames = [r[0] for r in conn.execute("SELECT username FROM contacts")]
+    rnd = random.Random(7)
+    sample = [rnd.choice(usernames) for _ in range(args.queries)]
+    week_start = datetime(2023, 3, 1, tzinfo=timezone.utc)
+    week = (week_start, week_start + timedelta(days=7))
+
+    use_db(legacy_path)
+
+    def legacy_watermarks():
+        with get_connection() as conn:
+            return conn.execute(_LEGACY_WATERMARKS).fetchall()
+
+    legacy = run_queries(
+        _LEGACY_QUERIES, sample, (week[0].isoformat(), week[1].isoformat()), legacy_watermarks
+    )
+    use_db(compact_path)
+    repo = MessageRepository()
+    compact = run_queries(
+        _COMPACT_QUERIES, sample, (to_epoch_ms(week[0]), to_epoch_ms(week[1])), lambda: repo.load_watermarks(3)
+    )
+
+    print("=" * 72)
+    print(f"{'файл БД':>24}: {legacy_size / 2**20:9.1f} МБ -> {compact_size / 2**20:9.1f} МБ "
+          f"({compact_size / legacy_size:.0%})")
+    for title, tables in (("старая", legacy_tables), ("компактная", compact_tables)):
+        if tables:
+            print(f"{title:>24}: " + ", ".join(f"{name} {size / 2**20:.1f} МБ" for name, size in tables))
+    print("-" * 72)
+    for name in legacy:
+        (old_median, old_p95), (new_median, new_p95) = legacy[name], compact[name]
+        print(
+            f"{name:>24}: медиана {old_median * 1e6:9.0f} -> {new_median * 1e6:9.0f} мкс, "
+            f"p95 {old_p95 * 1e6:9.0f} -> {new_p95 * 1e6:9.0f} мкс"
+        )
+
+    close_connections()
+    if not args.keep and not args.dir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# client/chat_stitcher.py
+#
+# Склейка раундов сбора чата (от новых к старым) в сообщения от старых
+# к новым с msg_hash — целиком (iter_chronological) или потоково
+# (ChatStreamStitcher). Без браузера: используется и при разборе шардов.
+
+from __future__ import annotations
+
+from typing import Iterable, Iterator, List, Optional
+
+from client.memory_governor import SnapshotSpool
+from core.fingerprint import CONTEXT_DEPTH, MessageFingerprinter, message_digest
+from core.models import MessageBatch, MessageSnapshot
+
+
+def _ordered_pairs(
+    batches: Iterable[list[tuple[str, MessageSnapshot]]],
+    spool: Optional[SnapshotSpool],
+) -> Iterator[tuple[str, MessageSnapshot]]:
+    for batch in reversed(list(batches)):
+        yield from batch
+    if spool is not None:
+        try:
+            for batch in spool.iter_batches_reversed():
+                yield from batch
+        finally:
+            spool.close()
+
+
+def iter_chronological(
+    batches: Iterable[list[tuple[str, MessageSnapshot]]],
+    drop_keys: set[str],
+    spool: Optional[SnapshotSpool] = None,
+    reached_start: bool = True,
+) -> Iterator[MessageSnapshot]:
+    """
+    Склеивает раунды сбора (в порядке сбора: от новых к старым) в поток
+    сообщений от старых к новым, пропуская ключи из drop_keys.
+    Раунды в памяти старше выгруженных в spool, поэтому идут первыми;
+    spool закрывается, когда дочитан.
+
+    Попутно проставляет msg_hash (core.fingerprint): отпечатки считаются
+    и по отброшенным сообщениям, чтобы первое новое после watermark
+    получило тот же контекст, что и при полном сборе.
+
+    reached_start=False — сбор не дошёл до начала чата: у CONTEXT_DEPTH самых
+    старых сообщений (и серии одинаковых за ними) контекст отпечатка неполный,
+    и более глубокий сбор дал бы им другие msg_hash. Такие сообщения не
+    отдаются — их сохранит сбор, который увидит их контекст.
+    """
+    fingerprinter = MessageFingerprinter()
+    # дайджест серии, начавшейся на границе сбора (номер повтора в ней неизвестен)
+    boundary: Optional[str] = None
+    for i, (key, snapshot) in enumerate(_ordered_pairs(batches, spool)):
+        msg_hash = fingerprinter.assign(snapshot)
+        if not reached_start and i <= CONTEXT_DEPTH:
+            boundary = msg_hash.partition(":")[0]
+            continue
+        if boundary is not None:
+            if msg_hash.partition(":")[0] == boundary:
+                continue
+            boundary = None
+        if key not in drop_keys:
+            yield snapshot
+
+
+class ChatStreamStitcher:
+    """
+    Потоковый вариант iter_chronological: отдаёт сообщения, не дожидаясь конца чата.
+
+    Раунды приходят от новых к старым, а msg_hash сообщения зависит от более
+    старых соседей (core.fingerprint), поэтому сообщение готово, когда:
+    - собраны CONTEXT_DEPTH более старых сообщений (контекст отпечатка);
+    - известно, где начинается серия одинаковых дайджестов перед ним (номер повтора);
+    - собрано ещё len(watermark) - 1 более старых (watermark целиком в одном окне).
+    release() забирает готовые сообщения с «нового» конца раундов и удаляет их
+    из state.batches — в памяти остаётся только хвост из нескольких сообщений.
+    Отпечатки и состав совпадают с iter_chronological по тем же раундам.
+    """
+
+    def __init__(self, contact_username: str, watermark: Optional[List[str]] = None) -> None:
+        self._contact_username = contact_username
+        self._hold = max(CONTEXT_DEPTH, len(watermark or ()) - 1)
+        self._released = 0
+        self._emitted = False
+
+    def release(
+        self,
+        batches: list[list[tuple[str, MessageSnapshot]]],
+        drop_keys: set[str],
+        final: bool = False,
+        reached_start: bool = True,
+    ) -> Optional[MessageBatch]:
+        """
+        Забирает готовые сообщения из batches (раунды в порядке сбора).
+        final=True — сбор закончен: с reached_start всё оставшееся готово
+        (самое старое — начало чата); без него — оставшиеся с неполным
+        контекстом так и не отдаются (см. iter_chronological).
+        """
+        at_start = final and reached_start
+        ordered = [pair for batch in reversed(batches) for pair in batch]
+        if not ordered:
+            return None
+
+        digests: list[Optional[str]] = [None] * len(ordered)
+        for i, (_, snapshot) in enumerate(ordered):
+            if at_start or i >= CONTEXT_DEPTH:
+                context = [m.text for _, m in ordered[max(0, i - CONTEXT_DEPTH):i]]
+                digests[i] = message_digest(snapshot.sender, snapshot.text, context)
+
+        # идём от самого нового, пока сообщения готовы
+        start = len(ordered)
+        while start > 0:
+            i = start - 1
+            if digests[i] is None or (not final and i < self._hold):
+                break
+            j = i - 1
+            while j >= 0 and digests[j] == digests[i]:
+                j -= 1
+            if j >= 0 and digests[j] is None:
+                # серия повторов уходит в ещё не собранную часть
+                break
+            if j < 0 and not at_start:
+                break
+            ordered[i][1].msg_hash = f"{digests[i]}:{i - 1 - j}"
+            start = i
+
+        count = len(ordered) - start
+        if not count:
+            return None
+        ranks = [self._released + count - 1 - k for k in range(count)]
+        self._released += count
+
+        released = ordered[start:]
+        _trim_newest(batches, count)
+        kept = [(snapshot, rank) for (key, snapshot), rank in zip(released, ranks) if key not in drop_keys]
+        first = not self._emitted and bool(kept)
+        self._emitted = self._emitted or bool(kept)
+        return MessageBatch(
+            contact_username=self._contact_username,
+            messages=[snapshot for snapshot, _ in kept],
+            ranks=[rank for _, rank in kept],
+            first=first,
+        )
+
+
+def _trim_newest(batches: list[list], count: int) -> None:
+    """
+    Удаляет count самых новых сообщений из раундов (batches[0] — самый новый раунд).
+    """
+    while count and batches:
+        newest = batches[0]
+        if len(newest) <= count:
+            count -= len(newest)
+            batches.pop(0)
+        else:
+            del newest[len(newest) - count:]
+            count = 0
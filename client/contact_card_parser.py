@@ -0,0 +1,298 @@
+# client/contact_card_parser.py
+
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from bs4 import BeautifulSoup
+
+from core.models import ContactSnapshot
+
+try:
+    from lxml import html as lxml_html
+except ImportError:  # lxml не обязателен — без него работает html.parser из bs4
+    lxml_html = None
+
+HTML_BACKEND_ENV = "MYGRAM_HTML_BACKEND"
+
+# Дешёвый ключ карточки: ссылка на диалог или title имени — без разбора HTML
+_CARD_HREF_RE = re.compile(r'href="([^"]*/direct/t/[^"]*)"')
+_CARD_TITLE_RE = re.compile(r'<span[^>]*\stitle="([^"]*)"')
+_THREAD_ID_RE = re.compile(r"/direct/t/([^/?#]+)")
+
+# Обёртка карточки в пакетном документе: всё разбирается за один проход парсера
+_CARD_WRAPPER_OPEN = '<div data-mygram-card="1">'
+_CARD_WRAPPER_CLOSE = "</div>"
+
+
+@dataclass
+class CardFields:
+    """
+    Сырые поля карточки диалога — то, что бэкенд достал из HTML.
+    """
+    username: str
+    preview_text: str
+    time_str: str
+    thread_id: Optional[str] = None
+
+
+def card_key(outer_html: str) -> str:
+    """
+    Ключ карточки для пропуска уже разобранных: ссылка на диалог, иначе title
+    имени, иначе сам HTML. Считается регуляркой, до любого парсинга.
+    """
+    match = _CARD_HREF_RE.search(outer_html)
+    if match:
+        return "href:" + match.group(1)
+    match = _CARD_TITLE_RE.search(outer_html)
+    if match:
+        return "title:" + match.group(1)
+    return "html:" + outer_html
+
+
+def _thread_id_from_href(href: Optional[str]) -> Optional[str]:
+    if not href:
+        return None
+    match = _THREAD_ID_RE.search(href)
+    return match.group(1) if match else None
+
+
+def _batch_document(htmls: List[str]) -> str:
+    return "<div>" + "".join(_CARD_WRAPPER_OPEN + h + _CARD_WRAPPER_CLOSE for h in htmls) + "</div>"
+
+
+# ---------- бэкенды ----------
+
+
+def _lxml_text(el) -> str:
+    # аналог bs4 get_text(strip=True)
+    return "".join(part.strip() for part in el.itertext())
+
+
+def _parse_batch_lxml(htmls: List[str]) -> List[Optional[CardFields]]:
+    try:
+        root = lxml_html.fragment_fromstring(_batch_document(htmls))
+    except Exception:
+        # лишний закрывающий тег закрыл пакетный документ раньше времени
+        root = None
+    cards = root.xpath("./div[@data-mygram-card]") if root is not None else []
+    if len(cards) != len(htmls):
+        # битая разметка склеила карточки — разбираем по одной
+        return [_parse_batch_lxml_single(h) for h in htmls]
+    return [_fields_lxml(card) for card in cards]
+
+
+def _parse_batch_lxml_single(outer_html: str) -> Optional[CardFields]:
+    try:
+        card = lxml_html.fragment_fromstring(outer_html, create_parent="div")
+    except Exception:
+        return None
+    return _fields_lxml(card)
+
+
+def _fields_lxml(card) -> Optional[CardFields]:
+    spans = card.xpath(".//span")
+
+    # 1) имя: span[title], иначе первый span с текстом
+    name_span = next((sp for sp in spans if sp.get("title") is not None), None)
+    if name_span is None:
+        name_span = next((sp for sp in spans if _lxml_text(sp)), None)
+    if name_span is None:
+        return None
+    username = (name_span.get("title") or "").strip() or _lxml_text(name_span)
+    if not username:
+        return None
+
+    # 2) превью: первый span без title с текстом
+    preview_text = next(
+        (txt for txt in (_lxml_text(sp) for sp in spans if sp.get("title") is None) if txt),
+        None,
+    )
+    if not preview_text:
+        return None
+
+    # 3) время — без него это не карточка чата
+    abbrs = card.xpath(".//abbr[@aria-label]")
+    if not abbrs:
+        return None
+
+    links = card.xpath(".//a[contains(@href, '/direct/t/')]")
+    return CardFields(
+        username=username,
+        preview_text=preview_text,
+        time_str=(abbrs[0].get("aria-label") or "").strip(),
+        thread_id=_thread_id_from_href(links[0].get("href")) if links else None,
+    )
+
+
+def _parse_batch_soup(htmls: List[str]) -> List[Optional[CardFields]]:
+    soup = BeautifulSoup(_batch_document(htmls), "html.parser")
+    cards = soup.select("div[data-mygram-card]")
+    if len(cards) != len(htmls):
+        cards = [BeautifulSoup(h, "html.parser") for h in htmls]
+    return [_fields_soup(card) for card in cards]
+
+
+def _fields_soup(card) -> Optional[CardFields]:
+    name_span = card.select_one("span[title]")
+    if name_span is None:
+        name_span = next(
+            (sp for sp in card.select("span") if (sp.get_text(strip=True) or "").strip()),
+            None,
+        )
+    if name_span is None:
+        return None
+    username = (name_span.get("title") or "").strip() or (name_span.get_text(strip=True) or "").strip()
+    if not username:
+        return None
+
+    preview_text = None
+    for sp in card.select("span"):
+        if sp.has_attr("title"):
+            continue
+        txt = (sp.get_text(strip=True) or "").strip()
+        if txt:
+            preview_text = txt
+            break
+    if not preview_text:
+        return None
+
+    abbr = card.select_one("abbr[aria-label]")
+    if abbr is None:
+        return None
+
+    link = card.select_one("a[href*='/direct/t/']")
+    return CardFields(
+        username=username,
+        preview_text=preview_text,
+        time_str=(abbr.get("aria-label") or "").strip(),
+        thread_id=_thread_id_from_href(link.get("href")) if link is not None else None,
+    )
+
+
+# name -> функция «список HTML карточек -> список CardFields/None»
+CARD_BACKENDS: Dict[str, Callable[[List[str]], List[Optional[CardFields]]]] = {
+    "html.parser": _parse_batch_soup,
+}
+if lxml_html is not None:
+    CARD_BACKENDS["lxml"] = _parse_batch_lxml
+
+
+def default_backend() -> str:
+    """
+    MYGRAM_HTML_BACKEND, если задан и доступен; иначе lxml, если установлен;
+    иначе html.parser.
+    """
+    wanted = os.getenv(HTML_BACKEND_ENV, "").strip()
+    if wanted in CARD_BACKENDS:
+        return wanted
+    if wanted:
+        print(f"[WARN] HTML-бэкенд {wanted!r} недоступен, использую запасной")
+    return "lxml" if "lxml" in CARD_BACKENDS else "html.parser"
+
+
+class ContactCardParser:
+    """
+    Пакетный разбор карточек диалогов в ContactSnapshot.
+
+    Все карточки раунда разбираются одним документом, а уже виденные
+    (по card_key) отбрасываются до парсинга — повторные раунды скролла
+    почти ничего не стоят.
+    """
+
+    def __init__(self, backend: Optional[str] = None) -> None:
+        self.backend = backend or default_backend()
+        if self.backend not in CARD_BACKENDS:
+            raise ValueError(f"Неизвестный HTML-бэкенд: {self.backend!r}")
+        self._parse_batch = CARD_BACKENDS[self.backend]
+        self.parsed = 0
+        self.skipped = 0
+
+    def parse_cards(
+        self,
+        htmls: Iterable[str],
+        scraped_at_utc: datetime,
+        seen_keys: Optional[Set[str]] = None,
+    ) -> List[ContactSnapshot]:
+        """
+        Разбирает outerHTML карточек. seen_keys пополняется ключами карточек,
+        которые разобрались; карточки с уже известными ключами пропускаются,
+        а неразобранные (недогруженная разметка, сбой парсера) будут разобраны
+        снова в следующем раунде.
+        """
+        fresh: List[str] = []
+        keys: List[str] = []
+        batch_keys: Set[str] = set()
+        for outer_html in htmls:
+            if not outer_html:
+                continue
+            if seen_keys is not None:
+                key = card_key(outer_html)
+                if key in seen_keys or key in batch_keys:
+                    self.skipped += 1
+                    continue
+                batch_keys.add(key)
+                keys.append(key)
+            fresh.append(outer_html)
+        if not fresh:
+            return []
+
+        try:
+            fields = self._parse_batch(fresh)
+        except Exception as e:
+            print("[ERROR] Не удалось распарсить карточки из HTML:", repr(e))
+            return []
+        self.parsed += len(fresh)
+        if seen_keys is not None:
+            seen_keys.update(key for key, f in zip(keys, fields) if f is not None)
+
+        return [
+            ContactSnapshot(
+                username=f.username,
+                full_name=None,  # пока не вытаскиваем отдельно
+                profile_url=None,
+                is_active=True,
+                last_message_preview=f.preview_text,
+                last_message_at_utc=None,  # time_str пока не парсим в datetime
+                scraped_at_utc=scraped_at_utc,
+                thread_id=f.thread_id,
+            )
+            for f in fields
+            if f is not None
+        ]
+
+    def parse_container(
+        self,
+        container_html: str,
+        scraped_at_utc: datetime,
+        card_selector: str = "div[role='button'][tabindex='0']",
+        seen_keys: Optional[Set[str]] = None,
+    ) -> List[ContactSnapshot]:
+        """
+        То же для HTML целого списка диалогов: карточки сначала вырезаются
+        по card_selector, потом идут в parse_cards.
+        """
+        return self.parse_cards(split_cards(container_html, card_selector), scraped_at_utc, seen_keys)
+
+
+def split_cards(container_html: str, card_selector: str = "div[role='button'][tabindex='0']") -> List[str]:
+    """
+    Вырезает outerHTML карточек из HTML контейнера (вложенные карточки не дублируются).
+    """
+    if lxml_html is not None and card_selector == "div[role='button'][tabindex='0']":
+        root = lxml_html.fragment_fromstring(container_html, create_parent="div")
+        cards = root.xpath(
+            ".//div[@role='button' and @tabindex='0']"
+            "[not(ancestor::div[@role='button' and @tabindex='0'])]"
+        )
+        return [lxml_html.tostring(c, encoding="unicode", with_tail=False) for c in cards]
+
+    soup = BeautifulSoup(container_html, "html.parser")
+    cards = soup.select(card_selector)
+    ids = {id(c) for c in cards}
+    top_level = [c for c in cards if not any(id(p) in ids for p in c.parents)]
+    return [str(c) for c in top_level]
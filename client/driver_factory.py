@@ -1,14 +1,80 @@
 # client/driver_factory.py
 
+import os
+import weakref
+from typing import Optional
+
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
+LEAN_ENV = "MYGRAM_LEAN_BROWSER"
+PROFILE_ENV = "MYGRAM_CHROME_PROFILE"
+
+# Что не нужно парсеру: картинки, видео/аудио, шрифты
+LEAN_BLOCKED_EXTENSIONS = [
+    "jpg", "jpeg", "png", "gif", "webp", "avif", "svg", "ico",
+    "mp4", "webm", "m4a", "mp3", "m4v",
+    "woff", "woff2", "ttf", "otf",
+]
+
+# Шаблон Network.setBlockedURLs должен совпасть со всем URL, а у файлов CDN
+# почти всегда есть query-строка (".jpg?stp=..."), поэтому на каждое
+# расширение два шаблона: без query и с ней
+LEAN_BLOCKED_URLS = [
+    pattern
+    for ext in LEAN_BLOCKED_EXTENSIONS
+    for pattern in (f"*.{ext}", f"*.{ext}?*")
+]
 
-def create_driver(headless: bool = False):
+# Драйверы с лёгким профилем: Network.setBlockedURLs действует только на
+# вкладку, в которой вызван, — новые вкладки блокируются заново (block_lean_resources)
+_LEAN_DRIVERS: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def lean_from_env() -> bool:
+    """
+    Лёгкий профиль можно включить на весь запуск через MYGRAM_LEAN_BROWSER=1.
+    """
+    return os.getenv(LEAN_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def profile_dir_from_env(worker_id: int = 0) -> Optional[str]:
+    """
+    Постоянный профиль Chrome (user-data-dir) из MYGRAM_CHROME_PROFILE.
+    Один профиль не может быть открыт двумя браузерами сразу, поэтому
+    воркеры пула (worker_id > 0) получают соседние папки <profile>-w<N>.
+    """
+    base = os.getenv(PROFILE_ENV, "").strip()
+    if not base:
+        return None
+    base = os.path.abspath(os.path.expanduser(base))
+    return base if worker_id == 0 else f"{base}-w{worker_id}"
+
+
+def create_driver(
+    headless: bool = False,
+    lean: Optional[bool] = None,
+    network_log: bool = False,
+    profile_dir: Optional[str] = None,
+):
     """
     Создаёт и конфигурирует Chrome WebDriver.
     :param headless: запуск без окна браузера.
+    :param lean: лёгкий профиль — без картинок, медиа и шрифтов и с eager-загрузкой
+                 страниц. Окно то же, что у обычного профиля: по геометрии вёрстки
+                 определяется отправитель (а он входит в msg_hash), так что лёгкий
+                 и обычный сбор одного чата должны давать одно и то же.
+                 None — взять из MYGRAM_LEAN_BROWSER.
+    :param network_log: включить performance-лог (сетевые события CDP) —
+                        нужен для extraction_mode="network" (client.network_capture).
+    :param profile_dir: постоянный user-data-dir — cookies, кэш и service worker'ы
+                        переживают перезапуск. None — взять из MYGRAM_CHROME_PROFILE
+                        (не задан — временный профиль, как раньше).
     """
+    if lean is None:
+        lean = lean_from_env()
+    if profile_dir is None:
+        profile_dir = profile_dir_from_env()
 
     chrome_options = Options()
 
@@ -18,11 +84,56 @@ def create_driver(headless: bool = False):
     chrome_options.add_argument("--disable-popup-blocking")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
 
     if headless:
         chrome_options.add_argument("--headless=new")
 
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+        chrome_options.add_argument("--profile-directory=Default")
+        # без «Восстановить страницы?» после аварийного завершения
+        chrome_options.add_argument("--hide-crash-restore-bubble")
+        chrome_options.add_argument("--no-first-run")
+
+    if network_log:
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    if lean:
+        # не ждём картинки/iframe'ы — парсеру хватает готового DOM
+        chrome_options.page_load_strategy = "eager"
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--autoplay-policy=user-gesture-required")
+        chrome_options.add_experimental_option(
+            "prefs",
+            {
+                "profile.managed_default_content_settings.images": 2,
+                "profile.managed_default_content_settings.media_stream": 2,
+            },
+        )
+
     driver = webdriver.Chrome(options=chrome_options)
+
+    if lean:
+        # шрифты и видео режем через CDP, картинки — ещё и настройками профиля выше
+        _LEAN_DRIVERS.add(driver)
+        block_lean_resources(driver)
     driver.maximize_window()
 
-    return driver
\ No newline at end of file
+    return driver
+
+
+def block_lean_resources(driver) -> None:
+    """
+    Включает блокировку LEAN_BLOCKED_URLS в текущей вкладке драйвера с лёгким
+    профилем (для обычного — ничего не делает). Вызывать после открытия каждой
+    новой вкладки: Network.setBlockedURLs действует только на свою вкладку.
+    """
+    if driver not in _LEAN_DRIVERS:
+        return
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+    except Exception as e:
+        print("[WARN] Не удалось включить блокировку ресурсов через CDP:", repr(e))
@@ -0,0 +1,278 @@
+# client/driver_supervisor.py
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, TypeVar
+
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
+
+from client.driver_factory import create_driver
+from client.selenium_direct import InstagramDirectClient
+
+try:
+    import psutil
+except ImportError:  # есть в requirements.txt; без него убиваем только chromedriver
+    psutil = None
+
+T = TypeVar("T")
+
+# Сообщения WebDriverException, после которых сессии точно нет
+_DEAD_SESSION_MARKERS = (
+    "invalid session id",
+    "no such session",
+    "session deleted",
+    "chrome not reachable",
+    "disconnected:",
+)
+
+
+class SupervisorGaveUp(RuntimeError):
+    """
+    Браузер перезапускался max_restarts раз — дальше продолжать бессмысленно.
+    """
+
+
+@dataclass
+class SupervisorStats:
+    restarts: int = 0
+    hangs: int = 0            # команды, прерванные watchdog'ом
+    crashes: int = 0          # сессия умерла сама
+    retries: int = 0          # повторы контакта после перезапуска
+    lost_seconds: float = 0.0  # от начала неудачной попытки до готового нового браузера
+
+
+class _Watchdog(threading.Thread):
+    """
+    Следит за текущей командой драйвера: если она выполняется дольше timeout,
+    вызывает on_hang (убить браузер) — заблокированный вызов тогда падает
+    с ошибкой соединения вместо вечного ожидания.
+    """
+
+    def __init__(self, timeout: float, on_hang: Callable[[str], None], poll: float = 1.0) -> None:
+        super().__init__(name="driver-watchdog", daemon=True)
+        self._timeout = timeout
+        self._on_hang = on_hang
+        self._poll = poll
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._command: Optional[str] = None
+        self._busy_since: Optional[float] = None
+        self.fired = False
+
+    def begin(self, command: str) -> None:
+        with self._lock:
+            self._command = command
+            self._busy_since = time.monotonic()
+
+    def end(self) -> None:
+        with self._lock:
+            self._command = None
+            self._busy_since = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._command = None
+            self._busy_since = None
+            self.fired = False
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        while not self._stop.wait(self._poll):
+            with self._lock:
+                hung = (
+                    not self.fired
+                    and self._busy_since is not None
+                    and time.monotonic() - self._busy_since > self._timeout
+                )
+                if hung:
+                    self.fired = True
+                    command = self._command or "?"
+            if hung:
+                self._on_hang(command)
+
+
+class DriverSupervisor:
+    """
+    Держит InstagramDirectClient живым в долгих прогонах.
+
+    - каждая команда драйвера идёт под watchdog'ом (command_timeout): зависший
+      chromedriver/Chrome убивается, и вызов падает, а не висит всю ночь;
+    - run(label, fn) выполняет fn(client); если после ошибки сессия мертва,
+      браузер пересоздаётся через driver_factory + client._open_direct()
+      (профиль Chrome / сохранённые cookies) и fn повторяется;
+    - ошибки при живой сессии (чат не открылся и т.п.) пробрасываются как есть;
+    - после max_restarts перезапусков — SupervisorGaveUp.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[object], InstagramDirectClient] = InstagramDirectClient,
+        driver_factory: Callable[[], object] = create_driver,
+        command_timeout: float = 120.0,
+        max_restarts: int = 5,
+        max_attempts: int = 2,
+        name: str = "driver",
+    ) -> None:
+        self._client_factory = client_factory
+        self._driver_factory = driver_factory
+        self._max_restarts = max_restarts
+        self._max_attempts = max(1, max_attempts)
+        self._name = name
+        self._driver = None
+        self._started = False
+        self.client: Optional[InstagramDirectClient] = None
+        self.stats = SupervisorStats()
+        self._watchdog = _Watchdog(command_timeout, self._on_hang)
+        self._watchdog.start()
+
+    # ---------- жизненный цикл ----------
+
+    def start(self) -> InstagramDirectClient:
+        """
+        Создаёт браузер и клиента и открывает Direct.
+        """
+        self._watchdog.reset()
+        self._started = True
+        driver = self._driver_factory()
+        self._instrument(driver)
+        self._driver = driver
+        self.client = self._client_factory(driver)
+        self.client._open_direct()
+        return self.client
+
+    def close(self) -> None:
+        self._teardown()
+        self._watchdog.stop()
+        print(f"[DEBUG] Супервизор {self._name}: {self.report()}")
+
+    def _instrument(self, driver) -> None:
+        # все команды (в том числе у WebElement'ов) проходят через driver.execute
+        original = driver.execute
+        watchdog = self._watchdog
+
+        def execute(driver_command, params=None):
+            watchdog.begin(driver_command)
+            try:
+                return original(driver_command, params)
+            finally:
+                watchdog.end()
+
+        driver.execute = execute
+
+    def _teardown(self) -> None:
+        client, driver = self.client, self._driver
+        self.client = None
+        self._driver = None
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+        if driver is not None:
+            self._kill(driver)
+
+    def _restart(self) -> None:
+        self._teardown()
+        while True:
+            if self.stats.restarts >= self._max_restarts:
+                raise SupervisorGaveUp(f"браузер перезапускался {self.stats.restarts} раз")
+            self.stats.restarts += 1
+            try:
+                self.start()
+                print(f"[INFO] Супервизор {self._name}: браузер перезапущен ({self.stats.restarts})")
+                return
+            except Exception as e:
+                print(f"[WARN] Супервизор {self._name}: не удалось запустить браузер: {e!r}")
+                self._teardown()
+
+    # ---------- выполнение ----------
+
+    def run(self, label: str, fn: Callable[[InstagramDirectClient], T]) -> T:
+        """
+        fn(client) с перезапуском браузера и повтором, если сессия умерла.
+        """
+        attempt = 0
+        while True:
+            if self.client is None:
+                if self._started:
+                    self._restart()
+                else:
+                    self.start()
+            attempt += 1
+            started = time.monotonic()
+            try:
+                return fn(self.client)
+            except Exception as e:
+                if not self._session_lost(e):
+                    raise
+                if self._watchdog.fired:
+                    self.stats.hangs += 1
+                    print(f"[WARN] {label}: команда драйвера зависла ({e!r}) — перезапускаю браузер")
+                else:
+                    self.stats.crashes += 1
+                    print(f"[WARN] {label}: сессия браузера потеряна ({e!r}) — перезапускаю браузер")
+                try:
+                    self._restart()
+                finally:
+                    self.stats.lost_seconds += time.monotonic() - started
+                if attempt >= self._max_attempts:
+                    raise
+                self.stats.retries += 1
+                print(f"[INFO] {label}: повтор {attempt + 1}/{self._max_attempts}")
+
+    def _session_lost(self, error: Exception) -> bool:
+        if self._watchdog.fired or isinstance(error, InvalidSessionIdException):
+            return True
+        if isinstance(error, WebDriverException):
+            message = (error.msg or "").lower()
+            if any(marker in message for marker in _DEAD_SESSION_MARKERS):
+                return True
+        # непонятная ошибка — спрашиваем сам браузер (тоже под watchdog'ом)
+        try:
+            self._driver.current_url
+            return False
+        except Exception:
+            return True
+
+    # ---------- watchdog ----------
+
+    def _on_hang(self, command: str) -> None:
+        print(f"[WARN] Супервизор {self._name}: команда {command} не ответила за отведённое время — убиваю браузер")
+        driver = self._driver
+        if driver is not None:
+            self._kill(driver)
+
+    @staticmethod
+    def _kill(driver) -> None:
+        """
+        Убивает chromedriver и все его дочерние процессы Chrome
+        (иначе осиротевший Chrome держит блокировку профиля).
+        """
+        process = getattr(getattr(driver, "service", None), "process", None)
+        if process is None or process.poll() is not None:
+            return
+        if psutil is None:
+            print("[WARN] psutil не установлен (pip install -r requirements.txt) — "
+                  "дочерние процессы Chrome могут остаться висеть")
+        else:
+            try:
+                for child in psutil.Process(process.pid).children(recursive=True):
+                    child.kill()
+            except psutil.Error:
+                pass
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+    def report(self) -> str:
+        s = self.stats
+        return (
+            f"перезапусков {s.restarts} (зависаний {s.hangs}, падений {s.crashes}), "
+            f"повторов {s.retries}, потеряно {s.lost_seconds:.0f} с"
+        )
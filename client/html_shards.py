@@ -0,0 +1,117 @@
+# client/html_shards.py
+
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# Шард — gzip-файл JSON-строк:
+#   1-я строка — заголовок {"kind": "chat"|"inbox", ...},
+#   дальше по строке на раунд {"round": N, "html": "..."},
+#   последняя — {"footer": {...}} (например, drop_keys после watermark).
+# Пока захват не завершён, файл лежит с суффиксом .part — недописанный
+# шард (упал браузер) парсер не подхватит.
+SHARD_SUFFIX = ".jsonl.gz"
+_PART_SUFFIX = ".part"
+
+_UNSAFE_RE = re.compile(r"[^\w.@-]+")
+
+
+def chat_shard_path(capture_dir: str, contact_username: str) -> str:
+    name = _UNSAFE_RE.sub("_", contact_username) or "_"
+    return os.path.join(capture_dir, "chats", name + SHARD_SUFFIX)
+
+
+def inbox_shard_path(capture_dir: str, scraped_at_utc: datetime) -> str:
+    return os.path.join(capture_dir, "inbox", scraped_at_utc.strftime("%Y%m%dT%H%M%S") + SHARD_SUFFIX)
+
+
+def list_shards(capture_dir: str) -> List[str]:
+    """
+    Все завершённые шарды в папке захвата (inbox первыми — контакты нужны раньше сообщений).
+    """
+    found: List[str] = []
+    for sub in ("inbox", "chats"):
+        directory = os.path.join(capture_dir, sub)
+        if not os.path.isdir(directory):
+            continue
+        found.extend(
+            os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith(SHARD_SUFFIX)
+        )
+    return found
+
+
+class ShardWriter:
+    """
+    Пишет HTML раундов одного чата/списка диалогов в сжатый шард.
+    Раунд с тем же HTML, что и предыдущий, не пишется.
+    """
+
+    def __init__(self, path: str, header: dict, compresslevel: int = 6) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = gzip.open(path + _PART_SUFFIX, "wt", encoding="utf-8", compresslevel=compresslevel)
+        self._write(header)
+        self._last_hash: Optional[int] = None
+        self.rounds = 0
+        self.bytes_raw = 0
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+
+    def write_round(self, html: str) -> bool:
+        """
+        Записывает HTML раунда. False — такой же HTML уже записан раундом раньше.
+        """
+        html_hash = hash(html)
+        if html_hash == self._last_hash:
+            return False
+        self._last_hash = html_hash
+        self._write({"round": self.rounds, "html": html})
+        self.rounds += 1
+        self.bytes_raw += len(html)
+        return True
+
+    def close(self, footer: Optional[dict] = None) -> str:
+        self._write({"footer": footer or {}})
+        self._file.close()
+        os.replace(self.path + _PART_SUFFIX, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        """
+        Закрывает файл, не публикуя шард.
+        """
+        try:
+            self._file.close()
+        finally:
+            try:
+                os.remove(self.path + _PART_SUFFIX)
+            except OSError:
+                pass
+
+
+def read_shard(path: str) -> Tuple[dict, List[str], dict]:
+    """
+    Читает шард целиком: (заголовок, HTML раундов по порядку, footer).
+    """
+    header: dict = {}
+    rounds: List[str] = []
+    footer: dict = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            record = json.loads(line)
+            if i == 0:
+                header = record
+            elif "footer" in record:
+                footer = record["footer"]
+            else:
+                rounds.append(record["html"])
+    return header, rounds, footer
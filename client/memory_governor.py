@@ -0,0 +1,181 @@
+# client/memory_governor.py
+
+from __future__ import annotations
+
+import pickle
+import tempfile
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+from core.models import MessageSnapshot
+
+# Схлопывает уже собранные bubble'ы ниже видимой области: содержимое удаляется,
+# высота фиксируется, чтобы не сбить позицию скролла.
+# arguments: container, keepPx (сколько px ниже экрана не трогаем),
+#            all (true — схлопывать любые bubble'ы, например в сетевом режиме).
+_JS_COLLAPSE_CAPTURED = """
+const container = arguments[0];
+const keepPx = arguments[1];
+const all = arguments[2];
+const crect = container.getBoundingClientRect();
+let collapsed = 0;
+for (const el of container.querySelectorAll("div[role='button']")) {
+    if (el.__mygramCollapsed || (!all && !el.__mygramCaptured)) {
+        continue;
+    }
+    const rect = el.getBoundingClientRect();
+    if (rect.top < crect.bottom + keepPx) {
+        continue;
+    }
+    el.style.height = rect.height + 'px';
+    el.style.overflow = 'hidden';
+    el.replaceChildren();
+    el.__mygramCollapsed = true;
+    collapsed++;
+}
+return {collapsed: collapsed, nodes: document.getElementsByTagName('*').length};
+"""
+
+
+class SnapshotSpool:
+    """
+    Дисковый буфер раундов сбора: держит в памяти только смещения чанков.
+    Чанки читаются обратно в обратном порядке — как того требует склейка
+    раундов от старых сообщений к новым.
+    """
+
+    def __init__(self) -> None:
+        self._file = tempfile.TemporaryFile()
+        self._offsets: List[int] = []
+        self.count = 0
+
+    def push(self, batches: List[List[Tuple[str, MessageSnapshot]]]) -> None:
+        self._offsets.append(self._file.seek(0, 2))
+        pickle.dump(batches, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += sum(len(b) for b in batches)
+
+    def iter_batches_reversed(self) -> Iterator[List[Tuple[str, MessageSnapshot]]]:
+        for offset in reversed(self._offsets):
+            self._file.seek(offset)
+            for batch in reversed(pickle.load(self._file)):
+                yield batch
+
+    def close(self) -> None:
+        self._file.close()
+
+
+@dataclass
+class GovernorStats:
+    samples: int = 0
+    peak_js_heap_mb: float = 0.0
+    peak_nodes: int = 0
+    collapses: int = 0
+    collapsed_bubbles: int = 0
+    spilled_messages: int = 0
+    peak_buffered: int = 0
+
+
+class MemoryGovernor:
+    """
+    Следит за памятью при сборе очень длинных чатов.
+
+    Браузер: раз в sample_every раундов читает CDP Performance.getMetrics
+    (JSHeapUsedSize, Nodes); если превышен max_nodes или max_js_heap_mb —
+    схлопывает уже собранные bubble'ы ниже экрана.
+
+    Python: если в памяти больше max_buffered собранных сообщений — старые
+    раунды уходят в SnapshotSpool на диске (fetch_messages_for_contact).
+    В потоковом сборе (state.streaming, stream_messages_for_contact) раунды
+    не выгружаются: ChatStreamStitcher сам отдаёт их в БД по ходу сбора и
+    spool не читает — в памяти остаётся только хвост, который ещё не готов
+    (например, длинная серия одинаковых сообщений).
+    """
+
+    def __init__(
+        self,
+        driver,
+        max_nodes: int = 15000,
+        max_js_heap_mb: float = 250.0,
+        max_buffered: int = 2000,
+        sample_every: int = 5,
+        keep_screens: float = 2.0,
+    ) -> None:
+        self._driver = driver
+        self._max_nodes = max_nodes
+        self._max_js_heap_mb = max_js_heap_mb
+        self._max_buffered = max_buffered
+        self._sample_every = max(1, sample_every)
+        self._keep_screens = keep_screens
+        self._metrics_enabled = False
+        self.stats = GovernorStats()
+
+    def metrics(self) -> dict:
+        """
+        CDP Performance.getMetrics как словарь name -> value.
+        """
+        if not self._metrics_enabled:
+            self._driver.execute_cdp_cmd("Performance.enable", {})
+            self._metrics_enabled = True
+        raw = self._driver.execute_cdp_cmd("Performance.getMetrics", {})
+        return {m["name"]: m["value"] for m in raw.get("metrics", [])}
+
+    def on_round(self, state) -> None:
+        """
+        Вызывается коллектором после каждого раунда (см. _chat_collect_round).
+        """
+        buffered = sum(len(b) for b in state.batches)
+        self.stats.peak_buffered = max(self.stats.peak_buffered, buffered)
+        if buffered > self._max_buffered and len(state.batches) > 1 and not state.streaming:
+            self._spill(state)
+
+        if state.rounds % self._sample_every:
+            return
+        try:
+            m = self.metrics()
+        except Exception as e:
+            print("[WARN] Не удалось получить Performance.getMetrics:", repr(e))
+            return
+
+        heap_mb = m.get("JSHeapUsedSize", 0) / (1024 * 1024)
+        nodes = int(m.get("Nodes", 0))
+        self.stats.samples += 1
+        self.stats.peak_js_heap_mb = max(self.stats.peak_js_heap_mb, heap_mb)
+        self.stats.peak_nodes = max(self.stats.peak_nodes, nodes)
+
+        if nodes > self._max_nodes or heap_mb > self._max_js_heap_mb:
+            self.collapse(state.chat_container, all_bubbles=(state.extraction_mode == "network"))
+
+    def collapse(self, container, all_bubbles: bool = False) -> int:
+        try:
+            client_height = self._driver.execute_script("return arguments[0].clientHeight;", container) or 0
+            result = self._driver.execute_script(
+                _JS_COLLAPSE_CAPTURED,
+                container,
+                int(client_height * self._keep_screens),
+                all_bubbles,
+            ) or {}
+        except Exception as e:
+            print("[WARN] Не удалось схлопнуть собранные bubble'ы:", repr(e))
+            return 0
+        collapsed = int(result.get("collapsed") or 0)
+        self.stats.collapses += 1
+        self.stats.collapsed_bubbles += collapsed
+        print(f"[MEM] Схлопнуто bubble'ов: {collapsed}, DOM-узлов теперь: {result.get('nodes')}")
+        return collapsed
+
+    def _spill(self, state) -> None:
+        # последний раунд оставляем в памяти — по нему ещё ищется watermark
+        to_spill = state.batches[:-1]
+        if state.spool is None:
+            state.spool = SnapshotSpool()
+        state.spool.push(to_spill)
+        state.batches = state.batches[-1:]
+        self.stats.spilled_messages += sum(len(b) for b in to_spill)
+
+    def report(self) -> str:
+        s = self.stats
+        return (
+            f"heap пик {s.peak_js_heap_mb:.0f} МБ, DOM-узлов пик {s.peak_nodes}, "
+            f"схлопнуто {s.collapsed_bubbles} за {s.collapses} раз, "
+            f"в буфере пик {s.peak_buffered}, выгружено на диск {s.spilled_messages}"
+        )
@@ -0,0 +1,260 @@
+# client/network_capture.py
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.models import MessageSnapshot
+
+# Запросы, в которых веб-клиент Instagram получает историю диалога
+THREAD_URL_MARKERS = (
+    "/api/v1/direct_v2/threads/",
+    "/api/graphql",
+    "/graphql/query",
+)
+
+# Типы item'ов, из которых берём текст
+_TEXT_ITEM_TYPES = ("text", "link")
+
+
+@dataclass
+class ThreadPage:
+    """
+    Одна страница истории диалога из JSON-ответа.
+    messages — пары (item_id, MessageSnapshot), от старых к новым.
+    """
+    thread_id: Optional[str]
+    messages: List[Tuple[str, MessageSnapshot]] = field(default_factory=list)
+    has_older: Optional[bool] = None
+
+
+def _parse_timestamp(raw) -> Optional[datetime]:
+    """
+    Instagram отдаёт timestamp в микросекундах (строкой или числом).
+    """
+    try:
+        value = int(raw)
+    except (TypeError, ValueError):
+        return None
+    # микросекунды / миллисекунды / секунды — по порядку величины
+    if value > 10**14:
+        value_s = value / 1_000_000
+    elif value > 10**11:
+        value_s = value / 1_000
+    else:
+        value_s = float(value)
+    return datetime.fromtimestamp(value_s, tz=timezone.utc)
+
+
+def _item_text(item: dict) -> Optional[str]:
+    item_type = item.get("item_type")
+    if item_type == "text":
+        return item.get("text")
+    if item_type == "link":
+        link = item.get("link") or {}
+        return link.get("text")
+    return None
+
+
+def _iter_threads(node) -> Iterator[dict]:
+    """
+    Ищет в произвольном JSON объекты-диалоги: словари со списком items,
+    элементы которого похожи на сообщения (item_id + timestamp).
+    """
+    if isinstance(node, dict):
+        items = node.get("items")
+        if (
+            isinstance(items, list)
+            and items
+            and isinstance(items[0], dict)
+            and "item_id" in items[0]
+            and "timestamp" in items[0]
+        ):
+            yield node
+            return
+        for value in node.values():
+            yield from _iter_threads(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _iter_threads(value)
+
+
+def _find_viewer_id(payload) -> Optional[str]:
+    if isinstance(payload, dict):
+        for key in ("viewer_id", "viewer"):
+            value = payload.get(key)
+            if isinstance(value, dict):
+                value = value.get("pk") or value.get("id")
+            if value is not None and not isinstance(value, (dict, list)):
+                return str(value)
+        for value in payload.values():
+            found = _find_viewer_id(value)
+            if found:
+                return found
+    elif isinstance(payload, list):
+        for value in payload:
+            found = _find_viewer_id(value)
+            if found:
+                return found
+    return None
+
+
+def decode_thread_payload(
+    payload: dict,
+    contact_username: str,
+    scraped_at_utc: datetime,
+) -> List[ThreadPage]:
+    """
+    Превращает JSON-ответ Direct в страницы ThreadPage с MessageSnapshot'ами.
+
+    Отправитель: 'self', если user_id совпадает с viewer_id, иначе 'peer';
+    в sender_id кладётся настоящий user_id. Нетекстовые item'ы пропускаются.
+    """
+    viewer_id = _find_viewer_id(payload)
+    pages: List[ThreadPage] = []
+
+    for thread in _iter_threads(payload):
+        thread_id = thread.get("thread_id")
+        page = ThreadPage(
+            thread_id=str(thread_id) if thread_id is not None else None,
+            has_older=thread.get("has_older"),
+        )
+        for item in thread.get("items") or []:
+            text = (_item_text(item) or "").strip()
+            if not text:
+                continue
+            sender_id = item.get("user_id")
+            sender_id = str(sender_id) if sender_id is not None else None
+            if sender_id is None or viewer_id is None:
+                sender = "unknown"
+            else:
+                sender = "self" if sender_id == viewer_id else "peer"
+            page.messages.append(
+                (
+                    str(item.get("item_id")),
+                    MessageSnapshot(
+                        contact_username=contact_username,
+                        sender=sender,
+                        text=text,
+                        timestamp_utc=_parse_timestamp(item.get("timestamp")),
+                        scraped_at_utc=scraped_at_utc,
+                        sender_id=sender_id,
+                    ),
+                )
+            )
+        # в ответе новые сообщения идут первыми
+        page.messages.sort(
+            key=lambda pair: pair[1].timestamp_utc or datetime.min.replace(tzinfo=timezone.utc)
+        )
+        pages.append(page)
+
+    return pages
+
+
+class NetworkCapture:
+    """
+    Читает JSON-ответы Direct прямо из сети браузера, минуя DOM.
+
+    Нужен драйвер с включённым performance-логом (create_driver(network_log=True)):
+    из лога берём Network.responseReceived / Network.loadingFinished для запросов
+    истории, а тело забираем через CDP Network.getResponseBody.
+
+    record_dir — если задан, каждый разобранный ответ сохраняется как
+    <record_dir>/<thread_id>/page_NNN.json (для стенда client.stub_direct_server).
+    """
+
+    def __init__(self, driver, record_dir: Optional[str] = None) -> None:
+        self._driver = driver
+        self._record_dir = record_dir
+        self._pending: Dict[str, str] = {}   # requestId -> url, ждём loadingFinished
+        self._recorded: Dict[str, int] = {}
+        self._enabled = False
+
+    def enable(self) -> None:
+        if self._enabled:
+            return
+        self._driver.execute_cdp_cmd("Network.enable", {})
+        self._enabled = True
+
+    def drain_payloads(self) -> List[dict]:
+        """
+        Забирает из performance-лога все готовые JSON-ответы с историей диалогов.
+        """
+        self.enable()
+        finished: List[str] = []
+        for entry in self._driver.get_log("performance"):
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            method = message.get("method")
+            params = message.get("params") or {}
+            if method == "Network.responseReceived":
+                response = params.get("response") or {}
+                url = response.get("url") or ""
+                if any(marker in url for marker in THREAD_URL_MARKERS):
+                    self._pending[params.get("requestId")] = url
+            elif method == "Network.loadingFinished":
+                if params.get("requestId") in self._pending:
+                    finished.append(params["requestId"])
+
+        payloads: List[dict] = []
+        for request_id in finished:
+            self._pending.pop(request_id, None)
+            try:
+                body = self._driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+            except Exception:
+                # тело уже выгружено из буфера браузера
+                continue
+            text = body.get("body") or ""
+            if body.get("base64Encoded"):
+                continue
+            # GraphQL иногда отдаёт префикс for (;;); или несколько JSON построчно
+            text = text.replace("for (;;);", "", 1).strip()
+            try:
+                payloads.append(json.loads(text))
+                continue
+            except ValueError:
+                pass
+            for chunk in text.splitlines():
+                chunk = chunk.strip()
+                if not chunk:
+                    continue
+                try:
+                    payloads.append(json.loads(chunk))
+                except ValueError:
+                    continue
+        return payloads
+
+    def drain_thread_pages(
+        self,
+        contact_username: str,
+        scraped_at_utc: datetime,
+        thread_id: Optional[str] = None,
+    ) -> List[ThreadPage]:
+        """
+        Декодирует свежие ответы в ThreadPage. Если thread_id известен —
+        отбрасывает страницы чужих диалогов (например, предыдущего чата).
+        """
+        pages: List[ThreadPage] = []
+        for payload in self.drain_payloads():
+            for page in decode_thread_payload(payload, contact_username, scraped_at_utc):
+                if thread_id and page.thread_id and page.thread_id != thread_id:
+                    continue
+                self._record(page.thread_id, payload)
+                pages.append(page)
+        return pages
+
+    def _record(self, thread_id: Optional[str], payload: dict) -> None:
+        if not self._record_dir or not thread_id:
+            return
+        directory = os.path.join(self._record_dir, thread_id)
+        os.makedirs(directory, exist_ok=True)
+        index = self._recorded.get(thread_id, 0)
+        self._recorded[thread_id] = index + 1
+        with open(os.path.join(directory, f"page_{index:03d}.json"), "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
@@ -0,0 +1,195 @@
+# client/parse_shards.py
+#
+# Офлайн-стадия режима захвата: разбирает шарды HTML (capture_contacts /
+# capture_messages_for_contact) в ContactSnapshot / MessageSnapshot
+# в нескольких процессах и загружает результат в БД. Браузер не нужен —
+# после правки селекторов достаточно перезапустить этот скрипт.
+#
+#     python -m client.parse_shards captures/2026-10-17 --workers 4
+#     python -m client.parse_shards captures/2026-10-17 --dry-run
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from bs4 import BeautifulSoup, Comment, NavigableString
+
+from client.contact_card_parser import ContactCardParser
+from client.html_shards import list_shards, read_shard
+from client.chat_stitcher import iter_chronological
+from client.selenium_direct import BUBBLE_CSS_SELECTORS, THREAD_CARD_SELECTOR
+from core.models import MessageSnapshot
+from db.contact_repository import ContactRepository
+from db.message_repository import MessageRepository
+
+# (путь, вид шарда, заголовок, снимки)
+ShardResult = Tuple[str, str, dict, list]
+
+
+def _parse_time(raw: Optional[str]) -> datetime:
+    if raw:
+        try:
+            return datetime.fromisoformat(raw)
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+
+def _has_own_text(tag) -> bool:
+    return any(
+        isinstance(child, NavigableString) and not isinstance(child, Comment) and child.strip()
+        for child in tag.children
+    )
+
+
+def extract_bubbles_html(html: str) -> List[dict]:
+    """
+    Офлайн-аналог _JS_EXTRACT_BUBBLES: bubble'ы из HTML контейнера чата
+    в порядке документа (= сверху вниз) как {key, text, sender}.
+    Ключ и отправитель берутся из пометок data-mygram-*, сделанных при захвате;
+    у непомеченных bubble'ов (селекторы тогда не совпали) ключ — хэш HTML,
+    отправитель — 'unknown'.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    matched = {id(el) for el in soup.select(", ".join(BUBBLE_CSS_SELECTORS))}
+
+    items: List[dict] = []
+    for el in soup.select("div[role='button']"):
+        if id(el) not in matched and not any(_has_own_text(d) for d in el.select("div[dir='auto']")):
+            continue
+
+        text_node = next((n for n in el.select("[dir='auto']") if _has_own_text(n)), None)
+        if text_node is None:
+            continue
+
+        key = el.get("data-mygram-key")
+        if not key:
+            key = "h:" + hashlib.blake2b(str(el).encode("utf-8"), digest_size=12).hexdigest()
+        items.append(
+            {
+                "key": key,
+                "text": text_node.get_text().strip(),
+                "sender": el.get("data-mygram-sender") or "unknown",
+            }
+        )
+    return items
+
+
+def parse_chat_shard(path: str, header: dict, rounds: List[str], footer: dict) -> ShardResult:
+    username = header.get("contact_username") or ""
+    scraped_at = _parse_time(header.get("scraped_at_utc"))
+
+    seen_keys: set[str] = set()
+    batches: list[list[tuple[str, MessageSnapshot]]] = []
+    for html in rounds:
+        batch: list[tuple[str, MessageSnapshot]] = []
+        for item in extract_bubbles_html(html):
+            if item["key"] in seen_keys:
+                continue
+            seen_keys.add(item["key"])
+            if not item["text"]:
+                continue
+            batch.append(
+                (
+                    item["key"],
+                    MessageSnapshot(
+                        contact_username=username,
+                        sender=item["sender"],
+                        text=item["text"],
+                        timestamp_utc=None,
+                        scraped_at_utc=scraped_at,
+                    ),
+                )
+            )
+        batches.append(batch)
+
+    # в шардах старых версий флага нет — разбираем, как раньше
+    messages = list(iter_chronological(
+        batches,
+        set(footer.get("drop_keys") or []),
+        reached_start=footer.get("reached_start", True),
+    ))
+    return path, "chat", header, messages
+
+
+def parse_inbox_shard(path: str, header: dict, rounds: List[str]) -> ShardResult:
+    scraped_at = _parse_time(header.get("scraped_at_utc"))
+    parser = ContactCardParser()
+    seen_cards: set[str] = set()
+    seen_usernames: set[str] = set()
+
+    contacts = []
+    for html in rounds:
+        for snapshot in parser.parse_container(html, scraped_at, THREAD_CARD_SELECTOR, seen_cards):
+            if snapshot.username in seen_usernames:
+                continue
+            seen_usernames.add(snapshot.username)
+            contacts.append(snapshot)
+    return path, "inbox", header, contacts
+
+
+def parse_shard(path: str) -> ShardResult:
+    """
+    Точка входа воркера ProcessPoolExecutor: вид шарда — по заголовку.
+    """
+    header, rounds, footer = read_shard(path)
+    if header.get("kind") == "inbox":
+        return parse_inbox_shard(path, header, rounds)
+    return parse_chat_shard(path, header, rounds, footer)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Разбор шардов HTML из режима захвата и загрузка в БД")
+    parser.add_argument("capture_dir", help="папка захвата (inbox/ и chats/)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="процессов для разбора")
+    parser.add_argument("--dry-run", action="store_true", help="только разобрать, в БД не писать")
+    args = parser.parse_args(argv)
+
+    shards = list_shards(args.capture_dir)
+    if not shards:
+        print(f"[WARN] В {args.capture_dir} нет готовых шардов")
+        return
+    print(f"[INFO] Шардов: {len(shards)}, процессов: {args.workers}")
+
+    contacts_repo = ContactRepository()
+    messages_repo = MessageRepository()
+    started = time.perf_counter()
+    results: List[ShardResult] = []
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(parse_shard, path): path for path in shards}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"[ERROR] Не удалось разобрать {futures[future]}: {e!r}")
+
+    print(f"[INFO] Разбор занял {time.perf_counter() - started:.1f} с")
+
+    # контакты раньше сообщений: для чатов проставляется thread_id
+    results.sort(key=lambda r: r[1] != "inbox")
+    for path, kind, header, snapshots in results:
+        if kind == "inbox":
+            saved = ""
+            if not args.dry_run and snapshots:
+                saved = f" ({contacts_repo.bulk_upsert(snapshots)})"
+            print(f"[OK] {path}: контактов {len(snapshots)}{saved}")
+            continue
+
+        username = header.get("contact_username")
+        inserted = 0
+        if not args.dry_run:
+            if header.get("thread_id"):
+                contacts_repo.set_thread_id(username, header["thread_id"])
+            inserted = messages_repo.bulk_insert(snapshots) if snapshots else 0
+        print(f"[OK] {username}: сообщений {len(snapshots)}, сохранено {inserted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,476 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import List, Optional
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.remote.webdriver import WebDriver
 
-from bs4 import BeautifulSoup
-
+import re
 import time
 
-from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, NoSuchElementException
+from selenium.common.exceptions import (
+    InvalidSessionIdException,
+    NoSuchElementException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-from core.models import ContactSnapshot, MessageSnapshot
+from client.chat_stitcher import ChatStreamStitcher, iter_chronological
+from client.contact_card_parser import ContactCardParser
+from client.driver_factory import block_lean_resources
+from client.html_shards import ShardWriter, chat_shard_path, inbox_shard_path
+from client.memory_governor import MemoryGovernor, SnapshotSpool
+from client.network_capture import NetworkCapture
+from core.models import ContactSnapshot, MessageBatch, MessageSnapshot
+from services.locator import LocatorService, LocatorTarget
+from services.selector_registry import SelectorRegistry, SelectorStrategy
+from services.session_manager import SessionManager
+from services.scroll_engine import ScrollEngine
+
+
+# Известные шаблоны bubble'ов (английский + локализованные aria-label)
+BUBBLE_CSS_SELECTORS = [
+    "div[role='button'][aria-label*='Double tap to like']",
+    "div[role='button'][aria-label*='Дважды коснитесь']",
+    "div[role='button'][aria-label*='Дважды нажмите']",
+]
+
+BUBBLE_SELECTOR = ", ".join(BUBBLE_CSS_SELECTORS)
+
+# Карточки диалогов в списке Direct
+THREAD_CARD_SELECTOR = "div[role='button'][tabindex='0']"
+
+# Стратегии поиска для SelectorRegistry. Имена стабильны — по ним
+# между запусками копится статистика (selector_stats.json).
+BUBBLE_STRATEGIES = [
+    SelectorStrategy("aria_en", By.CSS_SELECTOR, BUBBLE_CSS_SELECTORS[0]),
+    SelectorStrategy("aria_ru_touch", By.CSS_SELECTOR, BUBBLE_CSS_SELECTORS[1]),
+    SelectorStrategy("aria_ru_press", By.CSS_SELECTOR, BUBBLE_CSS_SELECTORS[2]),
+    # общий fallback: div[role='button'] с непустым div[dir='auto'] внутри
+    SelectorStrategy(
+        "generic_text",
+        By.XPATH,
+        ".//div[@role='button' and .//div[@dir='auto' and normalize-space(text())!='']]",
+    ),
+]
+CARD_STRATEGIES = [
+    SelectorStrategy("button_card", By.CSS_SELECTOR, THREAD_CARD_SELECTOR),
+    SelectorStrategy("thread_link", By.CSS_SELECTOR, "a[href*='/direct/t/']"),
+]
+
+# /direct/t/<thread_id>/ — адрес конкретного диалога
+_THREAD_URL_RE = re.compile(r"/direct/t/([^/?#]+)")
+
+# Сколько секунд подряд без движения и без новых bubble'ов терпим в чате
+NO_PROGRESS_PATIENCE = 15.0
+
+# Лимит раундов сбора без max_scrolls, когда весь чат копится в памяти.
+# С MemoryGovernor и в потоковом сборе лимита нет — листаем до начала чата.
+FULL_HISTORY_MAX_ROUNDS = 200
+
+
+
+class ChatNotOpened(RuntimeError):
+    """
+    Диалог с контактом открыть не удалось: на экране может быть чужой чат,
+    собирать его нельзя.
+    """
+
+
+# Заголовки h6, по которым Instagram помечает наши собственные сообщения
+SELF_SENDER_PREFIXES = ("Вы отправили", "You sent")
+
+# Общие JS-функции для распознавания и сериализации bubble'ов.
+# Ожидают в области видимости: container, selectors, selfPrefixes.
+_JS_BUBBLE_HELPERS = """
+function hasOwnText(node) {
+    for (const child of node.childNodes) {
+        if (child.nodeType === 3 && child.textContent.trim() !== '') {
+            return true;
+        }
+    }
+    return false;
+}
+
+// Короткий ключ DOM-узла bubble'а: выдаётся при первой встрече и хранится
+// в expando-свойстве — не зависит ни от атрибутов, которые React меняет,
+// ни от текста (повторяющиеся "ок" остаются разными bubble'ами).
+function nodeKey(bubble) {
+    if (!bubble.__mygramKey) {
+        window.__mygramNextKey = (window.__mygramNextKey || 0) + 1;
+        bubble.__mygramKey = 'n' + window.__mygramNextKey.toString(36);
+    }
+    return bubble.__mygramKey;
+}
+
+function isBubble(el) {
+    if (!el || el.nodeType !== 1 || !el.matches("div[role='button']")) {
+        return false;
+    }
+    for (const sel of selectors) {
+        if (el.matches(sel)) {
+            return true;
+        }
+    }
+    // общий fallback: div[role='button'] с непустым div[dir='auto'] внутри
+    for (const d of el.querySelectorAll("div[dir='auto']")) {
+        if (hasOwnText(d)) {
+            return true;
+        }
+    }
+    return false;
+}
+
+function collectBubbles(root, out) {
+    if (isBubble(root)) {
+        out.add(root);
+    }
+    for (const el of root.querySelectorAll("div[role='button']")) {
+        if (isBubble(el)) {
+            out.add(el);
+        }
+    }
+    return out;
+}
+
+// Строка ленты, в которой лежит bubble: ближайший предок почти во всю ширину
+// контейнера (не выше 10 уровней).
+function rowOf(bubble, minWidth) {
+    let el = bubble;
+    for (let depth = 0; el && el !== container && depth < 10; depth++) {
+        if (el.getBoundingClientRect().width >= minWidth) {
+            return el;
+        }
+        el = el.parentElement;
+    }
+    return null;
+}
+
+// Отправитель для всей пачки bubble'ов за один проход по layout:
+//   - выравнивание: центр bubble'а правее центра контейнера — 'self', левее — 'peer';
+//   - аватар (img) слева от bubble'а в той же строке — 'peer';
+//   - h6 "Вы отправили" / "You sent" в строке — подсказка 'self'.
+// Голоса сходятся — их ответ; противоречат друг другу или голосов нет — 'unknown'.
+// Возвращает Map bubble -> 'self' | 'peer' | 'unknown'.
+function classifySenders(bubbles) {
+    const result = new Map();
+    if (!bubbles.length) {
+        return result;
+    }
+    const crect = container.getBoundingClientRect();
+    const width = container.clientWidth || crect.width;
+    const center = crect.left + width / 2;
+    const margin = width * 0.05;
+
+    // строки с заголовком "своих" сообщений — один querySelectorAll на пачку
+    const selfRows = new Set();
+    for (const h6 of container.querySelectorAll('h6')) {
+        const txt = (h6.textContent || '').trim();
+        if (selfPrefixes.some((p) => txt.startsWith(p))) {
+            const row = rowOf(h6, width * 0.9);
+            if (row) {
+                selfRows.add(row);
+            }
+        }
+    }
+
+    for (const bubble of bubbles) {
+        const rect = bubble.getBoundingClientRect();
+        const votes = new Set();
+
+        // bubble почти во всю ширину — выравнивание ничего не говорит
+        if (rect.width < width * 0.85) {
+            const mid = rect.left + rect.width / 2;
+            if (mid > center + margin) {
+                votes.add('self');
+            } else if (mid < center - margin) {
+                votes.add('peer');
+            }
+        }
+
+        const row = rowOf(bubble, width * 0.9);
+        if (row) {
+            for (const img of row.querySelectorAll('img')) {
+                if (bubble.contains(img)) {
+                    continue;
+                }
+                // картинка может не загрузиться (лёгкий профиль режет картинки) и
+                // схлопнуться в 0 px — тогда берём рамку аватара, размер которой задан вёрсткой
+                let irect = img.getBoundingClientRect();
+                if (irect.width === 0 && img.parentElement && !img.parentElement.contains(bubble)) {
+                    irect = img.parentElement.getBoundingClientRect();
+                }
+                if (irect.width > 0 && irect.right <= rect.left && irect.bottom > rect.top - 8) {
+                    votes.add('peer');
+                    break;
+                }
+            }
+            if (selfRows.has(row)) {
+                votes.add('self');
+            }
+        }
+
+        result.set(bubble, votes.size === 1 ? votes.values().next().value : 'unknown');
+    }
+    return result;
+}
+
+// {key, text, sender, top} или null, если в bubble нет текста;
+// sender заранее посчитан classifySenders для всей пачки
+function serializeBubble(bubble, sender) {
+    let textNode = null;
+    for (const n of bubble.querySelectorAll("[dir='auto']")) {
+        if (hasOwnText(n)) {
+            textNode = n;
+            break;
+        }
+    }
+    if (!textNode) {
+        return null;
+    }
+    const rect = bubble.getBoundingClientRect();
+    const crect = container.getBoundingClientRect();
+    // метка вне outerHTML: собранный bubble можно схлопнуть (MemoryGovernor)
+    bubble.__mygramCaptured = true;
+    return {
+        key: nodeKey(bubble),
+        text: (textNode.innerText || '').trim(),
+        sender: sender || 'unknown',
+        top: Math.round(rect.top - crect.top + container.scrollTop),
+    };
+}
+"""
+
+# Извлекает все bubble'ы внутри контейнера чата за один round trip.
+# arguments[0] — контейнер чата, arguments[1] — CSS-селекторы bubble'ов,
+# arguments[2] — префиксы h6 для "своих" сообщений.
+# Возвращает массив {key, text, sender, top}, отсортированный по вертикали.
+_JS_EXTRACT_BUBBLES = """
+const container = arguments[0];
+const selectors = arguments[1];
+const selfPrefixes = arguments[2];
+""" + _JS_BUBBLE_HELPERS + """
+const result = [];
+const bubbles = Array.from(collectBubbles(container, new Set()));
+const senders = classifySenders(bubbles);
+for (const bubble of bubbles) {
+    const item = serializeBubble(bubble, senders.get(bubble));
+    if (item) {
+        result.push(item);
+    }
+}
+result.sort((a, b) => a.top - b.top);
+return result;
+"""
+
+# Вешает MutationObserver на контейнер чата. Новые bubble'ы сериализуются
+# прямо в странице и копятся в container.__mygramCapture.buffer.
+# Аргументы те же, что у _JS_EXTRACT_BUBBLES. Уже существующие bubble'ы
+# сразу кладутся в буфер, так что первый drain вернёт текущий экран.
+_JS_INSTALL_BUBBLE_OBSERVER = """
+const container = arguments[0];
+const selectors = arguments[1];
+const selfPrefixes = arguments[2];
+if (container.__mygramCapture) {
+    return true;
+}
+""" + _JS_BUBBLE_HELPERS + """
+const state = {buffer: [], keys: new Set(), observer: null};
+
+function push(bubbleSet) {
+    const bubbles = Array.from(bubbleSet);
+    const senders = classifySenders(bubbles);
+    for (const bubble of bubbles) {
+        const item = serializeBubble(bubble, senders.get(bubble));
+        if (!item || state.keys.has(item.key)) {
+            continue;
+        }
+        state.keys.add(item.key);
+        state.buffer.push(item);
+    }
+}
+
+state.observer = new MutationObserver((mutations) => {
+    const touched = new Set();
+    for (const m of mutations) {
+        // текст мог дорисоваться внутрь уже вставленного bubble
+        const target = m.target.nodeType === 1 ? m.target : m.target.parentElement;
+        const owner = target ? target.closest("div[role='button']") : null;
+        if (owner && container.contains(owner) && isBubble(owner)) {
+            touched.add(owner);
+        }
+        for (const node of m.addedNodes) {
+            if (node.nodeType === 1) {
+                collectBubbles(node, touched);
+            }
+        }
+    }
+    push(touched);
+});
+state.observer.observe(container, {childList: true, subtree: true, characterData: true});
+container.__mygramCapture = state;
+push(collectBubbles(container, new Set()));
+return true;
+"""
+
+# Забирает накопленный буфер. null — observer на этом контейнере не установлен.
+_JS_DRAIN_BUBBLE_OBSERVER = """
+const state = arguments[0].__mygramCapture;
+if (!state) {
+    return null;
+}
+const items = state.buffer;
+state.buffer = [];
+return items;
+"""
+
+# Ищет в контейнере чата последнее вхождение watermark — подряд идущих текстов
+# уже сохранённых сообщений. arguments[3] — тексты watermark (от старых к новым).
+# Возвращает ключи всех bubble'ов до конца watermark включительно
+# (то, что уже есть в БД) или null, если watermark на экране нет.
+_JS_FIND_WATERMARK = """
+const container = arguments[0];
+const selectors = arguments[1];
+const selfPrefixes = arguments[2];
+const watermark = arguments[3];
+""" + _JS_BUBBLE_HELPERS + """
+const items = [];
+for (const bubble of collectBubbles(container, new Set())) {
+    // отправитель для сравнения с watermark не нужен
+    const item = serializeBubble(bubble, null);
+    if (item) {
+        items.push(item);
+    }
+}
+items.sort((a, b) => a.top - b.top);
+
+const n = watermark.length;
+for (let end = items.length - 1; end >= n - 1; end--) {
+    let match = true;
+    for (let j = 0; j < n; j++) {
+        if (items[end - n + 1 + j].text !== watermark[j]) {
+            match = false;
+            break;
+        }
+    }
+    if (match) {
+        return items.slice(0, end + 1).map((it) => it.key);
+    }
+}
+return null;
+"""
+
+# Отправители для списка WebElement'ов bubble'ов (путь extraction_mode="elements").
+# arguments[0] — контейнер чата, arguments[1] — bubble'ы, arguments[2] — префиксы h6.
+_JS_CLASSIFY_SENDERS = """
+const container = arguments[0];
+const bubbles = arguments[1];
+const selfPrefixes = arguments[2];
+const selectors = [];
+""" + _JS_BUBBLE_HELPERS + """
+const senders = classifySenders(bubbles);
+return bubbles.map((b) => senders.get(b));
+"""
+
+# Режим захвата: помечает bubble'ы ключом узла и отправителем (data-mygram-*),
+# чтобы офлайн-парсер (client.parse_shards) мог склеить раунды без браузера,
+# и отдаёт HTML контейнера целиком. Аргументы те же, что у _JS_EXTRACT_BUBBLES.
+# Возвращает {html, fresh} — fresh: сколько bubble'ов встретилось впервые.
+_JS_CAPTURE_CHAT_HTML = """
+const container = arguments[0];
+const selectors = arguments[1];
+const selfPrefixes = arguments[2];
+""" + _JS_BUBBLE_HELPERS + """
+const bubbles = Array.from(collectBubbles(container, new Set()));
+const senders = classifySenders(bubbles);
+let fresh = 0;
+for (const bubble of bubbles) {
+    if (!bubble.__mygramKey) {
+        fresh++;
+    }
+    bubble.setAttribute('data-mygram-key', nodeKey(bubble));
+    bubble.setAttribute('data-mygram-sender', senders.get(bubble));
+}
+return {html: container.outerHTML, fresh: fresh};
+"""
+
+# Ключи nodeKey для списка WebElement'ов bubble'ов (путь extraction_mode="elements").
+_JS_NODE_KEYS = """
+const container = null;
+const selectors = [];
+const selfPrefixes = [];
+""" + _JS_BUBBLE_HELPERS + """
+return arguments[0].map(nodeKey);
+"""
+
+_JS_DISCONNECT_BUBBLE_OBSERVER = """
+const state = arguments[0].__mygramCapture;
+if (state) {
+    state.observer.disconnect();
+    delete arguments[0].__mygramCapture;
+}
+"""
+
+
+def extract_thread_id(url: Optional[str]) -> Optional[str]:
+    """
+    Достаёт id диалога из ссылки вида /direct/t/<id>/ (относительной или полной).
+    """
+    if not url:
+        return None
+    match = _THREAD_URL_RE.search(url)
+    return match.group(1) if match else None
+
+
+@dataclass
+class _ChatCollectState:
+    """
+    Состояние сбора сообщений одного открытого чата между раундами
+    (см. _chat_collect_round). Позволяет вести несколько чатов по очереди.
+    """
+    contact_username: str
+    chat_container: object
+    extraction_mode: str
+    stop_at_text: Optional[str]
+    watermark: Optional[List[str]]
+    max_rounds: Optional[int]    # None — до начала чата / пока есть прогресс
+    scraped_at: datetime
+
+    # раунды (ключ bubble'а, snapshot) — ключ нужен, чтобы отрезать уже сохранённое
+    batches: list[list[tuple[str, MessageSnapshot]]] = field(default_factory=list)
+    drop_keys: set[str] = field(default_factory=set)
+    seen_keys: set[str] = field(default_factory=set)    # короткие ключи узлов (nodeKey) / item_id
+    # раунды, выгруженные MemoryGovernor'ом на диск
+    spool: Optional[SnapshotSpool] = None
+    # раунды забирает ChatStreamStitcher: spool он не читает, выгружать нельзя
+    streaming: bool = False
+    # extraction_mode="capture": HTML раундов пишется сюда, без разбора
+    shard: Optional[ShardWriter] = None
+
+    rounds: int = 0
+    no_progress_wait: float = 0.0
+    top_header_rounds: int = 0
+    done: bool = False
+
+    # дошли до начала чата: у самых старых собранных сообщений полный контекст msg_hash
+    reached_start: bool = False
+
+    # сетевой режим: id открытого диалога и раунды без единого JSON-ответа
+    thread_id: Optional[str] = None
+    network_empty_rounds: int = 0
+
+    # для скролла без ожидания (wait=False): что вернул прошлый nudge и когда
+    last_nudge: Optional[dict] = None
+    last_nudge_at: Optional[float] = None
+
 
 class InstagramDirectClient:
     def __init__(
@@ -26,33 +479,61 @@ class InstagramDirectClient:
         driver: WebDriver,
         base_url: str = "https://www.instagram.com",
         wait_timeout: int = 20,
+        scroll_engine: Optional[ScrollEngine] = None,
+        network_capture: Optional[NetworkCapture] = None,
+        memory_governor: Optional[MemoryGovernor] = None,
+        session: Optional[SessionManager] = None,
     ) -> None:
         self._driver = driver
         self._base_url = base_url.rstrip("/")
+        # вход: живой профиль Chrome -> cookies из файла -> ручной логин
+        self._session = session or SessionManager(driver, self._base_url)
         self._wait = WebDriverWait(self._driver, wait_timeout)
+        self._scroller = scroll_engine or ScrollEngine(driver)
+        # создаётся при первом extraction_mode="network"
+        self._network = network_capture
+        self._card_parser = ContactCardParser()
+        # контейнеры списка диалогов / чата и рабочие селекторы bubble'ов
+        self._locator = LocatorService(
+            driver,
+            {
+                "inbox": LocatorTarget(THREAD_CARD_SELECTOR, thumb_fallback=True),
+                "chat": LocatorTarget(BUBBLE_SELECTOR),
+            },
+        )
+        # какие селекторы bubble'ов / карточек срабатывают на этом аккаунте
+        self._selectors = SelectorRegistry(driver, {"bubble": BUBBLE_STRATEGIES, "card": CARD_STRATEGIES})
+        # для очень длинных чатов: CDP-метрики, схлопывание DOM, выгрузка на диск
+        self._governor = memory_governor
+        # username -> thread_id, всё, что узнали за сессию (карточки, URL открытых чатов)
+        self._thread_ids: Dict[str, str] = {}
+        # username -> сколько раундов скролла понадобилось на последний сбор чата
+        self._scroll_depths: Dict[str, int] = {}
+        # username -> дошёл ли последний сбор чата до его начала
+        self._reached_start: Dict[str, bool] = {}
+
+    def thread_id_for(self, username: str) -> Optional[str]:
+        """
+        Возвращает id диалога, если он стал известен в этой сессии.
+        None — id не узнали (в том числе когда чат не открылся по сбою):
+        это не повод стирать id, сохранённый в БД.
+        """
+        return self._thread_ids.get(username)
 
-    def _load_cookies_if_exist(self, path: str = "cookies.json") -> bool:
-        import os, json
-        if not os.path.exists(path):
-            return False
-        self._driver.get(f"{self._base_url}/")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                cookies = json.load(f)
-        except Exception:
-            return False
-        for cookie in cookies:
-            try:
-                self._driver.add_cookie(cookie)
-            except Exception:
-                continue
-        return True
+    def scroll_depth_for(self, username: str) -> Optional[int]:
+        """
+        Сколько раундов скролла занял последний сбор чата с username (None — не собирали).
+        """
+        return self._scroll_depths.get(username)
+
+    def reached_start_for(self, username: str) -> bool:
+        """
+        Дошёл ли последний (завершённый) сбор чата с username до начала переписки.
+        Только по явному признаку — наверху видна шапка профиля или сервер ответил,
+        что старее сообщений нет; остановка по NO_PROGRESS_PATIENCE не считается.
+        """
+        return self._reached_start.get(username, False)
 
-    def _save_cookies(self, path: str = "cookies.json"):
-        import json
-        cookies = self._driver.get_cookies()
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(cookies, f, ensure_ascii=False, indent=2)
     """
     Отвечает за работу с веб-интерфейсом Instagram Direct через Selenium:
     - открытие Direct,
@@ -61,7 +542,7 @@ class InstagramDirectClient:
     """
 
     # ------------------ Публичный сценарий ------------------ #
-    def _scroll_contacts_list(self, max_scrolls: int = 30, pause: float = 1.0) -> None:
+    def _scroll_contacts_list(self, max_scrolls: int = 30) -> None:
         """
         Прокручивает список контактов вниз, чтобы подгрузить все диалоги.
         Останавливается, если новые контакты перестали появляться.
@@ -76,29 +557,8 @@ class InstagramDirectClient:
             )
         )
 
-        # 2. Пытаемся найти ближайший скроллируемый контейнер через JavaScript,
-        #    а не через жёсткий XPath, т.к. разметка Instagram часто меняется.
-        container = self._driver.execute_script(
-            """
-            let el = arguments[0];
-            // сначала идём вверх по предкам и ищем настоящий скроллируемый контейнер
-            while (el && el.parentElement) {
-                el = el.parentElement;
-                const style = window.getComputedStyle(el);
-                const oy = style.overflowY;
-                if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                    return el;
-                }
-            }
-            // если не нашли, пробуем найти скроллбар в левой колонке по data-thumb="1"
-            const thumb = document.querySelector('div[data-thumb="1"]');
-            if (thumb && thumb.parentElement) {
-                return thumb.parentElement;
-            }
-            return null;
-            """,
-            first_thread,
-        )
+        # 2. Ближайший скроллируемый контейнер (или скроллбар data-thumb="1")
+        container = self._locator.get("inbox", seed=first_thread)
 
         if container is None:
             # Если не нашли специфический контейнер, откатываемся к простому скроллу body
@@ -106,34 +566,22 @@ class InstagramDirectClient:
             self._scroll_threads_list(max_scrolls=max_scrolls)
             return
 
-        last_count = 0
+        self._scroller.reset()
         stable_rounds = 0
 
         for _ in range(max_scrolls):
-            # текущее количество карточек
-            threads = self._driver.find_elements(
-                By.CSS_SELECTOR,
-                "div[role='button'][tabindex='0']",
-            )
-            cur_count = len(threads)
+            # скроллим контейнер вниз и ждём, пока подгрузятся карточки
+            result = self._scroller.step(container, "down", count_selector=THREAD_CARD_SELECTOR)
 
-            if cur_count == last_count:
+            if result.at_edge and not result.loaded:
                 stable_rounds += 1
                 if stable_rounds >= 2:
-                    # два раза подряд ничего нового — выходим
+                    # два раза подряд внизу и ничего нового — выходим
                     break
             else:
                 stable_rounds = 0
-                last_count = cur_count
-
-            # скроллим контейнер вниз
-            self._driver.execute_script(
-                "arguments[0].scrollTop = arguments[0].scrollHeight;",
-                container,
-            )
-            time.sleep(pause)
 
-    def _scroll_chat_history_up(self, max_scrolls: int = 50, pause: float = 1.0) -> None:
+    def _scroll_chat_history_up(self, max_scrolls: int = 50) -> None:
         """
         Улучшенная прокрутка истории чата:
         - мелкие инкременты вверх;
@@ -150,42 +598,20 @@ class InstagramDirectClient:
         except TimeoutException:
             return
 
-        chat_container = self._driver.execute_script(
-            """
-            let el = arguments[0];
-            while (el && el.parentElement) {
-                el = el.parentElement;
-                const st = window.getComputedStyle(el);
-                const oy = st.overflowY;
-                if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                    return el;
-                }
-            }
-            return null;
-            """,
-            any_bubble,
-        )
+        chat_container = self._locator.get("chat", seed=any_bubble)
         if not chat_container:
             print("[WARN] Не найден контейнер истории для скролла")
             return
 
-        pause = 0.8
-
         # ---------- scrolling UP ----------
-        last_height = None
+        self._scroller.reset()
         stable_rounds = 0
 
         for _ in range(max_scrolls):
             try:
-                cur_height = self._driver.execute_script("return arguments[0].scrollTop;", chat_container)
-                self._driver.execute_script(
-                    "arguments[0].scrollTop = arguments[0].scrollTop - 200;",
-                    chat_container,
-                )
-                time.sleep(pause)
-                new_height = self._driver.execute_script("return arguments[0].scrollTop;", chat_container)
+                result = self._scroller.step(chat_container, "up", count_selector=BUBBLE_SELECTOR)
 
-                if new_height == cur_height:
+                if not result.moved and not result.loaded:
                     stable_rounds += 1
                     if stable_rounds >= 2:
                         break
@@ -195,28 +621,13 @@ class InstagramDirectClient:
                 break
 
         # ---------- scrolling DOWN ----------
+        self._scroller.reset()
         stable_rounds = 0
         for _ in range(max_scrolls):
             try:
-                cur_top = self._driver.execute_script("return arguments[0].scrollTop;", chat_container)
-                cur_sh  = self._driver.execute_script("return arguments[0].scrollHeight;", chat_container)
-                cur_ch  = self._driver.execute_script("return arguments[0].clientHeight;", chat_container)
-
-                at_bottom_before = (cur_top + cur_ch) >= (cur_sh - 5)
-
-                self._driver.execute_script(
-                    "arguments[0].scrollTop = arguments[0].scrollTop + 200;",
-                    chat_container,
-                )
-                time.sleep(pause)
+                result = self._scroller.step(chat_container, "down", count_selector=BUBBLE_SELECTOR)
 
-                new_top = self._driver.execute_script("return arguments[0].scrollTop;", chat_container)
-                cur_sh2 = self._driver.execute_script("return arguments[0].scrollHeight;", chat_container)
-                cur_ch2 = self._driver.execute_script("return arguments[0].clientHeight;", chat_container)
-
-                at_bottom_after = (new_top + cur_ch2) >= (cur_sh2 - 5)
-
-                if at_bottom_before and at_bottom_after:
+                if result.at_edge and not result.moved:
                     stable_rounds += 1
                     if stable_rounds >= 2:
                         break
@@ -226,91 +637,101 @@ class InstagramDirectClient:
             except StaleElementReferenceException:
                 break
 
-    def _detect_sender(self, bubble_el):
-        """
-        Определяет отправителя сообщения в пузыре.
-        Возвращает "self" или "peer".
-        """
-        try:
-            # Ищем h6 среди предков, в них Instagram показывает "Вы отправили"
-            h6_nodes = bubble_el.find_elements(By.XPATH, "ancestor::div//h6")
-            for h in h6_nodes:
-                txt = (h.text or "").strip()
-                if txt.startswith("Вы отправили") or txt.startswith("You sent"):
-                    return "self"
-        except Exception:
-            pass
-        return "peer"
-
     def fetch_contacts(self, max_scrolls: int = 25) -> List[ContactSnapshot]:
         """
         Открывает Direct, прокручивает список диалогов и возвращает
         список "снимков" контактов.
         """
-        self._open_direct()
         snapshots: List[ContactSnapshot] = []
         seen_usernames = set()
+        seen_cards: set[str] = set()
         scraped_at = datetime.now(timezone.utc)
 
-        for _ in range(max_scrolls if max_scrolls > 0 else 1):
-            thread_elements = self._collect_thread_elements()
-
-            html_snapshots: list[str] = []
-            for el in thread_elements:
-                try:
-                    outer_html = el.get_attribute("outerHTML")
-                except StaleElementReferenceException:
-                    continue
-                if not outer_html:
-                    continue
-                html_snapshots.append(outer_html)
-
-            for outer_html in html_snapshots:
-                snapshot = self._parse_thread_element(outer_html, scraped_at)
-                if snapshot is None:
-                    continue
+        for html_snapshots, _ in self._iter_contact_rounds(max_scrolls):
+            # уже разобранные на прошлых раундах карточки отсекаются до парсинга
+            for snapshot in self._card_parser.parse_cards(html_snapshots, scraped_at, seen_cards):
                 if snapshot.username in seen_usernames:
                     continue
                 seen_usernames.add(snapshot.username)
+                if snapshot.thread_id:
+                    self._thread_ids[snapshot.username] = snapshot.thread_id
                 snapshots.append(snapshot)
 
-            # scroll slightly down to fetch new contacts
+        return snapshots
+
+    def capture_contacts(self, capture_dir: str, max_scrolls: int = 25) -> str:
+        """
+        Режим захвата для списка диалогов: HTML контейнера после каждого раунда
+        пишется в шард <capture_dir>/inbox/<время>.jsonl.gz, разбор — потом,
+        в client.parse_shards. Возвращает путь к шарду.
+        """
+        scraped_at = datetime.now(timezone.utc)
+        shard = ShardWriter(
+            inbox_shard_path(capture_dir, scraped_at),
+            {"kind": "inbox", "scraped_at_utc": scraped_at.isoformat()},
+        )
+        try:
+            for html_snapshots, container in self._iter_contact_rounds(max_scrolls):
+                if container is not None:
+                    html = self._driver.execute_script("return arguments[0].outerHTML;", container)
+                else:
+                    html = "<div>" + "".join(html_snapshots) + "</div>"
+                shard.write_round(html or "")
+        except BaseException:
+            shard.abort()
+            raise
+        path = shard.close()
+        print(f"[CAPTURE] Список диалогов: записано раундов {shard.rounds} → {path}")
+        return path
+
+    def _iter_contact_rounds(self, max_scrolls: int) -> Iterator[Tuple[list[str], object]]:
+        """
+        Открывает Direct и скроллит список диалогов вниз. На каждом раунде
+        отдаёт (outerHTML карточек, контейнер списка или None).
+        """
+        self._open_direct()
+        self._scroller.reset()
+
+        for _ in range(max_scrolls if max_scrolls > 0 else 1):
+            thread_elements = self._collect_thread_elements()
+
+            # весь HTML карточек одним вызовом вместо get_attribute на каждую
             try:
-                any_thread = thread_elements[0]
-            except Exception:
-                break
+                html_snapshots: list[str] = self._driver.execute_script(
+                    "return arguments[0].map(el => el.outerHTML);",
+                    thread_elements,
+                ) or []
+            except StaleElementReferenceException:
+                html_snapshots = self._driver.execute_script(
+                    "return Array.from(document.querySelectorAll(arguments[0]), el => el.outerHTML);",
+                    self._selectors.css("card")[0],
+                ) or []
 
-            container = self._driver.execute_script(
-                """
-                let el = arguments[0];
-                while (el && el.parentElement) {
-                    el = el.parentElement;
-                    const style = window.getComputedStyle(el);
-                    const oy = style.overflowY;
-                    if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                        return el;
-                    }
-                }
-                const thumb = document.querySelector('div[data-thumb="1"]');
-                if (thumb && thumb.parentElement) {
-                    return thumb.parentElement;
-                }
-                return null;
-                """,
-                any_thread,
-            )
+            # контейнер ищется один раз, дальше — из кэша локатора
+            container = None
+            if thread_elements:
+                container = self._locator.get("inbox", seed=thread_elements[0])
+
+            yield html_snapshots, container
+
+            # scroll slightly down to fetch new contacts
             if not container:
                 break
 
-            self._driver.execute_script(
-                "arguments[0].scrollTop = arguments[0].scrollTop + 300;",
-                container,
-            )
-            time.sleep(1.0)
-
-        return snapshots
+            result = self._scroller.step(container, "down", count_selector=THREAD_CARD_SELECTOR)
+            if result.at_edge and not result.loaded and not result.moved:
+                # уже внизу списка и ничего не подгрузилось
+                break
 
     def close(self):
+        print(f"[DEBUG] Локатор: {self._locator.report()}")
+        print(f"[DEBUG] Селекторы: {self._selectors.report()}")
+        self._selectors.save()
+        try:
+            # за сессию Instagram мог обновить cookies — сохраняем свежие
+            self._session.save_cookies()
+        except Exception:
+            pass
         try:
             self._driver.quit()
         except:
@@ -321,15 +742,70 @@ class InstagramDirectClient:
         """
         return self.fetch_messages_for_contact(username, limit)
 
-    def open_chat_by_username(self, username: str, retries: int = 3, max_scrolls: int = 40) -> None:
+    def open_chat_by_username(
+        self,
+        username: str,
+        thread_id: Optional[str] = None,
+        retries: int = 3,
+        max_scrolls: int = 40,
+    ) -> Optional[str]:
         """
         Открывает диалог в Direct по username.
 
+        Если известен thread_id (из БД или из этой сессии) — переходит сразу на
+        /direct/t/<id>/. Если id нет или он устарел — ищет карточку в списке
+        диалогов (_open_chat_by_search).
+
+        Возвращает id открытого диалога (берётся из URL; None — диалог открыт,
+        но id в URL нет). Если диалог не открылся — ChatNotOpened: после
+        неудачной прямой ссылки на экране может остаться чужой чат.
+        """
+        self._locator.invalidate("chat")
+        thread_id = thread_id or self._thread_ids.get(username)
+        if thread_id:
+            if self._open_chat_by_thread_id(username, thread_id):
+                self._thread_ids[username] = thread_id
+                return thread_id
+            print(f"[WARN] thread_id {thread_id} для {username} устарел, ищу диалог в списке")
+            self._thread_ids.pop(username, None)
+
+        if not self._open_chat_by_search(username, retries=retries, max_scrolls=max_scrolls):
+            raise ChatNotOpened(f"Не удалось открыть диалог с {username}")
+
+        opened_id = extract_thread_id(self._driver.current_url)
+        if opened_id:
+            self._thread_ids[username] = opened_id
+        return opened_id
+
+    def _open_chat_by_thread_id(self, username: str, thread_id: str, timeout: int = 10) -> bool:
+        """
+        Переходит прямо на /direct/t/<thread_id>/ и проверяет, что открылся
+        нужный диалог: URL не увёл в inbox/login и в чате есть ссылка на профиль username.
+        """
+        self._driver.get(f"{self._base_url}/direct/t/{thread_id}/")
+        profile_link = f"main a[href='/{username}/'], main span[title='{username}']"
+        try:
+            WebDriverWait(self._driver, timeout).until(
+                lambda d: extract_thread_id(d.current_url) != thread_id
+                or d.find_elements(By.CSS_SELECTOR, profile_link)
+            )
+        except TimeoutException:
+            return False
+        return extract_thread_id(self._driver.current_url) == thread_id and bool(
+            self._driver.find_elements(By.CSS_SELECTOR, profile_link)
+        )
+
+    def _open_chat_by_search(self, username: str, retries: int = 3, max_scrolls: int = 40) -> bool:
+        """
+        Ищет диалог в списке Direct по username и кликает по нему.
+
         Теперь:
         - сначала пробует найти диалог среди уже прогруженных карточек;
         - если не получилось — находит скроллируемый контейнер списка диалогов,
           скроллит его небольшими шагами вниз и на каждом шаге ищет нужный username;
         - устойчиво к StaleElementReference.
+
+        Возвращает True, если по карточке удалось кликнуть.
         """
         xpath = f"//span[@title='{username}']/ancestor::div[@role='button']"
 
@@ -341,7 +817,7 @@ class InstagramDirectClient:
                 )
                 self._driver.execute_script("arguments[0].click();", dialog_button)
                 time.sleep(2)
-                return
+                return True
             except StaleElementReferenceException:
                 if attempt == retries - 1:
                     print(f"[ERROR] StaleElementReference при открытии диалога {username}, попытки исчерпаны")
@@ -357,35 +833,17 @@ class InstagramDirectClient:
         threads = self._collect_thread_elements()
         if not threads:
             print(f"[WARN] Не удалось найти ни одной карточки диалога перед поиском {username}")
-            return
+            return False
 
         # Пытаемся найти скроллируемый контейнер списка диалогов
         try:
-            container = self._driver.execute_script(
-                """
-                let el = arguments[0];
-                while (el && el.parentElement) {
-                    el = el.parentElement;
-                    const style = window.getComputedStyle(el);
-                    const oy = style.overflowY;
-                    if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                        return el;
-                    }
-                }
-                const thumb = document.querySelector('div[data-thumb="1"]');
-                if (thumb && thumb.parentElement) {
-                    return thumb.parentElement;
-                }
-                return null;
-                """,
-                threads[0],
-            )
+            container = self._locator.get("inbox", seed=threads[0])
         except Exception:
             container = None
 
         if not container:
             print(f"[WARN] Не удалось найти контейнер списка диалогов для {username}")
-            return
+            return False
 
         # Стартуем всегда с самого верха списка, чтобы никого не пропустить
         try:
@@ -393,10 +851,9 @@ class InstagramDirectClient:
             time.sleep(0.5)
         except StaleElementReferenceException:
             print(f"[WARN] Контейнер списка диалогов устарел перед поиском {username}")
-            return
+            return False
 
-        # Маленький шаг скролла, чтобы ничего не перескакивать
-        scroll_step = 260
+        self._scroller.reset()
 
         for i in range(max_scrolls):
             try:
@@ -406,46 +863,22 @@ class InstagramDirectClient:
                     # Нашли — кликаем и выходим
                     self._driver.execute_script("arguments[0].click();", dialog_button)
                     time.sleep(2)
-                    return
+                    return True
                 except NoSuchElementException:
                     # не видно — скроллим ниже
                     pass
 
-                self._driver.execute_script(
-                    "arguments[0].scrollTop = arguments[0].scrollTop + arguments[1];",
-                    container,
-                    scroll_step,
-                )
-                time.sleep(0.7)
+                # шаг не больше clientHeight, так что карточки не перескакиваем
+                result = self._scroller.step(container, "down", count_selector=THREAD_CARD_SELECTOR)
+                if result.at_edge and not result.moved and not result.loaded:
+                    break
 
             except StaleElementReferenceException:
                 # Пытаемся восстановить контейнер и продолжить
                 print(
                     f"[WARN] StaleElementReference при скролле списка диалогов (поиск {username}), пробую восстановиться")
                 try:
-                    threads = self._collect_thread_elements()
-                    if not threads:
-                        print("[WARN] Не удалось заново найти элементы диалогов")
-                        break
-                    container = self._driver.execute_script(
-                        """
-                        let el = arguments[0];
-                        while (el && el.parentElement) {
-                            el = el.parentElement;
-                            const style = window.getComputedStyle(el);
-                            const oy = style.overflowY;
-                            if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                                return el;
-                            }
-                        }
-                        const thumb = document.querySelector('div[data-thumb="1"]');
-                        if (thumb && thumb.parentElement) {
-                            return thumb.parentElement;
-                        }
-                        return null;
-                        """,
-                        threads[0],
-                    )
+                    container = self._locator.get("inbox", refresh=True)
                     if not container:
                         print("[WARN] Не удалось восстановить контейнер списка диалогов")
                         break
@@ -454,64 +887,26 @@ class InstagramDirectClient:
                     break
 
         print(f"[WARN] Не удалось найти диалог с пользователем {username} даже после скролла")
+        return False
 
 
-    def _find_message_bubbles(self):
+    def _find_message_bubbles(self, container=None, record: bool = True):
         """
-        Ищет все элементы пузырей сообщений в текущем открытом чате.
+        Ищет элементы пузырей сообщений в текущем открытом чате (внутри
+        container, если он известен).
 
         Instagram может использовать разные шаблоны:
         - с aria-label 'Double tap to like' (классический bubble);
         - с локализованным aria-label (на случай других языков);
         - просто div[role='button'] с текстовым div[dir='auto'] внутри.
 
-        Возвращает список WebElement без дублей.
+        Шаблоны пробуются по очереди, начиная с самого удачного на этом
+        аккаунте (SelectorRegistry), до первого, который что-то нашёл.
+        record=False — не портить статистику опросом в ожидании загрузки.
         """
-        bubbles = []
-
         try:
-            # 1) Классический шаблон (английский) + возможные локализованные варианты
-            css_selectors = [
-                "div[role='button'][aria-label*='Double tap to like']",
-                "div[role='button'][aria-label*='Дважды коснитесь']",
-                "div[role='button'][aria-label*='Дважды нажмите']",
-            ]
-
-            for sel in css_selectors:
-                try:
-                    found = self._driver.find_elements(By.CSS_SELECTOR, sel)
-                    if found:
-                        bubbles.extend(found)
-                except Exception:
-                    continue
-
-            # 2) Общий fallback: любой div[role='button'],
-            #    внутри которого есть div[@dir='auto' с непустым текстом].
-            try:
-                generic = self._driver.find_elements(
-                    By.XPATH,
-                    "//div[@role='button' and .//div[@dir='auto' and normalize-space(text())!='']]",
-                )
-                bubbles.extend(generic)
-            except Exception:
-                pass
-
-            # Убираем дубли WebElement по их внутреннему id
-            unique = []
-            seen_ids = set()
-            for el in bubbles:
-                try:
-                    key = el.id
-                except Exception:
-                    key = id(el)
-
-                if key in seen_ids:
-                    continue
-                seen_ids.add(key)
-                unique.append(el)
-
-            return unique
-
+            _, bubbles = self._selectors.find("bubble", root=container, record=record)
+            return bubbles
         except Exception:
             return []
 
@@ -523,261 +918,908 @@ class InstagramDirectClient:
         """
         try:
             WebDriverWait(self._driver, timeout).until(
-                lambda d: bool(self._find_message_bubbles()) or d.find_elements(By.CSS_SELECTOR, "main[role='main']")
+                lambda d: bool(self._find_message_bubbles(record=False))
+                or d.find_elements(By.CSS_SELECTOR, "main[role='main']")
             )
             # даём UI чуть времени стабилизироваться
             time.sleep(1.0)
         except TimeoutException:
             print("[WARN] Не дождались полной загрузки чата (timeout), пробуем парсить то, что есть.")
 
-    def fetch_messages_for_contact(self, username: str, max_scrolls: int = 0) -> list[MessageSnapshot]:
+    def fetch_messages_for_contact(
+        self,
+        username: str,
+        max_scrolls: int = 0,
+        extraction_mode: str = "observer",
+        thread_id: Optional[str] = None,
+        watermark: Optional[List[str]] = None,
+    ) -> list[MessageSnapshot]:
         """
-        Открывает чат и собирает все сообщения как список MessageSnapshot.
+        Открывает чат и собирает все сообщения как список MessageSnapshot
+        (от старых к новым).
+        thread_id — известный id диалога (см. open_chat_by_username); если диалог
+        не открылся — ChatNotOpened, чужой чат с экрана не собирается.
+        watermark — тексты последних сохранённых сообщений (от старых к новым):
+        скролл останавливается, как только они видны, и возвращаются только более новые.
+
+        extraction_mode:
+        - "observer" — MutationObserver в контейнере чата копит новые bubble'ы
+          в странице, после каждого скролла забираем только их;
+        - "js" — все bubble'ы раунда читаются одним execute_script;
+        - "elements" — старый путь через WebElement'ы (по несколько запросов на bubble);
+        - "network" — DOM только скроллится, сообщения (с настоящими timestamp и
+          user_id) берутся из JSON-ответов Direct; драйвер должен быть создан с
+          create_driver(network_log=True). Без ответов деградирует до "observer".
+        Захват HTML без разбора (разбор потом, офлайн) — capture_messages_for_contact.
         """
-        self.open_chat_by_username(username)
+        if extraction_mode == "network":
+            # чтобы в логе не остались ответы предыдущего чата
+            self._network_capture().drain_payloads()
+        self.open_chat_by_username(username, thread_id=thread_id)
         self._wait_chat_loaded()
-        messages = self._collect_messages_from_chat(contact_username=username, max_scrolls=max_scrolls)
+        messages = self._collect_messages_from_chat(
+            contact_username=username,
+            max_scrolls=max_scrolls,
+            extraction_mode=extraction_mode,
+            watermark=watermark,
+        )
         print(f"[DEBUG] Для {username} собрано сообщений: {len(messages)}")
         return messages
 
+    def capture_messages_for_contact(
+        self,
+        username: str,
+        capture_dir: str,
+        max_scrolls: int = 0,
+        thread_id: Optional[str] = None,
+        watermark: Optional[List[str]] = None,
+    ) -> Optional[str]:
+        """
+        Режим захвата: открывает чат и скроллит его, как fetch_messages_for_contact,
+        но ничего не разбирает — HTML контейнера после каждого раунда пишется
+        в сжатый шард <capture_dir>/chats/<username>.jsonl.gz. Разбор и загрузка
+        в БД — python -m client.parse_shards <capture_dir>, без браузера.
+        Возвращает путь к шарду или None, если чат пустой.
+        """
+        self.open_chat_by_username(username, thread_id=thread_id)
+        self._wait_chat_loaded()
+
+        state = self._start_chat_collect(
+            username,
+            max_scrolls=max_scrolls,
+            extraction_mode="capture",
+            watermark=watermark,
+        )
+        if state is None:
+            return None
+        state.shard = ShardWriter(
+            chat_shard_path(capture_dir, username),
+            {
+                "kind": "chat",
+                "contact_username": username,
+                "thread_id": self.thread_id_for(username),
+                "scraped_at_utc": state.scraped_at.isoformat(),
+            },
+        )
+        try:
+            while not state.done:
+                self._chat_collect_round(state, wait=True)
+        except BaseException:
+            state.shard.abort()
+            raise
+        self._finish_chat_collect(state)
+        print(
+            f"[CAPTURE] {username}: раундов {state.rounds}, записано {state.shard.rounds} "
+            f"({state.shard.bytes_raw // 1024} КБ HTML) → {state.shard.path}"
+        )
+        return state.shard.path
+
+    def fetch_messages_pipelined(
+        self,
+        contacts: List[ContactSnapshot],
+        tabs: int = 3,
+        max_scrolls: int = 0,
+        extraction_mode: str = "observer",
+        watermarks: Optional[Dict[str, List[str]]] = None,
+        min_tab_interval: float = 0.4,
+        on_start: Optional[Callable[[ContactSnapshot], None]] = None,
+    ) -> Iterator[Tuple[ContactSnapshot, Optional[list[MessageSnapshot]]]]:
+        """
+        Собирает сообщения нескольких контактов параллельно во вкладках одного Chrome.
+
+        Каждая из `tabs` вкладок ведёт свой чат. Вкладки обходятся по кругу:
+        в каждой читаем новые bubble'ы и отдаём команду скролла без ожидания,
+        а пока история подгружается — работаем с остальными вкладками.
+
+        Отдаёт (contact, messages) по мере завершения чатов (порядок не сохраняется).
+        messages is None — чат не открылся (inbox/bubble'ы не дождались) или его
+        сбор упал: контакт не собран, его нужно повторить.
+        on_start(contact) вызывается, когда контакт берётся в работу (для чекпоинтов прогона).
+        Если вкладка упала — остальные вкладки закрываются, а незавершённые контакты
+        дособираются в исходной вкладке обычным fetch_messages_for_contact.
+        """
+        watermarks = watermarks or {}
+        pending = deque(contacts)
+        home = self._driver.current_window_handle
+        slots: list[dict] = []
+
+        try:
+            for i in range(max(1, tabs)):
+                self._driver.switch_to.new_window("tab")
+                # блокировка ресурсов лёгкого профиля действует на одну вкладку
+                block_lean_resources(self._driver)
+                slots.append({"tab": i, "handle": self._driver.current_window_handle, "contact": None, "state": None})
+
+            while True:
+                # занимаем свободные вкладки следующими контактами
+                for slot in slots:
+                    if slot["state"] is None and pending:
+                        contact = pending.popleft()
+                        if on_start is not None:
+                            on_start(contact)
+                        self._driver.switch_to.window(slot["handle"])
+                        slot["contact"] = contact
+                        slot["state"] = self._start_tab_chat(contact, max_scrolls, extraction_mode, watermarks)
+                        slot["visited_at"] = 0.0
+                        if slot["state"] is None:
+                            # чат не открылся — это не пустой чат, контакт надо повторить
+                            slot["contact"] = None
+                            yield contact, None
+
+                active = [slot for slot in slots if slot["state"] is not None]
+                if not active:
+                    if pending:
+                        continue
+                    break
+
+                for slot in active:
+                    # даём вкладке время на подгрузку с прошлого скролла
+                    pause = min_tab_interval - (time.monotonic() - slot["visited_at"])
+                    if pause > 0:
+                        time.sleep(pause)
+
+                    self._driver.switch_to.window(slot["handle"])
+                    state = slot["state"]
+                    self._chat_collect_round(state, wait=False)
+                    slot["visited_at"] = time.monotonic()
+
+                    if state.done:
+                        messages = self._finish_chat_collect(state)
+                        print(f"[TAB {slot['tab']}] {state.contact_username}: готово, раундов {state.rounds}, сообщений {len(messages)}")
+                        contact = slot["contact"]
+                        slot["contact"] = None
+                        slot["state"] = None
+                        yield contact, messages
+                    elif state.rounds % 10 == 0:
+                        print(f"[TAB {slot['tab']}] {state.contact_username}: раунд {state.rounds}, сообщений {len(state.seen_keys)}")
+
+        except (NoSuchWindowException, InvalidSessionIdException) as e:
+            unfinished = [slot["contact"] for slot in slots if slot["contact"] is not None]
+            print(f"[WARN] Вкладка упала ({e!r}), дособираю {len(unfinished) + len(pending)} контактов в одной вкладке")
+            pending.extendleft(reversed(unfinished))
+            self._close_tabs(slots, home)
+            slots = []
+            # их попытка уже засчитана, когда их брали во вкладки
+            started = {c.username for c in unfinished}
+
+            while pending:
+                contact = pending.popleft()
+                if on_start is not None and contact.username not in started:
+                    on_start(contact)
+                try:
+                    messages = self.fetch_messages_for_contact(
+                        contact.username,
+                        max_scrolls=max_scrolls,
+                        extraction_mode=extraction_mode,
+                        thread_id=contact.thread_id,
+                        watermark=watermarks.get(contact.username),
+                    )
+                except Exception as e:
+                    print(f"[Ошибка] Не удалось получить сообщения {contact.username}: {e}")
+                    yield contact, None
+                    continue
+                yield contact, messages
+        finally:
+            self._close_tabs(slots, home)
+
+    def _start_tab_chat(
+        self,
+        contact: ContactSnapshot,
+        max_scrolls: int,
+        extraction_mode: str,
+        watermarks: Dict[str, List[str]],
+    ) -> Optional[_ChatCollectState]:
+        """
+        Открывает чат контакта в текущей вкладке и готовит состояние сбора.
+        None — чат не открылся или в нём нет bubble'ов.
+        """
+        username = contact.username
+        if not (contact.thread_id or self._thread_ids.get(username)):
+            # поиску по списку нужен inbox в этой вкладке
+            self._driver.get(f"{self._base_url}/direct/inbox/")
+            try:
+                self._wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, THREAD_CARD_SELECTOR)))
+            except TimeoutException:
+                print(f"[WARN] Inbox не загрузился во вкладке для {username}")
+                return None
+        try:
+            self.open_chat_by_username(username, thread_id=contact.thread_id)
+        except ChatNotOpened as e:
+            print(f"[WARN] {e}")
+            return None
+        self._wait_chat_loaded()
+        return self._start_chat_collect(
+            username,
+            max_scrolls=max_scrolls,
+            extraction_mode=extraction_mode,
+            watermark=watermarks.get(username),
+        )
+
+    def _close_tabs(self, slots: list[dict], home: str) -> None:
+        for slot in slots:
+            try:
+                self._driver.switch_to.window(slot["handle"])
+                self._driver.close()
+            except Exception:
+                pass
+        try:
+            self._driver.switch_to.window(home)
+        except Exception:
+            pass
+
+    def iter_message_batches_for_contact(
+        self,
+        username: str,
+        max_scrolls: int = 0,
+        extraction_mode: str = "observer",
+        thread_id: Optional[str] = None,
+        watermark: Optional[List[str]] = None,
+    ) -> Iterator[MessageBatch]:
+        """
+        Как fetch_messages_for_contact, но не собирает весь чат в один список:
+        после каждого раунда скролла отдаёт готовые сообщения пачкой MessageBatch
+        (от новых пачек к старым, внутри пачки — от старых к новым, msg_hash
+        проставлен). Память — один раунд плюс несколько сообщений хвоста.
+        """
+        if extraction_mode == "network":
+            self._network_capture().drain_payloads()
+        self.open_chat_by_username(username, thread_id=thread_id)
+        self._wait_chat_loaded()
+        yield from self._iter_messages_from_chat(
+            username,
+            max_scrolls=max_scrolls,
+            extraction_mode=extraction_mode,
+            watermark=watermark,
+        )
+
+    def stream_messages_for_contact(
+        self,
+        username: str,
+        sink: Callable[[MessageBatch], object],
+        max_scrolls: int = 0,
+        extraction_mode: str = "observer",
+        thread_id: Optional[str] = None,
+        watermark: Optional[List[str]] = None,
+    ) -> int:
+        """
+        iter_message_batches_for_contact с отдачей пачек в sink, например
+        BackgroundMessageWriter.submit: запись в БД идёт параллельно со скроллом,
+        а при сбое посередине чата уже отданное сохранено. Вместе с MemoryGovernor
+        и DOM браузера остаётся ограниченным на чатах в десятки тысяч сообщений.
+        Возвращает, сколько сообщений отдано в sink.
+        """
+        streamed = 0
+        for batch in self.iter_message_batches_for_contact(
+            username,
+            max_scrolls=max_scrolls,
+            extraction_mode=extraction_mode,
+            thread_id=thread_id,
+            watermark=watermark,
+        ):
+            sink(batch)
+            streamed += len(batch.messages)
+
+        if self._governor is not None:
+            print(f"[MEM] {username}: {self._governor.report()}")
+        return streamed
+
     def _collect_messages_from_chat(
         self,
         contact_username: str,
         max_scrolls: int = 0,
         stop_at_text: Optional[str] = None,
+        extraction_mode: str = "observer",
+        watermark: Optional[List[str]] = None,
     ) -> list[MessageSnapshot]:
         """
-        Сбор сообщений из открытого чата.
+        Сбор сообщений из открытого чата. Результат — от старых к новым:
+        каждый раунд скролла вверх приносит более старые bubble'ы, поэтому
+        раунды склеиваются в обратном порядке, а внутри раунда — по вертикали.
 
         Теперь логика проще и упрямая:
         - всегда скроллим ВВЕРХ (к старым сообщениям);
         - после каждого скролла сразу собираем bubble'ы;
         - выходим в двух случаях:
           1) явно видна "шапка" чата с аватаркой/названием;
-          2) очень много раундов без прогресса (ни движения, ни новых bubble'ов).
+          2) очень много раундов без прогресса (ни движения, ни новых bubble'ов);
+          3) на экране появился watermark — уже сохранённые сообщения;
+             всё, что выше него, отбрасывается.
+
+        Чтение bubble'ов — см. extraction_mode в fetch_messages_for_contact.
+        При ошибке режим деградирует до конца чата: network → observer → js → elements.
         """
+        state = self._start_chat_collect(
+            contact_username,
+            max_scrolls=max_scrolls,
+            stop_at_text=stop_at_text,
+            extraction_mode=extraction_mode,
+            watermark=watermark,
+        )
+        if state is None:
+            return []
+
+        while not state.done:
+            self._chat_collect_round(state, wait=True)
+
+        return self._finish_chat_collect(state)
+
+    def _iter_messages_from_chat(
+        self,
+        contact_username: str,
+        max_scrolls: int = 0,
+        stop_at_text: Optional[str] = None,
+        extraction_mode: str = "observer",
+        watermark: Optional[List[str]] = None,
+    ) -> Iterator[MessageBatch]:
+        """
+        Потоковый _collect_messages_from_chat: те же раунды, но готовые
+        сообщения уходят пачками сразу после раунда (см. ChatStreamStitcher),
+        а не копятся до конца чата.
+        """
+        state = self._start_chat_collect(
+            contact_username,
+            max_scrolls=max_scrolls,
+            stop_at_text=stop_at_text,
+            extraction_mode=extraction_mode,
+            watermark=watermark,
+            streaming=True,
+        )
+        if state is None:
+            return
+
+        stitcher = ChatStreamStitcher(contact_username, watermark)
+        try:
+            while not state.done:
+                self._chat_collect_round(state, wait=True)
+                if state.done:
+                    break
+                batch = stitcher.release(state.batches, state.drop_keys)
+                if batch is not None and batch.messages:
+                    yield batch
+        finally:
+            self._scroll_depths[contact_username] = state.rounds
+            if state.extraction_mode == "observer" and state.chat_container is not None:
+                self._disconnect_bubble_observer(state.chat_container)
+
+        self._reached_start[contact_username] = state.reached_start
+        batch = stitcher.release(state.batches, state.drop_keys, final=True, reached_start=state.reached_start)
+        if batch is not None and batch.messages:
+            yield batch
+
+    def _start_chat_collect(
+        self,
+        contact_username: str,
+        max_scrolls: int = 0,
+        stop_at_text: Optional[str] = None,
+        extraction_mode: str = "observer",
+        watermark: Optional[List[str]] = None,
+        streaming: bool = False,
+    ) -> Optional[_ChatCollectState]:
+        """
+        Находит контейнер открытого чата и готовит состояние сбора.
+        None — в чате нет ни одного bubble'а / контейнера.
+
+        max_scrolls == 0 — до начала чата: в потоковом сборе (streaming) и с
+        MemoryGovernor без лимита раундов, сбор заканчивают шапка чата или
+        NO_PROGRESS_PATIENCE; иначе — не больше FULL_HISTORY_MAX_ROUNDS.
+        """
+        self._reached_start.pop(contact_username, None)
         # 1. Находим любой bubble, чтобы найти контейнер чата
         try:
             bubbles_initial = self._wait.until(
-                lambda d: self._find_message_bubbles()
+                lambda d: self._find_message_bubbles(record=False)
             )
             any_bubble = bubbles_initial[0]
         except TimeoutException:
             print("[WARN] Не нашли ни одного bubble в чате")
-            return []
+            return None
 
-        chat_container = self._driver.execute_script(
-            """
-            let el = arguments[0];
-            while (el && el.parentElement) {
-                el = el.parentElement;
-                const st = window.getComputedStyle(el);
-                const oy = st.overflowY;
-                if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                    return el;
-                }
-            }
-            return null;
-            """,
-            any_bubble,
-        )
+        chat_container = self._find_chat_container(any_bubble)
         if not chat_container:
             print("[WARN] Не удалось найти контейнер чата, пробую main[role='main'] как fallback")
             try:
                 chat_container = self._driver.find_element(By.CSS_SELECTOR, "main[role='main']")
             except Exception:
-                return []
+                return None
 
         # 2. Подготовка структур
-        snapshots: list[MessageSnapshot] = []
-        scraped_at = datetime.now(timezone.utc)
-        seen_html: set[str] = set()
-        seen_texts: set[str] = set()
+        self._scroller.reset()
+        if extraction_mode == "network":
+            self._network_capture().enable()
+        if max_scrolls > 0:
+            max_rounds = max_scrolls * 4
+        elif streaming or self._governor is not None:
+            max_rounds = None
+        else:
+            max_rounds = FULL_HISTORY_MAX_ROUNDS
+        return _ChatCollectState(
+            contact_username=contact_username,
+            chat_container=chat_container,
+            extraction_mode=extraction_mode,
+            stop_at_text=stop_at_text,
+            watermark=watermark,
+            max_rounds=max_rounds,
+            scraped_at=datetime.now(timezone.utc),
+            thread_id=extract_thread_id(self._driver.current_url),
+            streaming=streaming,
+        )
 
-        # если max_scrolls == 0 → берём довольно большой лимит раундов
-        max_rounds = max_scrolls * 4 if max_scrolls > 0 else 200
+    def _network_capture(self) -> NetworkCapture:
+        if self._network is None:
+            self._network = NetworkCapture(self._driver)
+        return self._network
 
-        no_progress_rounds = 0
-        top_header_rounds = 0
+    def _find_chat_container(self, any_bubble):
+        # только что открытый чат — кэшу локатора не доверяем
+        return self._locator.get("chat", seed=any_bubble, refresh=True)
 
-        for _ in range(max_rounds):
-            try:
-                # 3. Собираем текущие bubble'ы (все известные шаблоны)
-                bubbles = self._find_message_bubbles()
-                seen_before = len(seen_html)
-
-                for bubble in bubbles:
-                    try:
-                        bubble_html = bubble.get_attribute("outerHTML")
-                    except StaleElementReferenceException:
-                        continue
-                    if not bubble_html or bubble_html in seen_html:
-                        continue
-                    seen_html.add(bubble_html)
-
-                    # Текст сообщения
-                    try:
-                        text_nodes = bubble.find_elements(
-                            By.XPATH,
-                            ".//*[@dir='auto' and normalize-space(text())!='']",
-                        )
-                        if not text_nodes:
-                            continue
-                        text = text_nodes[0].text.strip()
-                    except StaleElementReferenceException:
-                        continue
-
-                    if not text:
-                        continue
-
-                    # Базовая защита от дублей по тексту
-                    if text in seen_texts:
-                        continue
-                    seen_texts.add(text)
+    def _chat_collect_round(self, state: _ChatCollectState, wait: bool = True) -> None:
+        """
+        Один раунд сбора: читаем bubble'ы, проверяем условия остановки, скроллим вверх.
 
-                    sender = self._detect_sender(bubble)
+        wait=True — ждём реакции страницы через ScrollEngine.step;
+        wait=False — только отдаём команду скролла (ScrollEngine.nudge), а прогресс
+        оцениваем при следующем заходе — так несколько вкладок грузятся параллельно.
+        По окончании выставляет state.done.
+        """
+        if state.max_rounds is not None and state.rounds >= state.max_rounds:
+            state.done = True
+            return
+        state.rounds += 1
+        chat_container = state.chat_container
 
-                    snapshot = MessageSnapshot(
-                        contact_username=contact_username,
-                        sender=sender,
-                        text=text,
-                        timestamp_utc=None,
-                        scraped_at_utc=scraped_at,
-                    )
-                    snapshots.append(snapshot)
+        try:
+            got_new = False
+            if state.extraction_mode == "capture":
+                got_new = self._capture_round(state)
+            else:
+                if state.extraction_mode == "network":
+                    got_new = self._network_round(state)
+                if state.extraction_mode != "network":
+                    got_new = self._dom_round(state)
+            if state.done:
+                return
+            if self._governor is not None:
+                self._governor.on_round(state)
 
-                    if stop_at_text and stop_at_text in text:
-                        return snapshots
+            # 4. Проверяем, не дошли ли до "шапки" переписки
+            try:
+                at_top = self._driver.execute_script(
+                    "return arguments[0].scrollTop <= 5;",
+                    chat_container,
+                )
+            except StaleElementReferenceException:
+                at_top = False
 
-                # 4. Проверяем, не дошли ли до "шапки" переписки
+            top_header_visible = False
+            if at_top:
                 try:
-                    at_top = self._driver.execute_script(
-                        "return arguments[0].scrollTop <= 5;",
+                    top_header_visible = self._driver.execute_script(
+                        """
+                        const container = arguments[0];
+                        // ищем хедер профиля/аккаунта в истории чата
+                        const header = container.querySelector(
+                            "div[data-scope='messages_table'] img[alt='Аватар пользователя']"
+                        );
+                        if (!header) return false;
+                        const rect = header.getBoundingClientRect();
+                        const crect = container.getBoundingClientRect();
+                        // считаем, что "в самом верху", если картинка почти прижата к верхней части контейнера
+                        return rect.top <= crect.top + 10;
+                        """,
                         chat_container,
                     )
-                except StaleElementReferenceException:
-                    at_top = False
-
-                top_header_visible = False
-                if at_top:
-                    try:
-                        top_header_visible = self._driver.execute_script(
-                            """
-                            const container = arguments[0];
-                            // ищем хедер профиля/аккаунта в истории чата
-                            const header = container.querySelector(
-                                "div[data-scope='messages_table'] img[alt='Аватар пользователя']"
-                            );
-                            if (!header) return false;
-                            const rect = header.getBoundingClientRect();
-                            const crect = container.getBoundingClientRect();
-                            // считаем, что "в самом верху", если картинка почти прижата к верхней части контейнера
-                            return rect.top <= crect.top + 10;
-                            """,
-                            chat_container,
-                        )
-                    except Exception:
-                        top_header_visible = False
-
-                if at_top and top_header_visible and len(seen_html) == seen_before:
-                    top_header_rounds += 1
+                except Exception:
+                    top_header_visible = False
+
+            if at_top and top_header_visible and not got_new:
+                state.top_header_rounds += 1
+            else:
+                state.top_header_rounds = 0
+
+            # если несколько раундов подряд наверху видим "шапку" и новых bubble'ов нет — стоп, это начало чата
+            if state.top_header_rounds >= 3:
+                state.reached_start = True
+                state.done = True
+                return
+
+            # 5. Скролл ВВЕРХ: ждём подгрузки, а не фиксированную паузу
+            try:
+                if wait:
+                    result = self._scroller.step(chat_container, "up", count_selector=BUBBLE_SELECTOR)
+                    moved_or_loaded = result.moved or result.loaded
+                    waited = result.elapsed
                 else:
-                    top_header_rounds = 0
+                    # прогресс с прошлого захода: сдвинулись ли/выросла ли история
+                    nudge = self._scroller.nudge(chat_container, "up")
+                    now = time.monotonic()
+                    moved_or_loaded = (
+                        state.last_nudge is None
+                        or nudge.get("height") != state.last_nudge.get("height")
+                        or nudge.get("top_before") != state.last_nudge.get("top_after")
+                        or nudge.get("top_after") != nudge.get("top_before")
+                    )
+                    waited = now - state.last_nudge_at if state.last_nudge_at else 0.0
+                    state.last_nudge = nudge
+                    state.last_nudge_at = now
 
-                # если несколько раундов подряд наверху видим "шапку" и новых bubble'ов нет — стоп, это начало чата
-                if top_header_rounds >= 3:
-                    break
+                if not moved_or_loaded and not got_new:
+                    state.no_progress_wait += waited
+                else:
+                    state.no_progress_wait = 0.0
+
+                # долго нет ни движения, ни новых сообщений — выходим, чтобы не крутиться бесконечно.
+                # Само по себе scrollTop == 0 начала чата не доказывает (история могла
+                # не успеть подгрузиться): начало — только если наверху видна шапка профиля
+                if state.no_progress_wait >= NO_PROGRESS_PATIENCE:
+                    state.reached_start = state.reached_start or bool(at_top and top_header_visible)
+                    state.done = True
+                    return
 
-                # 5. Скролл ВВЕРХ маленькими шагами
+            except StaleElementReferenceException:
+                print("[WARN] StaleElementReference при скролле чата, пробую заново найти контейнер")
                 try:
-                    prev_top = self._driver.execute_script(
-                        "return arguments[0].scrollTop;",
-                        chat_container,
-                    )
-                    self._driver.execute_script(
-                        "arguments[0].scrollTop = arguments[0].scrollTop - 250;",
-                        chat_container,
-                    )
-                    time.sleep(1.2)
-                    new_top = self._driver.execute_script(
-                        "return arguments[0].scrollTop;",
-                        chat_container,
+                    bubbles_after = self._wait.until(
+                        lambda d: self._find_message_bubbles(record=False)
                     )
+                    state.chat_container = self._find_chat_container(bubbles_after[0])
+                    if not state.chat_container:
+                        print("[WARN] Не удалось восстановить контейнер чата, выхожу")
+                        state.done = True
+                except Exception:
+                    print("[WARN] Не удалось восстановиться после StaleElementReference")
+                    state.done = True
 
-                    if new_top == prev_top and len(seen_html) == seen_before:
-                        no_progress_rounds += 1
-                    else:
-                        no_progress_rounds = 0
+        except (NoSuchWindowException, InvalidSessionIdException):
+            # вкладка/браузер умерли — это решает вызывающий код
+            raise
+        except Exception as e:
+            print("[ERROR] Неожиданная ошибка при скролле/сборе сообщений:", repr(e))
+            state.done = True
 
-                    # очень много раундов без движения и без новых сообщений — выходим, чтобы не крутиться бесконечно
-                    if no_progress_rounds >= 12:
-                        break
+    def _dom_round(self, state: _ChatCollectState) -> bool:
+        """
+        Читает bubble'ы из DOM (observer / js / elements) в новый раунд state.batches.
+        Возвращает True, если появились новые bubble'ы.
+        """
+        chat_container = state.chat_container
+
+        # 3. Собираем текущие bubble'ы (все известные шаблоны)
+        items = None
+        if state.extraction_mode == "observer":
+            items = self._drain_bubble_observer(chat_container)
+            if items is None:
+                print("[WARN] MutationObserver для bubble'ов не установился, переключаюсь на js")
+                state.extraction_mode = "js"
+        if state.extraction_mode == "js":
+            items = self._extract_bubbles_js(chat_container)
+            if items is None:
+                print("[WARN] JS-экстрактор bubble'ов не сработал, переключаюсь на elements")
+                state.extraction_mode = "elements"
+        if items is None:
+            items = self._extract_bubbles_elements(state.chat_container, state.seen_keys)
+
+        seen_before = len(state.seen_keys)
+        batch: list[tuple[str, MessageSnapshot]] = []
+        state.batches.append(batch)
+
+        if all(item.get("top") is not None for item in items):
+            items = sorted(items, key=lambda item: item["top"])
+
+        for item in items:
+            key = item.get("key")
+            if not key or key in state.seen_keys:
+                continue
+            state.seen_keys.add(key)
 
-                except StaleElementReferenceException:
-                    print("[WARN] StaleElementReference при скролле чата, пробую заново найти контейнер")
-                    try:
-                        bubbles_after = self._wait.until(
-                            lambda d: self._find_message_bubbles()
-                        )
-                        any_bubble = bubbles_after[0]
-                        chat_container = self._driver.execute_script(
-                            """
-                            let el = arguments[0];
-                            while (el && el.parentElement) {
-                                el = el.parentElement;
-                                const st = window.getComputedStyle(el);
-                                const oy = st.overflowY;
-                                if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
-                                    return el;
-                                }
-                            }
-                            return null;
-                            """,
-                            any_bubble,
-                        )
-                        if not chat_container:
-                            print("[WARN] Не удалось восстановить контейнер чата, выхожу")
-                            break
-                    except Exception:
-                        print("[WARN] Не удалось восстановиться после StaleElementReference")
-                        break
+            # одинаковые тексты не склеиваем: дубли отсекает ключ узла,
+            # а в БД — msg_hash (см. _iter_chronological)
+            text = (item.get("text") or "").strip()
+            if not text:
+                continue
 
-            except Exception as e:
-                print("[ERROR] Неожиданная ошибка при скролле/сборе сообщений:", repr(e))
-                break
+            sender = item.get("sender") or "unknown"
+
+            snapshot = MessageSnapshot(
+                contact_username=state.contact_username,
+                sender=sender,
+                text=text,
+                timestamp_utc=None,
+                scraped_at_utc=state.scraped_at,
+            )
+            batch.append((key, snapshot))
+
+            if state.stop_at_text and state.stop_at_text in text:
+                state.done = True
+                return True
+
+        got_new = len(state.seen_keys) != seen_before
+
+        # Дошли до уже сохранённых сообщений — дальше скроллить незачем
+        if state.watermark:
+            covered = self._find_watermark(chat_container, state.watermark)
+            if covered is not None:
+                print(f"[DEBUG] {state.contact_username}: найден watermark, останавливаю скролл")
+                state.drop_keys = set(covered)
+                state.done = True
+        return got_new
+
+    def _capture_round(self, state: _ChatCollectState) -> bool:
+        """
+        Раунд режима захвата: HTML контейнера чата (с пометками data-mygram-*)
+        уходит в шард как есть, разбор — потом, в client.parse_shards.
+        Возвращает True, если на экране появились новые bubble'ы.
+        """
+        result = self._driver.execute_script(
+            _JS_CAPTURE_CHAT_HTML,
+            state.chat_container,
+            self._selectors.css("bubble"),
+            list(SELF_SENDER_PREFIXES),
+        ) or {}
+        html = result.get("html") or ""
+        if html:
+            state.shard.write_round(html)
+        got_new = bool(result.get("fresh"))
+
+        if state.watermark:
+            covered = self._find_watermark(state.chat_container, state.watermark)
+            if covered is not None:
+                print(f"[DEBUG] {state.contact_username}: найден watermark, останавливаю скролл")
+                state.drop_keys = set(covered)
+                state.done = True
+        return got_new
+
+    def _network_round(self, state: _ChatCollectState) -> bool:
+        """
+        Забирает из сети страницы истории открытого диалога в новый раунд.
+        Возвращает True, если пришли новые сообщения. Если за несколько раундов
+        не пришло ни одного ответа — переключает чат на DOM ("observer").
+        """
+        pages = self._network_capture().drain_thread_pages(
+            state.contact_username,
+            state.scraped_at,
+            thread_id=state.thread_id,
+        )
+        if not pages:
+            state.network_empty_rounds += 1
+            if state.network_empty_rounds >= 3 and not state.seen_keys:
+                print("[WARN] Нет JSON-ответов с историей диалога, переключаюсь на observer")
+                state.extraction_mode = "observer"
+            return False
+
+        seen_before = len(state.seen_keys)
+        batch: list[tuple[str, MessageSnapshot]] = []
+        state.batches.append(batch)
+
+        for page in pages:
+            if page.has_older is False:
+                state.reached_start = True
+            for key, snapshot in page.messages:
+                if key in state.seen_keys:
+                    continue
+                state.seen_keys.add(key)
+                batch.append((key, snapshot))
+                if state.stop_at_text and state.stop_at_text in snapshot.text:
+                    state.done = True
+
+        batch.sort(key=lambda pair: pair[1].timestamp_utc or state.scraped_at)
+        got_new = len(state.seen_keys) != seen_before
+
+        if state.watermark:
+            covered = self._watermark_keys(state)
+            if covered is not None:
+                print(f"[DEBUG] {state.contact_username}: найден watermark, останавливаю скролл")
+                state.drop_keys = covered
+                state.done = True
+
+        if state.reached_start:
+            # сервер сказал, что старее сообщений нет
+            state.done = True
+        return got_new
+
+    @staticmethod
+    def _watermark_keys(state: _ChatCollectState) -> Optional[set[str]]:
+        """
+        Ищет watermark в уже собранных сообщениях (от старых к новым).
+        Возвращает ключи watermark'а и всего, что старше, или None.
+        """
+        ordered = [pair for batch in reversed(state.batches) for pair in batch]
+        texts = [snapshot.text for _, snapshot in ordered]
+        n = len(state.watermark)
+        for end in range(len(texts) - 1, n - 2, -1):
+            if texts[end - n + 1 : end + 1] == state.watermark:
+                return {key for key, _ in ordered[: end + 1]}
+        return None
+
+    def _finish_chat_collect(self, state: _ChatCollectState) -> list[MessageSnapshot]:
+        self._scroll_depths[state.contact_username] = state.rounds
+        self._reached_start[state.contact_username] = state.reached_start
+        if state.extraction_mode == "observer" and state.chat_container is not None:
+            self._disconnect_bubble_observer(state.chat_container)
+        if state.shard is not None:
+            # режим захвата: сообщения появятся после client.parse_shards
+            state.shard.close({
+                "drop_keys": sorted(state.drop_keys),
+                "rounds": state.rounds,
+                "reached_start": state.reached_start,
+            })
+            return []
+        return list(self._iter_chronological(state))
+
+    @staticmethod
+    def _iter_chronological(state: _ChatCollectState) -> Iterator[MessageSnapshot]:
+        """
+        Сообщения чата от старых к новым, см. iter_chronological.
+        """
+        spool, state.spool = state.spool, None
+        return iter_chronological(state.batches, state.drop_keys, spool, reached_start=state.reached_start)
+
+    def _find_watermark(self, chat_container, watermark: List[str]) -> Optional[list[str]]:
+        """
+        Проверяет, виден ли в чате watermark. Возвращает ключи bubble'ов, которые
+        уже есть в БД (watermark и всё выше него), или None.
+        """
+        try:
+            return self._driver.execute_script(
+                _JS_FIND_WATERMARK,
+                chat_container,
+                self._selectors.css("bubble"),
+                list(SELF_SENDER_PREFIXES),
+                list(watermark),
+            )
+        except StaleElementReferenceException:
+            raise
+        except Exception as e:
+            print("[WARN] Ошибка поиска watermark:", repr(e))
+            return None
+
+    def _drain_bubble_observer(self, chat_container) -> Optional[list[dict]]:
+        """
+        Забирает bubble'ы, накопленные MutationObserver'ом с прошлого вызова.
+        Если observer на контейнере ещё нет (первый раунд или контейнер
+        перерисовался) — устанавливает его; тогда первый drain вернёт все
+        bubble'ы текущего экрана. None — установить observer не удалось.
+        """
+        try:
+            items = self._driver.execute_script(_JS_DRAIN_BUBBLE_OBSERVER, chat_container)
+            if items is None:
+                self._driver.execute_script(
+                    _JS_INSTALL_BUBBLE_OBSERVER,
+                    chat_container,
+                    self._selectors.css("bubble"),
+                    list(SELF_SENDER_PREFIXES),
+                )
+                items = self._driver.execute_script(_JS_DRAIN_BUBBLE_OBSERVER, chat_container)
+        except StaleElementReferenceException:
+            raise
+        except Exception as e:
+            print("[WARN] Ошибка MutationObserver для bubble'ов:", repr(e))
+            return None
+        if not isinstance(items, list):
+            return None
+        return items
+
+    def _disconnect_bubble_observer(self, chat_container) -> None:
+        try:
+            self._driver.execute_script(_JS_DISCONNECT_BUBBLE_OBSERVER, chat_container)
+        except Exception:
+            pass
+
+    def _extract_bubbles_js(self, chat_container) -> Optional[list[dict]]:
+        """
+        Читает все bubble'ы внутри контейнера чата одним execute_script.
+        Возвращает список {key, text, sender, top} или None, если скрипт упал
+        (тогда вызывающий код откатывается на _extract_bubbles_elements).
+        StaleElementReferenceException пробрасывается наверх — контейнер надо искать заново.
+        """
+        try:
+            items = self._driver.execute_script(
+                _JS_EXTRACT_BUBBLES,
+                chat_container,
+                self._selectors.css("bubble"),
+                list(SELF_SENDER_PREFIXES),
+            )
+        except StaleElementReferenceException:
+            raise
+        except Exception as e:
+            print("[WARN] Ошибка JS-экстрактора bubble'ов:", repr(e))
+            return None
+        if not isinstance(items, list):
+            return None
+        return items
+
+    def _extract_bubbles_elements(self, chat_container, seen_keys: set[str]) -> list[dict]:
+        """
+        Старый путь: обходит WebElement'ы bubble'ов по одному (XPath к тексту, .text).
+        Ключи узлов (nodeKey) и отправители новых bubble'ов берутся пачкой —
+        по одному execute_script. Возвращает тот же формат, что и _extract_bubbles_js.
+        Для уже виденных bubble'ов текст и отправитель не запрашиваются.
+        """
+        bubbles = self._find_message_bubbles(chat_container)
+        if not bubbles:
+            return []
+        try:
+            keys = self._driver.execute_script(_JS_NODE_KEYS, bubbles)
+        except StaleElementReferenceException:
+            raise
+        except Exception as e:
+            print("[WARN] Не удалось получить ключи bubble'ов:", repr(e))
+            return []
+
+        items: list[dict] = []
+        fresh: list = []
+        for bubble, key in zip(bubbles, keys or []):
+            if not key or key in seen_keys:
+                continue
+
+            # Текст сообщения
+            try:
+                text_nodes = bubble.find_elements(
+                    By.XPATH,
+                    ".//*[@dir='auto' and normalize-space(text())!='']",
+                )
+                text = text_nodes[0].text.strip() if text_nodes else ""
+            except StaleElementReferenceException:
+                continue
+
+            items.append({"key": key, "text": text, "sender": "unknown", "top": None})
+            fresh.append(bubble)
+
+        for item, sender in zip(items, self._classify_senders(chat_container, fresh)):
+            item["sender"] = sender
+        return items
+
+    def _classify_senders(self, chat_container, bubbles: list) -> list[str]:
+        """
+        Отправители ('self' / 'peer' / 'unknown') для пачки bubble'ов за один
+        execute_script — по выравниванию, аватару и заголовку "Вы отправили".
+        """
+        if not bubbles:
+            return []
+        try:
+            senders = self._driver.execute_script(
+                _JS_CLASSIFY_SENDERS,
+                chat_container,
+                bubbles,
+                list(SELF_SENDER_PREFIXES),
+            )
+        except StaleElementReferenceException:
+            raise
+        except Exception as e:
+            print("[WARN] Ошибка определения отправителей:", repr(e))
+            senders = None
+        if not isinstance(senders, list) or len(senders) != len(bubbles):
+            return ["unknown"] * len(bubbles)
+        return [s or "unknown" for s in senders]
 
-        return snapshots
     # ------------------ Вспомогательные методы ------------------ #
 
     def _open_direct(self) -> None:
         """
         Открывает страницу Direct и ждёт, пока прогрузится список диалогов.
         """
-        # 0. Пытаемся загрузить cookies и открыть Direct без логина
-        import time
-        if self._load_cookies_if_exist():
-            self._driver.get(f"{self._base_url}/direct/inbox/")
-            time.sleep(3)
-            if "/login" not in self._driver.current_url:
-                # авторизация успешна
-                wait = WebDriverWait(self._driver, 60)
-                wait.until(
-                    EC.presence_of_element_located(
-                        (By.CSS_SELECTOR, "div[role='button'][tabindex='0'] span[title]")
-                    )
-                )
-                return
-            print("[INFO] Cookies существуют, но недействительны — нужен логин.")
-        # 1. Фолбэк: просим пользователя залогиниться
-        print("[LOGIN] Выполните вход вручную. После логина я сохраню cookies автоматически.")
-        self._driver.get(f"{self._base_url}/accounts/login/")
-        time.sleep(5)
-        WebDriverWait(self._driver, 300).until(
-            lambda d: "/direct" in d.current_url or "/inbox" in d.current_url
-        )
-        time.sleep(3)
-        # 2. Сохраняем cookies после успешного входа
-        self._save_cookies()
+        self._locator.invalidate()
+        self._session.ensure_session()
 
     def _scroll_threads_list(self, max_scrolls: int = 25) -> None:
         """
@@ -812,15 +1854,12 @@ class InstagramDirectClient:
         """
         Собирает сырые элементы карточек диалогов.
 
-        Берём общий селектор:
-        - div[role='button'][tabindex='0'] — это кликабельные карточки,
-        - фильтрацию по span[title] делаем уже при парсинге.
+        Берём лучшую по статистике стратегию (обычно div[role='button'][tabindex='0'] —
+        кликабельные карточки), внутри контейнера списка, если он уже найден;
+        фильтрацию по span[title] делаем уже при парсинге.
         """
-        elements = self._driver.find_elements(
-            By.CSS_SELECTOR,
-            "div[role='button'][tabindex='0']",
-        )
-        print(f"[DEBUG] Найдено сырых элементов диалогов: {len(elements)}")
+        strategy, elements = self._selectors.find("card", root=self._locator.peek("inbox"))
+        print(f"[DEBUG] Найдено сырых элементов диалогов: {len(elements)} ({strategy or '—'})")
         return elements
 
     def _parse_thread_element(
@@ -831,72 +1870,7 @@ class InstagramDirectClient:
         """
         Извлекает данные из HTML одной карточки диалога и превращает их в ContactSnapshot.
         Если что-то пошло не так — возвращает None.
+        Для списка карточек дешевле ContactCardParser.parse_cards.
         """
-        try:
-            soup = BeautifulSoup(outer_html, "html.parser")
-
-            # 1) Имя / username
-            name_span = None
-
-            # сначала пробуем найти span[title]
-            name_span = soup.select_one("span[title]")
-            if name_span is None:
-                # fallback: любой span с текстом внутри карточки
-                span_with_text = None
-                for sp in soup.select("span"):
-                    txt = (sp.get_text(strip=True) or "").strip()
-                    if txt:
-                        span_with_text = sp
-                        break
-                name_span = span_with_text
-
-            # если вообще не нашли имя — пропускаем карточку
-            if name_span is None:
-                return None
-
-            name_title = (name_span.get("title") or "").strip()
-            name_text = (name_span.get_text(strip=True) or "").strip()
-
-            # username всегда берём из title, если он есть; иначе из текста
-            username = name_title or name_text
-            if not username:
-                return None
-
-            full_name: Optional[str] = None  # пока не вытаскиваем отдельно
-
-            # 2) Превью последнего сообщения
-            preview_text: Optional[str] = None
-            for sp in soup.select("span"):
-                if sp.has_attr("title"):
-                    continue
-                txt = (sp.get_text(strip=True) or "").strip()
-                if txt:
-                    preview_text = txt
-                    break
-
-            # 👉 фильтр: если нет превью — не считаем это диалогом
-            if not preview_text:
-                return None
-
-            # 3) Строка времени (abbr[aria-label])
-            abbr = soup.select_one("abbr[aria-label]")
-            if abbr is None:
-                # 👉 нет времени → это не карточка чата (скорее всего шапка или заметка)
-                return None
-
-            time_str = (abbr.get("aria-label") or "").strip()
-            # пока time_str никак не парсим в datetime, оставляем last_message_at_utc=None
-
-            snapshot = ContactSnapshot(
-                username=username,
-                full_name=full_name,
-                profile_url=None,
-                is_active=True,
-                last_message_preview=preview_text,
-                last_message_at_utc=None,
-                scraped_at_utc=scraped_at_utc,
-            )
-            return snapshot
-        except Exception as e:
-            print("[ERROR] Не удалось распарсить карточку из HTML:", repr(e))
-            return None
\ No newline at end of file
+        parsed = self._card_parser.parse_cards([outer_html], scraped_at_utc)
+        return parsed[0] if parsed else None
\ No newline at end of file
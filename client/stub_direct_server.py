@@ -0,0 +1,199 @@
+# client/stub_direct_server.py
+#
+# Локальный стенд Direct для проверки extraction_mode="network" без Instagram.
+# Отдаёт записанные JSON-ответы (NetworkCapture(record_dir=...)) по тем же путям,
+# что и веб-клиент Instagram, и простую страницу чата, которая подгружает
+# историю через XHR при скролле вверх.
+#
+#     python -m client.stub_direct_server --payloads recorded/ --port 8765
+#
+# Раскладка записи: <payloads>/<thread_id>/page_000.json, page_001.json, ...
+# (page_000 — самые новые сообщения). Дальше клиент указывает на стенд:
+#
+#     client = InstagramDirectClient(create_driver(network_log=True), base_url="http://127.0.0.1:8765")
+#     client.fetch_messages_for_contact("username", thread_id="<thread_id>", extraction_mode="network")
+
+from __future__ import annotations
+
+import argparse
+import html
+import json
+import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+_CHAT_RE = re.compile(r"^/direct/t/([^/]+)/?$")
+_API_RE = re.compile(r"^/api/v1/direct_v2/threads/([^/]+)/?$")
+
+_CHAT_PAGE = """<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>Direct stub</title></head>
+<body>
+<main role="main">
+  <a href="/__USERNAME__/"><span title="__USERNAME__">__USERNAME__</span></a>
+  <div id="history" style="height: 600px; overflow-y: auto;">
+    <div data-scope="messages_table" id="header"></div>
+    <div id="items"></div>
+  </div>
+</main>
+<script>
+const threadId = "__THREAD_ID__";
+const historyBox = document.getElementById("history");
+const list = document.getElementById("items");
+const header = document.getElementById("header");
+let cursor = 0;
+let hasOlder = true;
+let loading = false;
+
+function render(item, viewerId) {
+    const row = document.createElement("div");
+    if (String(item.user_id) === String(viewerId)) {
+        const h6 = document.createElement("h6");
+        h6.innerText = "You sent";
+        row.appendChild(h6);
+    }
+    const bubble = document.createElement("div");
+    bubble.setAttribute("role", "button");
+    bubble.setAttribute("aria-label", "Double tap to like");
+    const text = document.createElement("div");
+    text.setAttribute("dir", "auto");
+    text.textContent = item.text || (item.link && item.link.text) || "";
+    bubble.appendChild(text);
+    row.appendChild(bubble);
+    return row;
+}
+
+async function loadOlder() {
+    if (loading || !hasOlder) return;
+    loading = true;
+    const resp = await fetch(`/api/v1/direct_v2/threads/${threadId}/?cursor=${cursor}`);
+    if (resp.ok) {
+        const payload = await resp.json();
+        const thread = payload.thread || {};
+        const items = (thread.items || []).slice().reverse();
+        const before = historyBox.scrollHeight;
+        const frag = document.createDocumentFragment();
+        for (const item of items) {
+            frag.appendChild(render(item, payload.viewer_id));
+        }
+        list.insertBefore(frag, list.firstChild);
+        historyBox.scrollTop += historyBox.scrollHeight - before;
+        hasOlder = thread.has_older !== false;
+        cursor += 1;
+    } else {
+        hasOlder = false;
+    }
+    if (!hasOlder && !header.firstChild) {
+        // шапка чата появляется только когда история закончилась
+        const avatar = document.createElement("img");
+        avatar.alt = "Аватар пользователя";
+        header.appendChild(avatar);
+    }
+    loading = false;
+}
+
+historyBox.addEventListener("scroll", () => {
+    if (historyBox.scrollTop < 50) loadOlder();
+});
+loadOlder().then(() => { historyBox.scrollTop = historyBox.scrollHeight; });
+</script>
+</body>
+</html>
+"""
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    payload_dir = "."
+
+    def log_message(self, fmt, *args) -> None:  # не засоряем вывод
+        pass
+
+    def _send(self, code: int, body: bytes, content_type: str) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _pages(self, thread_id: str) -> List[str]:
+        directory = os.path.join(self.payload_dir, os.path.basename(thread_id))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.startswith("page_") and name.endswith(".json")
+        )
+
+    def _username(self, thread_id: str) -> Optional[str]:
+        pages = self._pages(thread_id)
+        if not pages:
+            return None
+        with open(pages[0], "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        users = (payload.get("thread") or {}).get("users") or []
+        return users[0].get("username") if users else None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+
+        match = _CHAT_RE.match(url.path)
+        if match:
+            thread_id = match.group(1)
+            username = self._username(thread_id)
+            if username is None:
+                self._send(404, b"unknown thread", "text/plain")
+                return
+            page = (
+                _CHAT_PAGE.replace("__USERNAME__", html.escape(username))
+                .replace("__THREAD_ID__", html.escape(thread_id))
+            )
+            self._send(200, page.encode("utf-8"), "text/html; charset=utf-8")
+            return
+
+        match = _API_RE.match(url.path)
+        if match:
+            pages = self._pages(match.group(1))
+            try:
+                cursor = int(parse_qs(url.query).get("cursor", ["0"])[0])
+            except ValueError:
+                cursor = 0
+            if not 0 <= cursor < len(pages):
+                self._send(404, b"{}", "application/json")
+                return
+            with open(pages[cursor], "rb") as f:
+                self._send(200, f.read(), "application/json")
+            return
+
+        self._send(404, b"not found", "text/plain")
+
+
+def serve(payload_dir: str, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """
+    Создаёт сервер стенда (без запуска) — удобно поднимать в отдельном потоке.
+    """
+    handler = type("StubHandler", (_StubHandler,), {"payload_dir": payload_dir})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Локальный стенд Instagram Direct с записанными ответами")
+    parser.add_argument("--payloads", required=True, help="папка с записями <thread_id>/page_NNN.json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    server = serve(args.payloads, args.host, args.port)
+    print(f"[STUB] Direct-стенд на http://{args.host}:{args.port}/direct/t/<thread_id>/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,29 @@
 # client/sync_contacts_from_direct.py
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+import argparse
+from typing import List, Optional
 
+from client.driver_factory import create_driver
 from client.selenium_direct import InstagramDirectClient
 from db.contact_repository import ContactRepository
 
 
-def main():
-    print("Запускаю Chrome для парсинга контактов...")
-    options = Options()
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument("--start-maximized")
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Парсинг контактов из Instagram Direct")
+    parser.add_argument(
+        "--capture-dir",
+        default=None,
+        help="режим захвата: только скроллить и писать HTML списка диалогов в шард; "
+             "разбор и загрузка — python -m client.parse_shards <папка>",
+    )
+    return parser.parse_args(argv)
+
 
-    driver = webdriver.Chrome(options=options)
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    print("Запускаю Chrome для парсинга контактов...")
+    # MYGRAM_LEAN_BROWSER=1 — лёгкий профиль без картинок/медиа/шрифтов
+    driver = create_driver()
     client = InstagramDirectClient(driver)
 
     contacts_repo = ContactRepository()
@@ -25,6 +35,12 @@ def main():
         # - если они не валидны или отсутствуют — просит залогиниться и сохраняет новые
         client._open_direct()
 
+        if args.capture_dir:
+            print("Захватываю HTML списка диалогов...")
+            client.capture_contacts(args.capture_dir, max_scrolls=25)
+            print(f"[OK] Разбор: python -m client.parse_shards {args.capture_dir}")
+            return
+
         print("Парсю контакты из Direct...")
         snapshots = client.fetch_contacts(max_scrolls=25)
         print(f"Собрано контактов: {len(snapshots)}")
@@ -35,7 +51,7 @@ def main():
 
         # Сохраняем контакты в БД (название метода подстрой под свой репозиторий)
         saved = contacts_repo.bulk_upsert(snapshots)
-        print(f"[OK] В БД обновлено/добавлено контактов: {saved}")
+        print(f"[OK] Контакты в БД: {saved}")
 
     except KeyboardInterrupt:
         print("\n[INFO] Остановлено пользователем (Ctrl+C)")
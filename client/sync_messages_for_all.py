@@ -1,69 +1,391 @@
 # client/sync_messages_for_all.py
 
+import argparse
 import time
+from typing import List, Optional, Tuple
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-
+from client.driver_factory import create_driver
+from client.driver_supervisor import DriverSupervisor
+from client.memory_governor import MemoryGovernor
+from client.network_capture import NetworkCapture
 from client.selenium_direct import InstagramDirectClient
+from client.sync_pool import SyncWorkerPool
+from core.models import ContactSnapshot
 from db.contact_repository import ContactRepository
 from db.message_repository import MessageRepository
+from db.message_writer import BackgroundMessageWriter
+from db.sync_run_repository import RUN_DONE, SyncRunRepository
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Парсинг сообщений всех контактов из БД")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="сколько браузеров запускать параллельно (1 — один Chrome, как раньше)",
+    )
+    parser.add_argument("--headless", action="store_true", help="воркеры пула без окна браузера")
+    parser.add_argument(
+        "--lean",
+        action="store_true",
+        default=None,
+        help="лёгкий профиль Chrome: без картинок, медиа и шрифтов (по умолчанию — MYGRAM_LEAN_BROWSER)",
+    )
+    parser.add_argument(
+        "--tabs",
+        type=int,
+        default=1,
+        help="сколько чатов вести параллельно во вкладках одного Chrome (без --workers)",
+    )
+    parser.add_argument(
+        "--memory-governor",
+        action="store_true",
+        help="для очень длинных чатов: следить за памятью браузера, схлопывать DOM "
+             "и писать сообщения в БД чанками",
+    )
+    parser.add_argument(
+        "--network",
+        action="store_true",
+        help="читать историю из JSON-ответов Direct (сетевой лог Chrome), а не из DOM; "
+             "если ответов нет — сбор сам переключится на DOM",
+    )
+    parser.add_argument(
+        "--record-dir",
+        default=None,
+        help="с --network (без --workers): сохранять разобранные ответы в эту папку "
+             "(стенд: python -m client.stub_direct_server --payloads <папка>)",
+    )
+    parser.add_argument(
+        "--capture-dir",
+        default=None,
+        help="режим захвата: только скроллить и писать HTML чатов в шарды этой папки; "
+             "разбор и загрузка — python -m client.parse_shards <папка>",
+    )
+    parser.add_argument(
+        "--resume",
+        type=int,
+        nargs="?",
+        const=-1,
+        default=None,
+        metavar="RUN_ID",
+        help="продолжить прогон (по умолчанию — последний незавершённый): готовые контакты "
+             "пропускаются, упавшие повторяются",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="сколько всего попыток даётся контакту при --resume",
+    )
+    parser.add_argument("--history", action="store_true", help="показать последние прогоны и выйти")
+    parser.add_argument(
+        "--command-timeout",
+        type=float,
+        default=120.0,
+        help="сколько секунд ждать ответа на одну команду драйвера, прежде чем "
+             "считать браузер зависшим и перезапустить его",
+    )
+    parser.add_argument(
+        "--max-restarts",
+        type=int,
+        default=5,
+        help="сколько раз за прогон можно перезапускать упавший/зависший браузер",
+    )
+    return parser.parse_args(argv)
+
+
+def extraction_mode(args: argparse.Namespace) -> str:
+    return "network" if args.network else "observer"
+
+
+def print_history(runs: SyncRunRepository, limit: int = 10) -> None:
+    for r in runs.history(limit):
+        print(
+            f"#{r.run_id} {r.started_at_utc[:19]} {r.mode:<10} {r.status:<11} "
+            f"контактов {r.contacts_done}/{r.contacts_total}, ошибок {r.contacts_failed}, "
+            f"сообщений {r.messages_saved}, {r.contacts_per_minute:.1f} контактов/мин, "
+            f"{r.messages_per_second:.1f} сообщений/с"
+        )
+
+
+def prepare_run(
+    runs: SyncRunRepository,
+    contacts: List[ContactSnapshot],
+    mode: str,
+    resume: Optional[int],
+    max_attempts: int,
+) -> Tuple[int, List[ContactSnapshot]]:
+    """
+    Новый прогон по всем контактам или продолжение старого (--resume):
+    возвращает id прогона и контакты, которые осталось обработать.
+    """
+    run_id = None
+    if resume is not None:
+        run_id = runs.latest_unfinished() if resume < 0 else resume
+        if run_id is None:
+            print("[INFO] Незавершённых прогонов нет — начинаю новый.")
+    if run_id is None:
+        run_id = runs.start_run(mode, [c.username for c in contacts])
+        print(f"[INFO] Прогон #{run_id}, контактов: {len(contacts)}")
+        return run_id, contacts
+
+    by_username = {c.username: c for c in contacts}
+    todo = [by_username[u] for u in runs.resume_run(run_id, max_attempts) if u in by_username]
+    print(f"[INFO] Продолжаю прогон #{run_id}: осталось контактов {len(todo)}")
+    return run_id, todo
+
 
+def finish_run(runs: SyncRunRepository, run_id: int, interrupted: bool) -> None:
+    status = runs.finish_run(run_id, interrupted=interrupted)
+    if status == RUN_DONE:
+        print(f"[INFO] Прогон #{run_id} завершён.")
+    else:
+        print(f"[INFO] Прогон #{run_id}: {status}. Продолжить: --resume {run_id}")
 
-def main():
-    print("Запускаю Chrome...")
-    options = Options()
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument("--start-maximized")
 
-    driver = webdriver.Chrome(options=options)
-    client = InstagramDirectClient(driver)
+def run_pool(
+    contacts: List[ContactSnapshot],
+    args: argparse.Namespace,
+    runs: SyncRunRepository,
+    run_id: int,
+) -> None:
+    print(f"Воркеров: {args.workers}")
+    pool = SyncWorkerPool(
+        workers=args.workers,
+        headless=args.headless,
+        lean=args.lean,
+        max_scrolls=12,
+        extraction_mode=extraction_mode(args),
+        command_timeout=args.command_timeout,
+        max_restarts=args.max_restarts,
+    )
+    pool.run(contacts, ContactRepository(), MessageRepository(), runs=runs, run_id=run_id)
+    if pool.leftover:
+        print(f"----- Остановлено: не обработано контактов {len(pool.leftover)}. Продолжить: --resume {run_id} -----")
+    else:
+        print("----- Готово. Все контакты обработаны. -----")
 
-    # 🔐 Авто-логин:
-    # - если есть валидные cookies → сразу зайдёт в Direct;
-    # - если cookies нет/протухли → откроет страницу логина и будет
-    #   ждать, пока ты вручную залогинишься и попадёшь в Direct.
-    #   Никаких input() в консоли.
-    client._open_direct()
 
-    # Репозитории
+def run_tabs(
+    client: InstagramDirectClient,
+    contacts: List[ContactSnapshot],
+    tabs: int,
+    runs: SyncRunRepository,
+    run_id: int,
+    mode: str = "observer",
+) -> None:
     contacts_repo = ContactRepository()
     messages_repo = MessageRepository()
 
-    # Загружаем список всех контактов из БД
-    contacts = contacts_repo.list_all()
-    print(f"Найдено контактов в БД: {len(contacts)}")
+    # чаты идут параллельно — длительность контакта считаем от предыдущего готового
+    last_done = time.monotonic()
+    failed = 0
+    pipeline = client.fetch_messages_pipelined(
+        contacts,
+        tabs=tabs,
+        max_scrolls=12,
+        extraction_mode=mode,
+        on_start=lambda c: runs.mark_in_progress(run_id, c.username),
+    )
+    for c, messages in pipeline:
+        username = c.username
+        now = time.monotonic()
+        if messages is None:
+            # не помечаем готовым: --resume повторит контакт
+            runs.mark_failed(run_id, username, "чат не открылся или сбор упал", now - last_done)
+            last_done = now
+            print(f"[Ошибка] {username}: сообщения не получены")
+            failed += 1
+            continue
+
+        thread_id = client.thread_id_for(username)
+        if thread_id and thread_id != c.thread_id:
+            contacts_repo.set_thread_id(username, thread_id)
+
+        inserted_count = messages_repo.bulk_insert(messages) if messages else 0
+        runs.mark_done(run_id, username, inserted_count, client.scroll_depth_for(username), now - last_done)
+        last_done = now
+        print(f"[OK] {username}: сохранено сообщений: {inserted_count}")
 
+    if failed:
+        print(f"----- Готово, но не собрано контактов: {failed}. Повторить: --resume {run_id} -----")
+    else:
+        print("----- Готово. Все контакты обработаны. -----")
+
+
+def run_capture(
+    supervisor: DriverSupervisor,
+    contacts: List[ContactSnapshot],
+    capture_dir: str,
+    runs: SyncRunRepository,
+    run_id: int,
+) -> None:
     for c in contacts:
-        username = c.username
         print("=" * 60)
-        print(f"Парсю сообщения с пользователем: {username}")
-
+        print(f"Захватываю HTML чата с пользователем: {c.username}")
+        started = time.monotonic()
+        runs.mark_in_progress(run_id, c.username)
         try:
-            # max_scrolls можешь регулировать, если нужно глубже/мельче
-            messages = client.fetch_messages_for_contact(
-                username=username,
-                max_scrolls=12,
+            supervisor.run(
+                c.username,
+                lambda client: client.capture_messages_for_contact(
+                    c.username, capture_dir, max_scrolls=12, thread_id=c.thread_id
+                ),
             )
         except Exception as e:
-            print(f"[Ошибка] Не удалось получить сообщения {username}: {e}")
+            runs.mark_failed(run_id, c.username, repr(e), time.monotonic() - started)
+            print(f"[Ошибка] Не удалось захватить чат {c.username}: {e}")
             continue
+        depth = supervisor.client.scroll_depth_for(c.username)
+        runs.mark_done(run_id, c.username, 0, depth, time.monotonic() - started)
+        time.sleep(1)
 
-        print(f"[DEBUG] Собрано сообщений: {len(messages)}")
+    print("----- Готово. Разбор: python -m client.parse_shards " + capture_dir + " -----")
 
-        if messages:
-            inserted_count = messages_repo.bulk_insert(messages)
-        else:
-            inserted_count = 0
 
-        print(f"[OK] Сохранено сообщений: {inserted_count}")
+def run_sequential(
+    supervisor: DriverSupervisor,
+    contacts: List[ContactSnapshot],
+    full_history: bool,
+    runs: SyncRunRepository,
+    run_id: int,
+    mode: str = "observer",
+) -> None:
+    """
+    Контакты по одному; сообщения пишутся в БД пачками по ходу скролла
+    фоновым потоком (BackgroundMessageWriter) — при сбое посередине чата
+    собранное уже сохранено, а запись не тормозит браузер.
+    """
+    contacts_repo = ContactRepository()
+    messages_repo = MessageRepository()
+    writer = BackgroundMessageWriter(messages_repo).start()
+    # без max_scrolls (full_history, --memory-governor) — листаем до начала чата
+    max_scrolls = 0 if full_history else 12
+    # сохранённые до отпечатков — тоже до начала чата, затем их строки удаляются
+    legacy = messages_repo.legacy_contacts()
+
+    try:
+        for c in contacts:
+            username = c.username
+            print("=" * 60)
+            print(f"Парсю сообщения с пользователем: {username}")
+            started = time.monotonic()
+            runs.mark_in_progress(run_id, username)
 
-        # небольшая пауза между контактами, чтобы не спамить Instagram
-        time.sleep(1)
+            try:
+                # упавший/зависший браузер супервизор перезапустит и повторит контакт;
+                # повтор безопасен: уже записанное отсеется по msg_hash
+                streamed = supervisor.run(
+                    username,
+                    lambda client: client.stream_messages_for_contact(
+                        username,
+                        sink=writer.submit,
+                        max_scrolls=0 if username in legacy else max_scrolls,
+                        extraction_mode=mode,
+                        thread_id=c.thread_id,
+                    ),
+                )
+                inserted_count = writer.drain(username)
+            except Exception as e:
+                try:
+                    saved = writer.drain(username)
+                except RuntimeError:
+                    saved = 0
+                runs.mark_failed(run_id, username, repr(e), time.monotonic() - started)
+                print(f"[Ошибка] Не удалось получить сообщения {username}: {e} (успели сохранить {saved})")
+                continue
+
+            # запоминаем id диалога, чтобы в следующий раз открыть его по прямой ссылке
+            client = supervisor.client
+            thread_id = client.thread_id_for(username)
+            if thread_id and thread_id != c.thread_id:
+                contacts_repo.set_thread_id(username, thread_id)
+            if username in legacy and client.reached_start_for(username):
+                dropped = messages_repo.drop_legacy(username)
+                print(f"[INFO] Чат пересобран целиком, удалено строк старого формата: {dropped}")
+
+            runs.mark_done(run_id, username, inserted_count, client.scroll_depth_for(username), time.monotonic() - started)
+            print(f"[DEBUG] Собрано сообщений: {streamed}")
+            print(f"[OK] Сохранено сообщений: {inserted_count}")
+
+            # небольшая пауза между контактами, чтобы не спамить Instagram
+            time.sleep(1)
+    finally:
+        writer.close()
+        print(f"[DEBUG] Запись в БД: {writer.report()}")
 
     print("----- Готово. Все контакты обработаны. -----")
-    client.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    runs = SyncRunRepository()
+    runs.init_schema()
+    if args.history:
+        print_history(runs)
+        return
+
+    # Загружаем список всех контактов из БД
+    contacts = ContactRepository().list_all()
+    print(f"Найдено контактов в БД: {len(contacts)}")
+
+    if args.workers > 1:
+        mode = "pool"
+    elif args.tabs > 1:
+        mode = "tabs"
+    elif args.capture_dir:
+        mode = "capture"
+    elif args.memory_governor:
+        mode = "governor"
+    else:
+        mode = "sequential"
+    run_id, contacts = prepare_run(runs, contacts, mode, args.resume, args.max_attempts)
+
+    interrupted = True
+    supervisor = None
+    try:
+        if mode == "pool":
+            run_pool(contacts, args, runs, run_id)
+            interrupted = False
+            return
+
+        def make_client(driver) -> InstagramDirectClient:
+            governor = MemoryGovernor(driver) if args.memory_governor else None
+            network = NetworkCapture(driver, record_dir=args.record_dir) if args.network else None
+            return InstagramDirectClient(driver, network_capture=network, memory_governor=governor)
+
+        supervisor = DriverSupervisor(
+            client_factory=make_client,
+            driver_factory=lambda: create_driver(lean=args.lean, network_log=args.network),
+            command_timeout=args.command_timeout,
+            max_restarts=args.max_restarts,
+        )
+
+        # 🔐 Авто-логин:
+        # - если есть валидные cookies → сразу зайдёт в Direct;
+        # - если cookies нет/протухли → откроет страницу логина и будет
+        #   ждать, пока ты вручную залогинишься и попадёшь в Direct.
+        #   Никаких input() в консоли.
+        print("Запускаю Chrome...")
+        supervisor.start()
+
+        if mode == "tabs":
+            # вкладки сами дособирают контакты при падении одной из них;
+            # зависание прервёт watchdog, а прогон можно продолжить через --resume
+            run_tabs(supervisor.client, contacts, args.tabs, runs, run_id, extraction_mode(args))
+        elif mode == "capture":
+            run_capture(supervisor, contacts, args.capture_dir, runs, run_id)
+        else:
+            run_sequential(supervisor, contacts, mode == "governor", runs, run_id, extraction_mode(args))
+        interrupted = False
+    finally:
+        # Ctrl+C / упавший браузер: прогон остаётся незавершённым, его можно продолжить
+        finish_run(runs, run_id, interrupted)
+        if supervisor is not None:
+            supervisor.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
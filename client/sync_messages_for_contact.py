@@ -1,23 +1,41 @@
 # client/sync_messages_for_all.py
 
+import argparse
 import time
+from typing import List, Optional
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-
+from client.driver_factory import create_driver
+from client.network_capture import NetworkCapture
 from client.selenium_direct import InstagramDirectClient
 from db.contact_repository import ContactRepository
 from db.message_repository import MessageRepository
 
 
-def main():
-    print("Запускаю Chrome для парсинга сообщений...")
-    options = Options()
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument("--start-maximized")
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Парсинг сообщений контактов из БД (один Chrome)")
+    parser.add_argument(
+        "--network",
+        action="store_true",
+        help="читать историю из JSON-ответов Direct (сетевой лог Chrome), а не из DOM",
+    )
+    parser.add_argument(
+        "--record-dir",
+        default=None,
+        help="с --network: сохранять разобранные ответы в эту папку "
+             "(стенд: python -m client.stub_direct_server --payloads <папка>)",
+    )
+    return parser.parse_args(argv)
+
 
-    driver = webdriver.Chrome(options=options)
-    client = InstagramDirectClient(driver)
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    extraction_mode = "network" if args.network else "observer"
+
+    print("Запускаю Chrome для парсинга сообщений...")
+    # MYGRAM_LEAN_BROWSER=1 — лёгкий профиль без картинок/медиа/шрифтов
+    driver = create_driver(network_log=args.network)
+    network = NetworkCapture(driver, record_dir=args.record_dir) if args.network else None
+    client = InstagramDirectClient(driver, network_capture=network)
 
     contacts_repo = ContactRepository()
     messages_repo = MessageRepository()
@@ -40,13 +58,20 @@ def main():
                 # max_scrolls можно подправить, если нужно глубже лезть в историю
                 messages = client.fetch_messages_for_contact(
                     username=username,
+                    thread_id=c.thread_id,
                     max_scrolls=20,
+                    extraction_mode=extraction_mode,
                 )
             except Exception as e:
                 print(f"[Ошибка] Не удалось получить сообщения {username}: {e}")
                 continue
 
             print(f"[DEBUG] Собрано сообщений: {len(messages)}")
+
+            # запоминаем id диалога, чтобы в следующий раз открыть его по прямой ссылке
+            thread_id = client.thread_id_for(username)
+            if thread_id and thread_id != c.thread_id:
+                contacts_repo.set_thread_id(username, thread_id)
             if not messages:
                 continue
 
@@ -0,0 +1,104 @@
+# client/sync_new_messages.py
+
+import time
+
+from client.driver_factory import create_driver
+from client.selenium_direct import InstagramDirectClient
+from core.models import ContactSnapshot
+from db.contact_repository import ContactRepository
+from db.message_repository import MessageRepository
+
+# Сколько последних сохранённых сообщений должно совпасть, чтобы остановить скролл
+WATERMARK_DEPTH = 3
+
+
+def rescan_chat(client: InstagramDirectClient, messages_repo: MessageRepository, contact: ContactSnapshot) -> int:
+    """
+    Полный пересбор чата контакта со строками старого формата (LEGACY_HASH_PREFIX):
+    их порядок ненадёжен, поэтому watermark по ним не ищем. Пачки пишутся по ходу
+    скролла; если сбор дошёл до начала чата, старые строки удаляются.
+    Возвращает количество вставленных сообщений.
+    """
+    username = contact.username
+    inserted = 0
+    anchor = None
+    for batch in client.iter_message_batches_for_contact(username, thread_id=contact.thread_id):
+        count, anchor = messages_repo.insert_batch(batch, None if batch.first else anchor)
+        inserted += count
+    if client.reached_start_for(username):
+        dropped = messages_repo.drop_legacy(username)
+        print(f"[INFO] {username}: удалено строк старого формата: {dropped}")
+    else:
+        print(f"[WARN] {username}: сбор не дошёл до начала чата, строки старого формата пересоберём в следующий раз")
+    return inserted
+
+
+def main():
+    print("Запускаю Chrome для инкрементальной синхронизации...")
+    # MYGRAM_LEAN_BROWSER=1 — лёгкий профиль без картинок/медиа/шрифтов
+    driver = create_driver()
+    client = InstagramDirectClient(driver)
+
+    contacts_repo = ContactRepository()
+    messages_repo = MessageRepository()
+
+    try:
+        print("Открываю Instagram Direct (куки / логин)...")
+        client._open_direct()
+
+        contacts = contacts_repo.list_all()
+        print(f"Найдено контактов в БД: {len(contacts)}")
+
+        # watermark'и всех контактов одним запросом
+        watermarks = messages_repo.load_watermarks(depth=WATERMARK_DEPTH)
+        # сохранённые до отпечатков — пересобираем целиком (см. rescan_chat)
+        legacy = messages_repo.legacy_contacts()
+
+        for c in contacts:
+            username = c.username
+            watermark = watermarks.get(username)
+            print("=" * 60)
+            if username in legacy:
+                print(f"Сообщения с {username} сохранены старой версией, пересобираю чат целиком")
+            elif watermark:
+                print(f"Новые сообщения с пользователем: {username}")
+            else:
+                print(f"В БД ещё нет сообщений с {username}, парсю чат целиком")
+
+            started = time.monotonic()
+            try:
+                if username in legacy:
+                    # пишет в БД сам, по ходу скролла
+                    inserted_count = rescan_chat(client, messages_repo, c)
+                    messages = []
+                else:
+                    messages = client.fetch_messages_for_contact(
+                        username=username,
+                        thread_id=c.thread_id,
+                        watermark=watermark,
+                    )
+                    inserted_count = 0
+            except Exception as e:
+                print(f"[Ошибка] Не удалось получить сообщения {username}: {e}")
+                continue
+
+            thread_id = client.thread_id_for(username)
+            if thread_id and thread_id != c.thread_id:
+                contacts_repo.set_thread_id(username, thread_id)
+
+            if messages:
+                inserted_count = messages_repo.bulk_insert(messages)
+
+            print(f"[OK] Новых сообщений: {inserted_count} ({time.monotonic() - started:.1f} c)")
+
+        print("----- Готово. Все контакты обработаны. -----")
+
+    except KeyboardInterrupt:
+        print("\n[INFO] Остановлено пользователем (Ctrl+C)")
+    finally:
+        client.close()
+        print("[INFO] Браузер закрыт")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+# client/sync_pool.py
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Union
+
+from client.driver_factory import create_driver, profile_dir_from_env
+from client.driver_supervisor import DriverSupervisor, SupervisorGaveUp
+from core.models import ContactSnapshot, MessageSnapshot
+from db.contact_repository import ContactRepository
+from db.message_repository import MessageRepository
+from db.sync_run_repository import SyncRunRepository
+
+
+class WorkStealingQueue:
+    """
+    Очередь контактов для пула воркеров.
+
+    Контакты заранее раскладываются по личным очередям воркеров (round-robin).
+    Воркер берёт из своей очереди с начала, а когда она пуста — забирает
+    с конца самой длинной чужой очереди. Так быстрые воркеры разгружают
+    медленных, а очередь упавшего воркера достаётся остальным.
+
+    Ошибки считаются по контакту, а не по воркеру: контакт, который не собрался
+    max_attempts раз (в любых воркерах), из очереди убирается.
+    """
+
+    def __init__(self, items: List[ContactSnapshot], workers: int, max_attempts: int = 2) -> None:
+        self._lock = threading.Lock()
+        self._queues: List[Deque[ContactSnapshot]] = [deque() for _ in range(workers)]
+        for i, item in enumerate(items):
+            self._queues[i % workers].append(item)
+        self._max_attempts = max(1, max_attempts)
+        self._failures: Dict[str, int] = {}
+        self.stolen = 0
+
+    def get(self, worker_id: int) -> Optional[ContactSnapshot]:
+        with self._lock:
+            own = self._queues[worker_id]
+            if own:
+                return own.popleft()
+            victim = max(self._queues, key=len)
+            if not victim:
+                return None
+            self.stolen += 1
+            return victim.pop()
+
+    def put_back(self, worker_id: int, item: ContactSnapshot) -> None:
+        with self._lock:
+            self._queues[worker_id].appendleft(item)
+
+    def fail(self, worker_id: int, item: ContactSnapshot) -> bool:
+        """
+        Засчитывает контакту неудачную попытку. Если попытки ещё есть — ставит
+        его в конец очереди воркера (оттуда его скорее заберёт другой воркер)
+        и возвращает True; иначе контакт выбывает — False.
+        """
+        with self._lock:
+            failures = self._failures.get(item.username, 0) + 1
+            self._failures[item.username] = failures
+            if failures >= self._max_attempts:
+                return False
+            self._queues[worker_id].append(item)
+            return True
+
+    def remaining(self) -> List[ContactSnapshot]:
+        """
+        Контакты, которые остались в очереди (все воркеры остановились раньше).
+        """
+        with self._lock:
+            return [item for q in self._queues for item in q]
+
+
+@dataclass
+class _WriteJob:
+    contact: ContactSnapshot
+    thread_id: Optional[str]
+    messages: List[MessageSnapshot]
+    scroll_depth: Optional[int] = None
+    duration_seconds: float = 0.0
+
+
+@dataclass
+class _RunMark:
+    """
+    Чекпоинт прогона без сообщений: контакт взят в работу или не собран.
+    """
+    username: str
+    error: Optional[str] = None
+    duration_seconds: float = 0.0
+
+
+class ResultWriter:
+    """
+    Единственный поток, который пишет в БД: воркеры только кладут результаты
+    и чекпоинты прогона в очередь, так что SQLite не дерётся за блокировки
+    между браузерами, а отметки контакта пишутся в том порядке, в каком их
+    отдал воркер.
+    """
+
+    def __init__(
+        self,
+        contacts_repo: ContactRepository,
+        messages_repo: MessageRepository,
+        runs: Optional[SyncRunRepository] = None,
+        run_id: Optional[int] = None,
+    ) -> None:
+        self._contacts_repo = contacts_repo
+        self._messages_repo = messages_repo
+        # состояние контактов в прогоне (--resume) — отмечаем после записи
+        self._runs = runs
+        self._run_id = run_id
+        self._queue: "queue.Queue[Optional[Union[_WriteJob, _RunMark]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.inserted = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, job: _WriteJob) -> None:
+        self._queue.put(job)
+
+    def mark_in_progress(self, username: str) -> None:
+        if self._runs is not None:
+            self._queue.put(_RunMark(username))
+
+    def mark_failed(self, username: str, error: str, duration_seconds: float) -> None:
+        if self._runs is not None:
+            self._queue.put(_RunMark(username, error, duration_seconds))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if isinstance(job, _RunMark):
+                self._write_mark(job)
+                continue
+            username = job.contact.username
+            try:
+                if job.thread_id and job.thread_id != job.contact.thread_id:
+                    self._contacts_repo.set_thread_id(username, job.thread_id)
+                inserted = self._messages_repo.bulk_insert(job.messages) if job.messages else 0
+                self.inserted += inserted
+                if self._runs is not None:
+                    self._runs.mark_done(self._run_id, username, inserted, job.scroll_depth, job.duration_seconds)
+            except Exception as e:
+                self.errors += 1
+                print(f"[ERROR] Не удалось сохранить сообщения {username}: {e!r}")
+                self._write_mark(_RunMark(username, repr(e), job.duration_seconds))
+
+    def _write_mark(self, mark: _RunMark) -> None:
+        if self._runs is None:
+            return
+        try:
+            if mark.error is None:
+                self._runs.mark_in_progress(self._run_id, mark.username)
+            else:
+                self._runs.mark_failed(self._run_id, mark.username, mark.error, mark.duration_seconds)
+        except Exception as e:
+            # чекпоинт потерян — контакт просто повторится при --resume
+            self.errors += 1
+            print(f"[ERROR] Не удалось отметить {mark.username} в прогоне: {e!r}")
+
+
+@dataclass
+class WorkerStats:
+    worker_id: int
+    contacts_done: int = 0
+    contacts_failed: int = 0
+    messages: int = 0
+    busy_seconds: float = 0.0
+    restarts: int = 0
+    lost_seconds: float = 0.0
+    alive: bool = True
+    error: Optional[str] = None
+    failed_usernames: List[str] = field(default_factory=list)
+
+
+class SyncWorkerPool:
+    """
+    Пул из N браузеров для sync_messages_for_all.
+
+    - каждый воркер — свой Chrome из create_driver и свой InstagramDirectClient;
+    - первый воркер логинится (или поднимает cookies) до старта остальных,
+      поэтому остальные входят по уже сохранённым cookies;
+    - контакты раздаются через WorkStealingQueue;
+    - в БД пишет один поток (ResultWriter);
+    - упавший или зависший браузер воркера перезапускает DriverSupervisor;
+    - если браузер не поднимается, воркер выходит, а его контакты забирают другие;
+    - контакт, который не собрался max_contact_attempts раз, отмечается упавшим
+      и больше не раздаётся — один «ядовитый» чат не останавливает воркеров;
+    - контакты, которые так и не раздали (остановились все воркеры), остаются
+      в `leftover`.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        headless: bool = False,
+        lean: Optional[bool] = None,
+        max_scrolls: int = 12,
+        extraction_mode: str = "observer",
+        max_contact_attempts: int = 2,
+        driver_factory: Callable[..., object] = create_driver,
+        command_timeout: float = 120.0,
+        max_restarts: int = 5,
+    ) -> None:
+        self._workers = max(1, workers)
+        self._headless = headless
+        self._lean = lean
+        self._max_scrolls = max_scrolls
+        self._extraction_mode = extraction_mode
+        self._max_contact_attempts = max_contact_attempts
+        self._driver_factory = driver_factory
+        self._command_timeout = command_timeout
+        self._max_restarts = max_restarts
+        self.leftover: List[ContactSnapshot] = []
+
+    def run(
+        self,
+        contacts: List[ContactSnapshot],
+        contacts_repo: ContactRepository,
+        messages_repo: MessageRepository,
+        runs: Optional[SyncRunRepository] = None,
+        run_id: Optional[int] = None,
+    ) -> List[WorkerStats]:
+        work = WorkStealingQueue(contacts, self._workers, self._max_contact_attempts)
+        writer = ResultWriter(contacts_repo, messages_repo, runs, run_id)
+        stats = [WorkerStats(worker_id=i) for i in range(self._workers)]
+        started = time.monotonic()
+
+        writer.start()
+        try:
+            # Воркер 0 открывает Direct первым: при необходимости здесь
+            # произойдёт ручной логин и сохранятся cookies для остальных.
+            primary = self._start_client(stats[0])
+            threads = [
+                threading.Thread(
+                    target=self._run_worker,
+                    args=(0, primary, work, writer, stats[0]),
+                    name="sync-worker-0",
+                )
+            ]
+            for i in range(1, self._workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._run_worker,
+                        args=(i, None, work, writer, stats[i]),
+                        name=f"sync-worker-{i}",
+                    )
+                )
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            writer.close()
+
+        self.leftover = work.remaining()
+        self._report(stats, writer, work, time.monotonic() - started)
+        return stats
+
+    # ------------------ Воркеры ------------------ #
+
+    def _start_client(self, st: WorkerStats) -> Optional[DriverSupervisor]:
+        supervisor = DriverSupervisor(
+            driver_factory=lambda: self._driver_factory(
+                headless=self._headless,
+                lean=self._lean,
+                network_log=self._extraction_mode == "network",
+                profile_dir=profile_dir_from_env(st.worker_id),
+            ),
+            command_timeout=self._command_timeout,
+            max_restarts=self._max_restarts,
+            name=f"воркера {st.worker_id}",
+        )
+        try:
+            supervisor.start()
+            return supervisor
+        except Exception as e:
+            supervisor.close()
+            st.alive = False
+            st.error = f"не удалось запустить браузер: {e!r}"
+            print(f"[ERROR] Воркер {st.worker_id}: {st.error}")
+            return None
+
+    def _run_worker(
+        self,
+        worker_id: int,
+        supervisor: Optional[DriverSupervisor],
+        work: WorkStealingQueue,
+        writer: ResultWriter,
+        st: WorkerStats,
+    ) -> None:
+        if supervisor is None:
+            supervisor = self._start_client(st) if st.alive else None
+        if supervisor is None:
+            return
+
+        try:
+            while True:
+                contact = work.get(worker_id)
+                if contact is None:
+                    return
+
+                started = time.monotonic()
+                try:
+                    writer.mark_in_progress(contact.username)
+                    # упавший/зависший браузер супервизор перезапустит и повторит контакт
+                    messages = supervisor.run(
+                        contact.username,
+                        lambda client: client.fetch_messages_for_contact(
+                            username=contact.username,
+                            thread_id=contact.thread_id,
+                            max_scrolls=self._max_scrolls,
+                            extraction_mode=self._extraction_mode,
+                        ),
+                    )
+                except Exception as e:
+                    duration = time.monotonic() - started
+                    st.busy_seconds += duration
+                    print(f"[Ошибка] Воркер {worker_id}: не удалось получить сообщения {contact.username}: {e}")
+
+                    if work.fail(worker_id, contact):
+                        print(f"[INFO] {contact.username} вернулся в очередь, попробуем ещё раз")
+                    else:
+                        st.contacts_failed += 1
+                        st.failed_usernames.append(contact.username)
+                        writer.mark_failed(contact.username, repr(e), duration)
+
+                    if isinstance(e, SupervisorGaveUp):
+                        # браузер не поднимается — выходим, очередь воркера заберут остальные
+                        st.alive = False
+                        st.error = repr(e)
+                        print(f"[ERROR] Воркер {worker_id} остановлен, его контакты заберут остальные")
+                        return
+                    continue
+
+                duration = time.monotonic() - started
+                st.busy_seconds += duration
+                st.contacts_done += 1
+                st.messages += len(messages)
+                client = supervisor.client
+                writer.submit(
+                    _WriteJob(
+                        contact=contact,
+                        thread_id=client.thread_id_for(contact.username),
+                        messages=messages,
+                        scroll_depth=client.scroll_depth_for(contact.username),
+                        duration_seconds=duration,
+                    )
+                )
+                print(f"[OK] Воркер {worker_id}: {contact.username} — собрано сообщений: {len(messages)}")
+        finally:
+            st.restarts = supervisor.stats.restarts
+            st.lost_seconds = supervisor.stats.lost_seconds
+            supervisor.close()
+
+    # ------------------ Отчёт ------------------ #
+
+    @staticmethod
+    def _report(stats: List[WorkerStats], writer: ResultWriter, work: WorkStealingQueue, elapsed: float) -> None:
+        done = sum(s.contacts_done for s in stats)
+        failed = sum(s.contacts_failed for s in stats)
+        scraped = sum(s.messages for s in stats)
+
+        print("=" * 60)
+        print("Итоги пула:")
+        for s in stats:
+            state = "ok" if s.alive else f"упал ({s.error})"
+            print(
+                f"  воркер {s.worker_id}: контактов {s.contacts_done}, ошибок {s.contacts_failed}, "
+                f"сообщений {s.messages}, в работе {s.busy_seconds:.0f} c, "
+                f"перезапусков {s.restarts} (потеряно {s.lost_seconds:.0f} c) — {state}"
+            )
+        minutes = elapsed / 60 if elapsed > 0 else 0
+        print(
+            f"  всего: контактов {done}, ошибок {failed}, собрано сообщений {scraped}, "
+            f"сохранено {writer.inserted}, ошибок записи {writer.errors}, украдено задач {work.stolen}"
+        )
+        leftover = work.remaining()
+        if leftover:
+            names = ", ".join(c.username for c in leftover[:10])
+            more = f" и ещё {len(leftover) - 10}" if len(leftover) > 10 else ""
+            print(f"  не обработано (все воркеры остановились): {len(leftover)} — {names}{more}")
+        if minutes:
+            print(
+                f"  время {elapsed:.0f} c, {done / minutes:.1f} контактов/мин, "
+                f"{scraped / elapsed:.1f} сообщений/с"
+            )
@@ -0,0 +1,74 @@
+# core/fingerprint.py
+from __future__ import annotations
+
+import hashlib
+from collections import deque
+from typing import Iterable, Optional, Sequence
+
+from core.models import MessageSnapshot
+
+# 12 байт blake2b — 24 hex-символа; коллизия в пределах одного чата нереальна
+DIGEST_SIZE = 12
+
+# Сколько предыдущих сообщений входит в контекст отпечатка
+CONTEXT_DEPTH = 2
+
+_SEP = "\x1f"
+
+
+def message_digest(sender: str, text: str, context: Sequence[str]) -> str:
+    """
+    Дайджест фиксированного размера от отправителя, текста и текстов
+    предыдущих сообщений (context, от старых к новым).
+    """
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    h.update(_SEP.join([sender or "", text, *context]).encode("utf-8"))
+    return h.hexdigest()
+
+
+class MessageFingerprinter:
+    """
+    Проставляет msg_hash сообщениям чата, идущим от старых к новым.
+
+    msg_hash = "<дайджест>:<n>", где дайджест считается от отправителя,
+    текста и CONTEXT_DEPTH предыдущих сообщений, а n — номер среди подряд
+    идущих сообщений с тем же дайджестом. Так три "ок" подряд или один и
+    тот же "👍" в разных местах чата остаются разными сообщениями,
+    а повторный сбор того же участка даёт те же отпечатки.
+
+    Контекст берётся только со стороны старых сообщений: новые, пришедшие
+    после сбора, отпечатки уже сохранённых не меняют. Память — O(CONTEXT_DEPTH).
+    Самые старые сообщения сбора, не дошедшего до начала чата, получают
+    неполный контекст — клиент такие не сохраняет (client.chat_stitcher).
+    """
+
+    def __init__(self, context_depth: int = CONTEXT_DEPTH) -> None:
+        self._context: deque[str] = deque(maxlen=context_depth)
+        self._last_digest: Optional[str] = None
+        self._repeat = 0
+
+    def next_hash(self, sender: str, text: str) -> str:
+        """
+        Отпечаток следующего сообщения чата (без MessageSnapshot — для строк БД).
+        """
+        digest = message_digest(sender, text, self._context)
+        if digest == self._last_digest:
+            self._repeat += 1
+        else:
+            self._last_digest = digest
+            self._repeat = 0
+        self._context.append(text)
+        return f"{digest}:{self._repeat}"
+
+    def assign(self, message: MessageSnapshot) -> str:
+        message.msg_hash = self.next_hash(message.sender, message.text)
+        return message.msg_hash
+
+
+def assign_fingerprints(messages: Iterable[MessageSnapshot]) -> None:
+    """
+    Проставляет msg_hash пачке сообщений одного чата (от старых к новым).
+    """
+    fingerprinter = MessageFingerprinter()
+    for m in messages:
+        fingerprinter.assign(m)
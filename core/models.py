@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 
 @dataclass
@@ -20,6 +20,8 @@ class ContactSnapshot:
     last_message_at_utc: Optional[datetime]
     scraped_at_utc: datetime
 
+    thread_id: Optional[str] = None    # id диалога из /direct/t/<id>/
+
 
 @dataclass
 class MessageSnapshot:
@@ -30,4 +32,19 @@ class MessageSnapshot:
     sender: str                    # 'me', 'contact' или 'unknown'
     text: str
     timestamp_utc: Optional[datetime]
-    scraped_at_utc: datetime
\ No newline at end of file
+    scraped_at_utc: datetime
+
+    sender_id: Optional[str] = None  # user_id отправителя, если известен (сетевой режим)
+    msg_hash: Optional[str] = None   # отпечаток с учётом соседей, см. core.fingerprint
+
+@dataclass
+class MessageBatch:
+    """
+    Готовая к записи пачка потокового сбора чата (см. InstagramDirectClient.iter_message_batches_for_contact).
+    messages — от старых к новым, с проставленным msg_hash;
+    ranks[i] — место messages[i] от самого нового сообщения сбора (0 — самое новое).
+    """
+    contact_username: str
+    messages: List[MessageSnapshot]
+    ranks: List[int]
+    first: bool = False              # первая пачка сбора (в ней самые новые сообщения)
@@ -1,13 +1,26 @@
 # db/connection.py
 import os
 import sqlite3
+import threading
 from pathlib import Path
-from typing import Iterator, ContextManager
+from typing import Dict, Iterator
 from contextlib import contextmanager
 
 DB_PATH_ENV = "MYGRAM_DB_PATH"
 DEFAULT_DB_FILE = "mygram.db"
 
+# Настройки соединения: WAL — читатели (WebUI, бот) не ждут писателя и наоборот;
+# synchronous=NORMAL в WAL не теряет целостность, только последние коммиты при сбое ОС.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",   # 256 МБ
+    "PRAGMA cache_size = -65536",     # 64 МБ (отрицательное — в КиБ)
+)
+BUSY_TIMEOUT_SECONDS = 10.0
+STATEMENT_CACHE_SIZE = 256
+
 
 def get_db_path() -> str:
     """
@@ -22,12 +35,132 @@ def get_db_path() -> str:
     return str(base_dir / DEFAULT_DB_FILE)
 
 
+class _PooledConnection:
+    """
+    Долгоживущее соединение потока. Ведёт себя как sqlite3.Connection,
+    но commit() внутри transaction() откладывается до её конца, а close() —
+    ничего не делает (соединение переиспользуется).
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self.depth = 0      # вложенность transaction()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def execute(self, *args):
+        return self._conn.execute(*args)
+
+    def executemany(self, *args):
+        return self._conn.executemany(*args)
+
+    def commit(self) -> None:
+        if self.depth == 0:
+            self._conn.commit()
+
+    def rollback(self) -> None:
+        if self.depth == 0:
+            self._conn.rollback()
+
+    def close(self) -> None:
+        pass
+
+
+class ConnectionManager:
+    """
+    Пул соединений с SQLite: по одному долгоживущему соединению на поток
+    (sqlite3.Connection нельзя делить между потоками) и файл БД.
+    Подготовленные запросы кэшируются в соединении (cached_statements),
+    так что повторные execute одного SQL не компилируются заново.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    def _connections(self) -> Dict[str, _PooledConnection]:
+        local = self._local
+        # после fork (ProcessPoolExecutor) соединения родителя использовать нельзя
+        if getattr(local, "pid", None) != os.getpid():
+            local.pid = os.getpid()
+            local.connections = {}
+        return local.connections
+
+    def connection(self) -> _PooledConnection:
+        db_path = get_db_path()
+        connections = self._connections()
+        pooled = connections.get(db_path)
+        if pooled is None:
+            conn = sqlite3.connect(
+                db_path,
+                timeout=BUSY_TIMEOUT_SECONDS,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            pooled = connections[db_path] = _PooledConnection(conn)
+        return pooled
+
+    def close_all(self) -> None:
+        """
+        Закрывает соединения текущего потока.
+        """
+        connections = self._connections()
+        for pooled in connections.values():
+            pooled._conn.close()
+        connections.clear()
+
+
+_manager = ConnectionManager()
+
+
 @contextmanager
 def get_connection() -> Iterator[sqlite3.Connection]:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    """
+    Соединение текущего потока. Вне transaction() незакоммиченное при выходе
+    откатывается — как раньше при закрытии одноразового соединения.
+    """
+    pooled = _manager.connection()
     try:
-        yield conn
+        yield pooled
     finally:
-        conn.close()
\ No newline at end of file
+        if pooled.depth == 0 and pooled.in_transaction:
+            pooled._conn.rollback()
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Единица работы: все вызовы репозиториев внутри блока (в этом потоке)
+    идут одной транзакцией с одним commit в конце; при исключении — откат.
+
+        with transaction():
+            contacts_repo.set_thread_id(...)
+            messages_repo.bulk_insert(...)
+    """
+    pooled = _manager.connection()
+    pooled.depth += 1
+    try:
+        yield pooled
+    except BaseException:
+        pooled.depth -= 1
+        if pooled.depth == 0:
+            pooled._conn.rollback()
+        raise
+    pooled.depth -= 1
+    if pooled.depth == 0:
+        pooled._conn.commit()
+
+
+def close_connections() -> None:
+    """
+    Закрывает соединения текущего потока (например, перед выходом из воркера).
+    """
+    _manager.close_all()
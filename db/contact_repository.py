@@ -1,11 +1,53 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterator, Optional
+from typing import Optional
 
-from db.connection import get_connection
+from db.connection import get_connection, transaction
 from core.models import ContactSnapshot
 
+# Строка контакта считается изменённой, если отличается хоть одно из полей
+# (IS NOT — сравнение с учётом NULL). scraped_at_utc не сравнивается: он меняется всегда.
+_CHANGED = """
+    c.display_name IS NOT s.display_name
+    OR c.profile_url IS NOT s.profile_url
+    OR c.is_active IS NOT s.is_active
+    OR c.last_message_preview IS NOT s.last_message_preview
+    OR c.last_message_at_utc IS NOT s.last_message_at_utc
+    OR (s.thread_id IS NOT NULL AND c.thread_id IS NOT s.thread_id)
+"""
+
+
+@dataclass
+class UpsertResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.inserted + self.updated + self.unchanged
+
+    def __str__(self) -> str:
+        return f"новых {self.inserted}, обновлено {self.updated}, без изменений {self.unchanged}"
+
+
+def _contact_row(snapshot: ContactSnapshot) -> tuple:
+    """
+    ContactSnapshot -> значения колонок contacts (в порядке CREATE TABLE без id).
+    """
+    return (
+        snapshot.username,
+        snapshot.full_name,  # сохраняем в display_name!!!
+        snapshot.profile_url,
+        1 if snapshot.is_active else 0,
+        snapshot.last_message_preview,
+        snapshot.last_message_at_utc.isoformat() if snapshot.last_message_at_utc else None,
+        snapshot.scraped_at_utc.isoformat(),
+        snapshot.thread_id,
+    )
+
 
 class ContactRepository:
     """
@@ -19,7 +61,8 @@ class ContactRepository:
         is_active INTEGER DEFAULT 1,
         last_message_preview TEXT,
         last_message_at_utc TEXT,
-        scraped_at_utc TEXT
+        scraped_at_utc TEXT,
+        thread_id TEXT
     """
 
     def __init__(self) -> None:
@@ -33,7 +76,7 @@ class ContactRepository:
     # -------------------------
     def init_schema(self) -> None:
         """
-        Создаёт таблицу contacts.
+        Создаёт таблицу contacts. Изменения старых БД — в db.migrations.
         """
         with self._connect() as conn:
             conn.execute(
@@ -46,57 +89,89 @@ class ContactRepository:
                     is_active INTEGER DEFAULT 1,
                     last_message_preview TEXT,
                     last_message_at_utc TEXT,
-                    scraped_at_utc TEXT
+                    scraped_at_utc TEXT,
+                    thread_id TEXT
                 );
                 """
             )
+            conn.commit()
 
     # -------------------------
     #        UPSERT
     # -------------------------
-    def upsert_from_snapshot(self, snapshot: ContactSnapshot) -> None:
+    def upsert_from_snapshot(self, snapshot: ContactSnapshot) -> UpsertResult:
         """
         Вставляет или обновляет запись по username.
         """
-        if not snapshot.username:
-            return
-
-        username = snapshot.username
-        display_name = snapshot.full_name  # сохраняем в display_name!!!
-        profile_url = snapshot.profile_url
-        is_active = 1 if snapshot.is_active else 0
-        last_message_preview = snapshot.last_message_preview
-
-        last_message_at_utc = (
-            snapshot.last_message_at_utc.isoformat()
-            if snapshot.last_message_at_utc
-            else None
-        )
-
-        scraped_at_utc = snapshot.scraped_at_utc.isoformat()
+        return self.bulk_upsert([snapshot])
 
-        with self._connect() as conn:
+    def bulk_upsert(self, snapshots: list[ContactSnapshot]) -> UpsertResult:
+        """
+        Массовый upsert контактов одной транзакцией.
+
+        Snapshot'ы без username пропускаются, при повторе username побеждает
+        последний. Список заливается во временную таблицу contacts_stage, дальше
+        два set-based запроса:
+        - INSERT новых username;
+        - UPDATE только тех строк, где реально поменялось что-то из
+          display_name / profile_url / is_active / last_message_* / thread_id
+          (пустой thread_id не затирает известный).
+        Неизменённые строки не переписываются — у них остаётся прежний scraped_at_utc.
+
+        Возвращает счётчики inserted / updated / unchanged.
+        """
+        staged = {}
+        for s in snapshots or []:
+            if s and s.username:
+                staged[s.username] = _contact_row(s)
+        if not staged:
+            return UpsertResult()
+
+        with transaction() as conn:
             conn.execute(
                 """
-                INSERT INTO contacts (
-                    username,
-                    display_name,
-                    profile_url,
-                    is_active,
-                    last_message_preview,
-                    last_message_at_utc,
-                    scraped_at_utc
+                CREATE TEMP TABLE IF NOT EXISTS contacts_stage (
+                    username TEXT PRIMARY KEY,
+                    display_name TEXT,
+                    profile_url TEXT,
+                    is_active INTEGER,
+                    last_message_preview TEXT,
+                    last_message_at_utc TEXT,
+                    scraped_at_utc TEXT,
+                    thread_id TEXT
+                )
+                """
+            )
+            conn.execute("DELETE FROM contacts_stage")
+            conn.executemany(
+                "INSERT INTO contacts_stage VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                list(staged.values()),
+            )
+
+            updated = conn.execute(
+                f"""
+                UPDATE contacts
+                SET (display_name, profile_url, is_active, last_message_preview,
+                     last_message_at_utc, scraped_at_utc, thread_id) = (
+                    SELECT
+                        s.display_name, s.profile_url, s.is_active, s.last_message_preview,
+                        s.last_message_at_utc, s.scraped_at_utc,
+                        COALESCE(s.thread_id, contacts.thread_id)
+                    FROM contacts_stage s
+                    WHERE s.username = contacts.username
+                )
+                WHERE username IN (
+                    SELECT s.username
+                    FROM contacts_stage s
+                    JOIN contacts c ON c.username = s.username
+                    WHERE {_CHANGED}
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(username) DO UPDATE SET
-                    display_name = excluded.display_name,
-                    profile_url = excluded.profile_url,
-                    is_active = excluded.is_active,
-                    last_message_preview = excluded.last_message_preview,
-                    last_message_at_utc = excluded.last_message_at_utc,
-                    scraped_at_utc = excluded.scraped_at_utc
-                """,
-                (
+                """
+            ).rowcount
+
+            inserted = conn.execute(
+                """
+                INSERT INTO contacts (
                     username,
                     display_name,
                     profile_url,
@@ -104,32 +179,35 @@ class ContactRepository:
                     last_message_preview,
                     last_message_at_utc,
                     scraped_at_utc,
-                ),
-            )
-            conn.commit()
+                    thread_id
+                )
+                SELECT
+                    username, display_name, profile_url, is_active,
+                    last_message_preview, last_message_at_utc, scraped_at_utc, thread_id
+                FROM contacts_stage s
+                WHERE NOT EXISTS (SELECT 1 FROM contacts c WHERE c.username = s.username)
+                """
+            ).rowcount
 
-    def bulk_upsert(self, snapshots: list[ContactSnapshot]) -> int:
-        """
-        Массовый upsert контактов из списка с использованием существующей логики upsert_from_snapshot.
+            conn.execute("DELETE FROM contacts_stage")
 
-        Для каждого snapshot:
-        - если username пустой — пропускаем;
-        - иначе вызываем upsert_from_snapshot.
+        return UpsertResult(
+            inserted=inserted,
+            updated=updated,
+            unchanged=len(staged) - inserted - updated,
+        )
 
-        Возвращает количество успешно обработанных snapshot'ов.
+    def set_thread_id(self, username: str, thread_id: Optional[str]) -> None:
         """
-        if not snapshots:
-            return 0
-
-        processed = 0
-        for s in snapshots:
-            if not s or not s.username:
-                continue
-            # используем единый метод, чтобы не дублировать SQL/маппинг полей
-            self.upsert_from_snapshot(s)
-            processed += 1
-
-        return processed
+        Запоминает id диалога (/direct/t/<id>/) для контакта.
+        None — сбросить устаревший id.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE contacts SET thread_id = ? WHERE username = ?",
+                (thread_id, username),
+            )
+            conn.commit()
 
     # -------------------------
     #       LIST ALL
@@ -148,7 +226,8 @@ class ContactRepository:
                     is_active,
                     last_message_preview,
                     last_message_at_utc,
-                    scraped_at_utc
+                    scraped_at_utc,
+                    thread_id
                 FROM contacts
                 """
             ).fetchall()
@@ -164,6 +243,7 @@ class ContactRepository:
                     last_message_preview=r[4],
                     last_message_at_utc=r[5],
                     scraped_at_utc=r[6],
+                    thread_id=r[7],
                 )
             )
         return results
\ No newline at end of file
@@ -2,17 +2,73 @@
 
 from __future__ import annotations
 
-from typing import Iterable, List, Optional
-from datetime import datetime
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from datetime import datetime, timezone
 import sqlite3
 
 from db.connection import get_connection
-from core.models import MessageSnapshot
+from core.fingerprint import MessageFingerprinter
+from core.models import MessageBatch, MessageSnapshot
+
+# Порядок сообщений контакта — по seq (не по id: потоковый сбор пишет пачки
+# от новых к старым). Новый потоковый сбор нумеруется вниз от MAX(seq) + SEQ_GAP,
+# чтобы хватило места на всю историю чата.
+SEQ_GAP = 1 << 32
+
+# msg_hash строк, сохранённых до отпечатков (см. db.migrations._legacy_history).
+# С отпечатками новых сборов они не совпадают: порядок экранов в тех сборах
+# не восстановить, поэтому такой контакт пересобирается целиком (до начала
+# чата), после чего эти строки удаляются — drop_legacy.
+LEGACY_HASH_PREFIX = "legacy:"
+# верхняя граница префикса для поиска по индексу (':' + 1 == ';')
+_LEGACY_HASH_END = "legacy;"
+
+# Дубли (тот же контакт и msg_hash) молча пропускаются уникальным индексом;
+# rowcount у executemany — сколько строк реально вставлено.
+_INSERT_SQL = """
+    INSERT INTO messages (
+        contact_id,
+        sender_id,
+        text,
+        timestamp_ms,
+        scraped_at_ms,
+        msg_hash,
+        seq
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(contact_id, msg_hash) DO NOTHING
+"""
+
+# epoch-мс -> ISO-строка, как раньше лежало в timestamp_utc
+_ISO_FROM_MS = "strftime('%Y-%m-%dT%H:%M:%f+00:00', {col} / 1000.0, 'unixepoch')"
+
+
+def to_epoch_ms(value: Optional[datetime]) -> Optional[int]:
+    """
+    datetime -> миллисекунды Unix-времени. Время без tzinfo считается UTC.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(round(value.timestamp() * 1000))
+
+
+def from_epoch_ms(value: Optional[int]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
 
 
 class MessageRepository:
     """
     Работа с таблицей messages.
+
+    Компактная раскладка: контакт — contacts.id (строка контакта заводится
+    при первом сообщении, если её ещё нет), отправитель — id из словаря
+    senders, время — миллисекунды Unix-времени. Наружу по-прежнему идут
+    MessageSnapshot / строки с contact_username, sender и timestamp_utc.
     """
 
     def __init__(self) -> None:
@@ -25,32 +81,48 @@ class MessageRepository:
 
     def init_schema(self) -> None:
         """
-        Создаёт таблицу messages, если её ещё нет.
+        Создаёт таблицы messages и senders, если их ещё нет.
+        Индексы и изменения старых БД — в db.migrations.
         """
         with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS senders (
+                    id   INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                )
+                """
+            )
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS messages (
-                    id              INTEGER PRIMARY KEY AUTOINCREMENT,
-                    contact_username TEXT NOT NULL,
-                    sender           TEXT NOT NULL,
-                    text             TEXT NOT NULL,
-                    timestamp_utc    TEXT NULL,
-                    scraped_at_utc   TEXT NOT NULL
+                    id            INTEGER PRIMARY KEY,
+                    contact_id    INTEGER NOT NULL REFERENCES contacts(id),
+                    sender_id     INTEGER NOT NULL REFERENCES senders(id),
+                    text          TEXT NOT NULL,
+                    timestamp_ms  INTEGER NULL,
+                    scraped_at_ms INTEGER NOT NULL,
+                    msg_hash      TEXT NULL,
+                    seq           INTEGER NOT NULL
                 )
                 """
             )
             conn.commit()
 
-
     def get_last_for_contact(self, contact_username: str) -> Optional[sqlite3.Row]:
         with get_connection() as conn:
             cur = conn.execute(
-                """
-                SELECT contact_username, sender, text, timestamp_utc
-                FROM messages
-                WHERE contact_username = ?
-                ORDER BY id DESC
+                f"""
+                SELECT
+                    c.username AS contact_username,
+                    s.name     AS sender,
+                    m.text,
+                    {_ISO_FROM_MS.format(col="m.timestamp_ms")} AS timestamp_utc
+                FROM contacts c
+                JOIN messages m ON m.contact_id = c.id
+                JOIN senders s  ON s.id = m.sender_id
+                WHERE c.username = ?
+                ORDER BY m.seq DESC
                 LIMIT 1
                 """,
                 (contact_username,),
@@ -58,40 +130,258 @@ class MessageRepository:
             row = cur.fetchone()
             return row
 
-    def bulk_insert(self, messages: Iterable[MessageSnapshot]) -> int:
+    def load_watermarks(self, depth: int = 3) -> Dict[str, List[str]]:
         """
-        Сохраняет пачку сообщений. Возвращает количество вставленных строк.
+        Возвращает watermark'и для всех контактов одним запросом:
+        contact_username -> тексты последних `depth` сохранённых сообщений
+        (от старых к новым).
         """
-        msgs: List[MessageSnapshot] = list(messages)
-        if not msgs:
-            return 0
+        watermarks: Dict[str, List[str]] = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT c.username AS contact_username, w.text
+                FROM (
+                    SELECT
+                        seq,
+                        contact_id,
+                        text,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY contact_id ORDER BY seq DESC
+                        ) AS rn
+                    FROM messages
+                ) w
+                JOIN contacts c ON c.id = w.contact_id
+                WHERE w.rn <= ?
+                ORDER BY c.username, w.seq
+                """,
+                (depth,),
+            ).fetchall()
+        for r in rows:
+            watermarks.setdefault(r["contact_username"], []).append(r["text"])
+        return watermarks
 
+    def legacy_contacts(self) -> Set[str]:
+        """
+        Контакты, у которых ещё есть строки до отпечатков: им нужен полный пересбор.
+        """
         with self._connect() as conn:
-            conn.executemany(
+            rows = conn.execute(
                 """
-                INSERT INTO messages (
-                    contact_username,
-                    sender,
-                    text,
-                    timestamp_utc,
-                    scraped_at_utc
+                SELECT c.username
+                FROM contacts c
+                WHERE EXISTS (
+                    SELECT 1 FROM messages m
+                    WHERE m.contact_id = c.id AND m.msg_hash >= ? AND m.msg_hash < ?
                 )
-                VALUES (?, ?, ?, ?, ?)
                 """,
-                [
-                    (
-                        m.contact_username,
-                        m.sender,
-                        m.text,
-                        m.timestamp_utc.isoformat() if m.timestamp_utc else None,
-                        m.scraped_at_utc.isoformat(),
-                    )
-                    for m in msgs
-                ],
+                (LEGACY_HASH_PREFIX, _LEGACY_HASH_END),
+            ).fetchall()
+        return {r["username"] for r in rows}
+
+    def drop_legacy(self, contact_username: str) -> int:
+        """
+        Удаляет строки контакта, сохранённые до отпечатков. Вызывать только после
+        сбора, дошедшего до начала чата, — он сохранил всю историю заново.
+        Возвращает количество удалённых строк.
+        """
+        with self._connect() as conn:
+            deleted = conn.execute(
+                """
+                DELETE FROM messages
+                WHERE contact_id = (SELECT id FROM contacts WHERE username = ?)
+                  AND msg_hash >= ? AND msg_hash < ?
+                """,
+                (contact_username, LEGACY_HASH_PREFIX, _LEGACY_HASH_END),
+            ).rowcount
+            conn.commit()
+        return deleted
+
+    def list_for_contact(self, contact_username: str, limit: Optional[int] = None) -> List[MessageSnapshot]:
+        """
+        Сообщения контакта от старых к новым (limit — только последние limit).
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT s.name AS sender, m.text, m.timestamp_ms, m.scraped_at_ms, m.msg_hash
+                FROM (
+                    SELECT m.*
+                    FROM contacts c
+                    JOIN messages m ON m.contact_id = c.id
+                    WHERE c.username = ?
+                    ORDER BY m.seq DESC
+                    LIMIT ?
+                ) m
+                JOIN senders s ON s.id = m.sender_id
+                ORDER BY m.seq
+                """,
+                (contact_username, -1 if limit is None else limit),
+            ).fetchall()
+        return [
+            MessageSnapshot(
+                contact_username=contact_username,
+                sender=r["sender"],
+                text=r["text"],
+                timestamp_utc=from_epoch_ms(r["timestamp_ms"]),
+                scraped_at_utc=from_epoch_ms(r["scraped_at_ms"]),
+                msg_hash=r["msg_hash"],
             )
+            for r in rows
+        ]
+
+    def bulk_insert(self, messages: Iterable[MessageSnapshot]) -> int:
+        """
+        Сохраняет пачку сообщений, пропуская те, чей msg_hash уже есть в БД
+        у того же контакта. Возвращает количество вставленных строк.
+
+        Сообщения каждого контакта считаются одним сбором от старых к новым
+        (как отдаёт клиент) и раскладываются по seq так же, как insert_batch:
+        по уже сохранённым сообщениям сбора. Так более глубокий сбор после
+        неглубокого ставит старые сообщения перед сохранёнными, а не в конец.
+        Сообщениям без msg_hash он проставляется здесь.
+        """
+        by_contact: Dict[str, List[MessageSnapshot]] = {}
+        for m in messages:
+            by_contact.setdefault(m.contact_username, []).append(m)
+        if not by_contact:
+            return 0
+
+        fingerprinters: Dict[str, MessageFingerprinter] = {}
+        for contact, msgs in by_contact.items():
+            for m in msgs:
+                if m.msg_hash is None:
+                    fingerprinters.setdefault(contact, MessageFingerprinter()).assign(m)
+
+        inserted = 0
+        with self._connect() as conn:
+            contact_ids = self._contact_ids(conn, by_contact)
+            for contact, msgs in by_contact.items():
+                ranks = list(range(len(msgs) - 1, -1, -1))
+                count, _ = self._insert_ranked(conn, contact_ids[contact], msgs, ranks, None)
+                inserted += count
+            conn.commit()
+        return inserted
+
+    def insert_batch(self, batch: MessageBatch, anchor: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Пишет одну пачку потокового сбора чата в своей транзакции —
+        при сбое посередине чата уже записанное остаётся в БД.
+
+        seq сообщения = anchor - rank, где anchor — seq самого нового сообщения
+        сбора. Если в пачке есть уже сохранённые сообщения, anchor выравнивается
+        по ним (повторный сбор после сбоя продолжает ту же нумерацию); для новой
+        истории — MAX(seq) + SEQ_GAP. Возвращает (вставлено, anchor) — anchor
+        передаётся в следующую пачку того же сбора.
+        """
+        contact = batch.contact_username
+        if not batch.messages:
+            return 0, anchor
+        with self._connect() as conn:
+            contact_id = self._contact_ids(conn, {contact})[contact]
+            inserted, anchor = self._insert_ranked(conn, contact_id, batch.messages, batch.ranks, anchor)
             conn.commit()
+        return inserted, anchor
+
+    def _insert_ranked(
+        self,
+        conn: sqlite3.Connection,
+        contact_id: int,
+        messages: List[MessageSnapshot],
+        ranks: List[int],
+        anchor: Optional[int],
+    ) -> Tuple[int, int]:
+        """
+        Вставляет сообщения одного сбора с seq = anchor - rank (без commit).
+        """
+        known = self._known_seqs(conn, contact_id, [m.msg_hash for m in messages])
+        # каждое уже сохранённое сообщение «голосует» за свой anchor; редкие
+        # совпадения msg_hash с сообщением из другого места чата дают выбросы
+        votes = Counter(known[m.msg_hash] + rank for m, rank in zip(messages, ranks) if m.msg_hash in known)
+        if votes:
+            best, count = votes.most_common(1)[0]
+            if anchor is None or count >= 2:
+                anchor = best
+        if anchor is None:
+            anchor = self._max_seq(conn, contact_id) + SEQ_GAP
 
-        return len(msgs)
+        sender_ids = self._sender_ids(conn, {m.sender for m in messages})
+        rows = [
+            self._row(m, contact_id, sender_ids[m.sender], anchor - rank)
+            for m, rank in zip(messages, ranks)
+            if m.msg_hash not in known
+        ]
+        inserted = conn.executemany(_INSERT_SQL, rows).rowcount if rows else 0
+        return inserted, anchor
+
+    @staticmethod
+    def _row(m: MessageSnapshot, contact_id: int, sender_id: int, seq: int) -> tuple:
+        return (
+            contact_id,
+            sender_id,
+            m.text,
+            to_epoch_ms(m.timestamp_utc),
+            to_epoch_ms(m.scraped_at_utc),
+            m.msg_hash,
+            seq,
+        )
+
+    @staticmethod
+    def _contact_ids(conn: sqlite3.Connection, usernames: Iterable[str]) -> Dict[str, int]:
+        """
+        username -> contacts.id; контактам, которых ещё нет в contacts
+        (чат сохранили раньше списка диалогов), заводится строка с одним username.
+        """
+        usernames = list(usernames)
+        conn.executemany(
+            "INSERT INTO contacts (username) VALUES (?) ON CONFLICT(username) DO NOTHING",
+            [(u,) for u in usernames],
+        )
+        ids: Dict[str, int] = {}
+        for i in range(0, len(usernames), 500):
+            chunk = usernames[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT id, username FROM contacts WHERE username IN ({placeholders})", chunk)
+            ids.update((r["username"], r["id"]) for r in rows)
+        return ids
+
+    @staticmethod
+    def _sender_ids(conn: sqlite3.Connection, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Словарь отправителей: значение sender -> senders.id (новые добавляются).
+        """
+        names = list(names)
+        conn.executemany(
+            "INSERT INTO senders (name) VALUES (?) ON CONFLICT(name) DO NOTHING",
+            [(n,) for n in names],
+        )
+        placeholders = ",".join("?" * len(names))
+        rows = conn.execute(f"SELECT id, name FROM senders WHERE name IN ({placeholders})", names)
+        return {r["name"]: r["id"] for r in rows}
+
+    @staticmethod
+    def _max_seq(conn: sqlite3.Connection, contact_id: int) -> int:
+        row = conn.execute(
+            "SELECT MAX(seq) FROM messages WHERE contact_id = ?",
+            (contact_id,),
+        ).fetchone()
+        return row[0] or 0
+
+    @staticmethod
+    def _known_seqs(conn: sqlite3.Connection, contact_id: int, hashes: List[str]) -> Dict[str, int]:
+        """
+        msg_hash -> seq для уже сохранённых сообщений контакта из hashes.
+        """
+        known: Dict[str, int] = {}
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT msg_hash, seq FROM messages WHERE contact_id = ? AND msg_hash IN ({placeholders})",
+                (contact_id, *chunk),
+            )
+            known.update((r["msg_hash"], r["seq"]) for r in rows)
+        return known
 
     def save_message(self, snapshot: MessageSnapshot) -> None:
         """
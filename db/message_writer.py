@@ -0,0 +1,101 @@
+# db/message_writer.py
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from core.models import MessageBatch
+from db.message_repository import MessageRepository
+
+
+class BackgroundMessageWriter:
+    """
+    Фоновый поток записи сообщений: коллектор кладёт готовые пачки
+    (MessageBatch) в ограниченную очередь и сразу скроллит дальше, а поток
+    пишет каждую пачку в своей транзакции (MessageRepository.insert_batch).
+
+    Очередь ограничена (max_pending): если БД не успевает, submit() ждёт —
+    память не растёт. Ошибка записи пачки не останавливает поток, она
+    считается в errors и в результате drain() по контакту.
+    """
+
+    def __init__(self, repo: Optional[MessageRepository] = None, max_pending: int = 8) -> None:
+        self._repo = repo or MessageRepository()
+        self._queue: "queue.Queue[Optional[MessageBatch]]" = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._lock = threading.Lock()
+        # contact_username -> anchor текущего сбора (см. insert_batch)
+        self._anchors: Dict[str, Optional[int]] = {}
+        self._inserted: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self.batches = 0
+        self.inserted = 0
+        self.errors = 0
+        self.write_seconds = 0.0
+
+    def start(self) -> "BackgroundMessageWriter":
+        self._thread.start()
+        return self
+
+    def submit(self, batch: MessageBatch) -> None:
+        """
+        Ставит пачку в очередь (ждёт, если очередь полна).
+        """
+        self._queue.put(batch)
+
+    def drain(self, contact_username: str) -> int:
+        """
+        Ждёт, пока записаны все поставленные пачки, и возвращает, сколько
+        сообщений контакта вставлено с прошлого drain(). Если часть пачек
+        контакта не записалась — RuntimeError (записанное остаётся в БД).
+        """
+        self._queue.join()
+        with self._lock:
+            inserted = self._inserted.pop(contact_username, 0)
+            errors = self._errors.pop(contact_username, 0)
+        if errors:
+            raise RuntimeError(f"не записано пачек: {errors} (сохранено {inserted})")
+        return inserted
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                self._write(batch)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, batch: MessageBatch) -> None:
+        contact = batch.contact_username
+        anchor = None if batch.first else self._anchors.get(contact)
+        started = time.perf_counter()
+        try:
+            inserted, anchor = self._repo.insert_batch(batch, anchor)
+        except Exception as e:
+            with self._lock:
+                self._errors[contact] = self._errors.get(contact, 0) + 1
+                self.errors += 1
+            print(f"[ERROR] Не удалось записать пачку сообщений {contact}: {e!r}")
+            return
+        finally:
+            self.write_seconds += time.perf_counter() - started
+        self._anchors[contact] = anchor
+        with self._lock:
+            self._inserted[contact] = self._inserted.get(contact, 0) + inserted
+            self.batches += 1
+            self.inserted += inserted
+
+    def report(self) -> str:
+        return (
+            f"пачек {self.batches}, вставлено {self.inserted}, ошибок {self.errors}, "
+            f"в БД {self.write_seconds:.1f} с"
+        )
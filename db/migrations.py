@@ -0,0 +1,404 @@
+# db/migrations.py
+
+from __future__ import annotations
+
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from db.connection import get_connection
+from db.message_repository import LEGACY_HASH_PREFIX
+from core.fingerprint import MessageFingerprinter
+
+# Сколько строк обновляется одной транзакцией. Между пачками блокировка
+# записи отпускается — бот / WebUI / сбор продолжают работать с БД.
+BATCH_SIZE = 50_000
+
+
+@dataclass
+class Migration:
+    """
+    Шаг схемы. apply должен быть идемпотентным: если процесс упал после
+    изменения, но до записи в schema_version, шаг просто повторится.
+    Долгие шаги сами коммитят пачками размера batch_size.
+    """
+    version: int
+    name: str
+    apply: Callable[[sqlite3.Connection, int], None]
+
+
+# ---------- помощники ----------
+
+def _columns(conn: sqlite3.Connection, table: str) -> Set[str]:
+    return {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _legacy_messages(conn: sqlite3.Connection) -> bool:
+    """
+    messages в старой раскладке (contact_username / sender / ISO-время в каждой строке).
+    Шаги 2–6 относятся только к ней: новая БД сразу создаётся компактной.
+    """
+    return "contact_username" in _columns(conn, "messages")
+
+
+def _in_batches(conn: sqlite3.Connection, sql: str, batch_size: int) -> int:
+    """
+    Повторяет UPDATE/DELETE с параметром LIMIT (sql содержит один '?')
+    до тех пор, пока он что-то меняет; каждая пачка — своя транзакция.
+    """
+    total = 0
+    while True:
+        changed = conn.execute(sql, (batch_size,)).rowcount
+        conn.commit()
+        total += changed
+        if changed < batch_size:
+            return total
+
+
+# ---------- шаги ----------
+
+def _contacts_thread_id(conn: sqlite3.Connection, batch_size: int) -> None:
+    if "thread_id" not in _columns(conn, "contacts"):
+        conn.execute("ALTER TABLE contacts ADD COLUMN thread_id TEXT")
+
+
+def _messages_hash_and_seq(conn: sqlite3.Connection, batch_size: int) -> None:
+    if not _legacy_messages(conn):
+        return
+    columns = _columns(conn, "messages")
+    if "msg_hash" not in columns:
+        conn.execute("ALTER TABLE messages ADD COLUMN msg_hash TEXT NULL")
+    if "seq" not in columns:
+        conn.execute("ALTER TABLE messages ADD COLUMN seq INTEGER NULL")
+    # раньше порядок задавал id
+    _in_batches(
+        conn,
+        "UPDATE messages SET seq = id WHERE id IN (SELECT id FROM messages WHERE seq IS NULL LIMIT ?)",
+        batch_size,
+    )
+
+
+def _messages_contact_seq_index(conn: sqlite3.Connection, batch_size: int) -> None:
+    if not _legacy_messages(conn):
+        return
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_contact_seq ON messages(contact_username, seq)")
+
+
+def _legacy_history(rows: List[sqlite3.Row]) -> Tuple[List[Tuple[int, str]], List[int]]:
+    """
+    Сводит строки без msg_hash (сохранённые до отпечатков) одного контакта
+    в одну историю. Возвращает ([(id, msg_hash)] от старых к новым, id дублей).
+
+    Такие строки писал первый сборщик: один прогон — одно значение scraped_at_utc
+    на все строки, порядок — порядок записи. Поэтому отпечаток считается внутри
+    каждого сбора отдельно, с контекстом из того же сбора: повторный сбор того же
+    участка чата даёт те же отпечатки, и его строки — дубли. У первых строк сбора
+    контекст неполный — они сверяются по отправителю и тексту с соседями
+    совпавшего сообщения. Новые строки сбора встают перед следующим его
+    совпавшим сообщением (или в конец истории).
+
+    Порядок экранов внутри такого сбора (новые экраны писались первыми) из
+    данных не восстановить, поэтому msg_hash получает LEGACY_HASH_PREFIX:
+    контакт потом пересобирается целиком, а эти строки удаляются.
+    """
+    scrapes: Dict[str, List[sqlite3.Row]] = {}
+    for r in sorted(rows, key=lambda r: r["id"]):
+        scrapes.setdefault(r["scraped_at_utc"], []).append(r)
+
+    history: List[Tuple[sqlite3.Row, str]] = []
+    duplicates: List[int] = []
+    for scrape in scrapes.values():
+        fingerprinter = MessageFingerprinter()
+        hashes = [fingerprinter.next_hash(r["sender"], r["text"]) for r in scrape]
+        position = {h: i for i, (_, h) in enumerate(history)}
+        matched = [position.get(h) for h in hashes]
+
+        # граничные строки сбора: тот же отправитель и текст подряд перед первым совпавшим
+        first = next((k for k, p in enumerate(matched) if p is not None), None)
+        if first is not None:
+            k, p = first - 1, matched[first] - 1
+            while k >= 0 and p >= 0 and (scrape[k]["sender"], scrape[k]["text"]) == (
+                history[p][0]["sender"], history[p][0]["text"]
+            ):
+                matched[k] = p
+                k, p = k - 1, p - 1
+
+        # before[i] — новые строки перед history[i] (before[len] — в конец)
+        before: List[List[Tuple[sqlite3.Row, str]]] = [[] for _ in range(len(history) + 1)]
+        pending: List[Tuple[sqlite3.Row, str]] = []
+        seen = set(position)
+        for r, h, p in zip(scrape, hashes, matched):
+            if p is not None or h in seen:
+                duplicates.append(r["id"])
+                if p is not None:
+                    before[p].extend(pending)
+                    pending = []
+                continue
+            seen.add(h)
+            pending.append((r, h))
+        before[len(history)].extend(pending)
+
+        merged: List[Tuple[sqlite3.Row, str]] = []
+        for i, item in enumerate(history):
+            merged.extend(before[i])
+            merged.append(item)
+        merged.extend(before[len(history)])
+        history = merged
+
+    return [(r["id"], LEGACY_HASH_PREFIX + h) for r, h in history], duplicates
+
+
+def _messages_unique_hash(conn: sqlite3.Connection, batch_size: int) -> None:
+    """
+    Подготовка к UNIQUE(contact_username, msg_hash) на старой БД.
+
+    Строки без msg_hash сводятся по сборам (_legacy_history): дубли удаляются,
+    остальным проставляются msg_hash и seq по сведённой истории — в том же
+    диапазоне seq, что они занимали, то есть перед строками с отпечатками.
+    Из строк с одинаковым msg_hash остаётся первая. Контакты обрабатываются
+    по одному, коммит — когда набралось batch_size изменённых строк.
+    """
+    if not _legacy_messages(conn):
+        return
+    filled = removed = pending = 0
+    contacts = [
+        r[0] for r in conn.execute(
+            """
+            SELECT DISTINCT contact_username FROM messages WHERE msg_hash IS NULL
+            UNION
+            SELECT contact_username FROM messages
+            WHERE msg_hash IS NOT NULL
+            GROUP BY contact_username, msg_hash HAVING COUNT(*) > 1
+            """
+        )
+    ]
+    for contact in contacts:
+        rows = conn.execute(
+            """
+            SELECT id, sender, text, scraped_at_utc, msg_hash, seq
+            FROM messages WHERE contact_username = ? ORDER BY seq, id
+            """,
+            (contact,),
+        ).fetchall()
+        legacy = [r for r in rows if r["msg_hash"] is None]
+        taken = set()
+        duplicates: List[int] = []
+        for r in rows:
+            if r["msg_hash"] is None:
+                continue
+            if r["msg_hash"] in taken:
+                duplicates.append(r["id"])
+            taken.add(r["msg_hash"])
+
+        updates: List[tuple] = []
+        if legacy:
+            history, legacy_duplicates = _legacy_history(legacy)
+            duplicates.extend(legacy_duplicates)
+            base = min(r["seq"] for r in legacy)
+            updates = [(msg_hash, base + i, row_id) for i, (row_id, msg_hash) in enumerate(history)]
+
+        # сначала удаляем дубли: их msg_hash может совпасть с проставляемым
+        conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in duplicates])
+        conn.executemany("UPDATE messages SET msg_hash = ?, seq = ? WHERE id = ?", updates)
+        filled += len(updates)
+        removed += len(duplicates)
+        pending += len(updates) + len(duplicates)
+        if pending >= batch_size:
+            conn.commit()
+            pending = 0
+    conn.commit()
+    if filled or removed:
+        print(f"[INFO] messages: проставлен msg_hash {filled} строкам, удалено дублей {removed}")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_contact_hash ON messages(contact_username, msg_hash)"
+    )
+
+
+def _messages_contact_id_index(conn: sqlite3.Connection, batch_size: int) -> None:
+    if not _legacy_messages(conn):
+        return
+    # последние сообщения контакта в порядке вставки (id) без полного скана
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_contact_id ON messages(contact_username, id)")
+
+
+def _messages_contact_timestamp_index(conn: sqlite3.Connection, batch_size: int) -> None:
+    if not _legacy_messages(conn):
+        return
+    # выборки переписки контакта за период
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_contact_ts ON messages(contact_username, timestamp_utc)"
+    )
+
+
+# epoch-мс из ISO-строки (julianday понимает и смещение часового пояса)
+_MS_FROM_ISO = "CAST(ROUND((julianday({col}) - 2440587.5) * 86400000.0) AS INTEGER)"
+
+
+def _create_compact_indexes(conn: sqlite3.Connection, table: str) -> None:
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_cid_hash ON {table}(contact_id, msg_hash)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_messages_cid_seq ON {table}(contact_id, seq)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_messages_cid_ts ON {table}(contact_id, timestamp_ms)")
+
+
+def _messages_compact(conn: sqlite3.Connection, batch_size: int) -> None:
+    """
+    Переводит messages в компактную раскладку:
+        contact_username TEXT -> contact_id INTEGER (contacts.id),
+        sender TEXT           -> sender_id INTEGER (словарь senders),
+        *_utc ISO TEXT        -> *_ms INTEGER (мс Unix-времени).
+
+    Строки копируются в messages_compact пачками по id (можно прервать и
+    продолжить); индексы строятся до подмены, так что под блокировкой
+    остаются только докопирование новых строк, DROP старой таблицы и RENAME.
+    Место старой таблицы возвращается файлу только после VACUUM.
+    """
+    if not _legacy_messages(conn):
+        # новая БД: таблица уже компактная, нужны только индексы
+        _create_compact_indexes(conn, "messages")
+        return
+
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS senders (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages_compact (
+            id            INTEGER PRIMARY KEY,
+            contact_id    INTEGER NOT NULL REFERENCES contacts(id),
+            sender_id     INTEGER NOT NULL REFERENCES senders(id),
+            text          TEXT NOT NULL,
+            timestamp_ms  INTEGER NULL,
+            scraped_at_ms INTEGER NOT NULL,
+            msg_hash      TEXT NULL,
+            seq           INTEGER NOT NULL
+        )
+        """
+    )
+
+    copy_sql = f"""
+        INSERT INTO messages_compact (
+            id, contact_id, sender_id, text, timestamp_ms, scraped_at_ms, msg_hash, seq
+        )
+        SELECT
+            m.id,
+            c.id,
+            s.id,
+            m.text,
+            {_MS_FROM_ISO.format(col="m.timestamp_utc")},
+            {_MS_FROM_ISO.format(col="m.scraped_at_utc")},
+            m.msg_hash,
+            COALESCE(m.seq, m.id)
+        FROM messages m
+        JOIN contacts c ON c.username = m.contact_username
+        JOIN senders s  ON s.name = m.sender
+        WHERE m.id > ?
+        ORDER BY m.id
+        LIMIT ?
+    """
+
+    def copy_new_rows(commit_batches: bool) -> int:
+        # словари пополняются каждый раз: между пачками сбор мог записать новых
+        conn.execute(
+            """
+            INSERT INTO contacts (username)
+            SELECT DISTINCT contact_username FROM messages WHERE id > ?
+            ON CONFLICT(username) DO NOTHING
+            """,
+            (last_id(),),
+        )
+        conn.execute(
+            """
+            INSERT INTO senders (name)
+            SELECT DISTINCT sender FROM messages WHERE id > ?
+            ON CONFLICT(name) DO NOTHING
+            """,
+            (last_id(),),
+        )
+        total = 0
+        while True:
+            copied = conn.execute(copy_sql, (last_id(), batch_size)).rowcount
+            total += copied
+            if copied < batch_size:
+                return total
+            if commit_batches:
+                conn.commit()
+
+    def last_id() -> int:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages_compact").fetchone()[0]
+
+    copied = copy_new_rows(commit_batches=True)
+    conn.commit()
+    print(f"[INFO] messages: скопировано в компактную таблицу {copied} строк")
+    _create_compact_indexes(conn, "messages_compact")
+
+    # подмена — одной транзакцией, писатели ждут её на busy_timeout
+    conn.execute("BEGIN IMMEDIATE")
+    copy_new_rows(commit_batches=False)
+    conn.execute("DROP TABLE messages")
+    conn.execute("ALTER TABLE messages_compact RENAME TO messages")
+    conn.commit()
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "contacts.thread_id", _contacts_thread_id),
+    Migration(2, "messages.msg_hash + messages.seq", _messages_hash_and_seq),
+    Migration(3, "index messages(contact_username, seq)", _messages_contact_seq_index),
+    Migration(4, "unique messages(contact_username, msg_hash)", _messages_unique_hash),
+    Migration(5, "index messages(contact_username, id)", _messages_contact_id_index),
+    Migration(6, "index messages(contact_username, timestamp_utc)", _messages_contact_timestamp_index),
+    Migration(7, "compact messages: contact_id, sender_id, epoch ms", _messages_compact),
+]
+
+
+# ---------- запуск ----------
+
+def _init_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version        INTEGER PRIMARY KEY,
+            name           TEXT NOT NULL,
+            applied_at_utc TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+
+def current_version() -> int:
+    """
+    Последняя применённая миграция (0 — ни одной).
+    """
+    with get_connection() as conn:
+        _init_version_table(conn)
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(target: Optional[int] = None, batch_size: int = BATCH_SIZE) -> List[Migration]:
+    """
+    Применяет по порядку миграции новее текущей версии (до target включительно).
+    Таблицы должны уже существовать — init_db создаёт их до вызова.
+    Возвращает применённые шаги.
+    """
+    applied: List[Migration] = []
+    with get_connection() as conn:
+        _init_version_table(conn)
+        version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version <= version:
+                continue
+            if target is not None and migration.version > target:
+                break
+            started = time.perf_counter()
+            migration.apply(conn, batch_size)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at_utc) VALUES (?, ?, ?)",
+                (migration.version, migration.name, datetime.now(timezone.utc).isoformat()),
+            )
+            conn.commit()
+            applied.append(migration)
+            print(f"[MIGRATE] {migration.version}: {migration.name} ({time.perf_counter() - started:.1f} с)")
+    return applied
@@ -0,0 +1,275 @@
+# db/sync_run_repository.py
+
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from db.connection import get_connection
+
+# Состояния контакта внутри прогона
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+# Состояния прогона
+RUN_RUNNING = "running"
+RUN_DONE = "done"
+RUN_INCOMPLETE = "incomplete"      # дошли до конца, но остались упавшие контакты
+RUN_INTERRUPTED = "interrupted"    # Ctrl+C / упал браузер
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class SyncRunSummary:
+    run_id: int
+    mode: str
+    status: str
+    started_at_utc: str
+    finished_at_utc: Optional[str]
+    contacts_total: int
+    contacts_done: int
+    contacts_failed: int
+    messages_saved: int
+    busy_seconds: float          # сумма длительностей контактов
+
+    @property
+    def contacts_per_minute(self) -> float:
+        return self.contacts_done * 60 / self.busy_seconds if self.busy_seconds else 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages_saved / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class SyncRunRepository:
+    """
+    Прогоны sync_messages_for_all и состояние каждого контакта в них.
+
+        sync_runs          — один прогон: режим, статус, время начала/конца;
+        sync_run_contacts  — контакт в прогоне: pending / in_progress / done / failed,
+                             попытки, сохранённые сообщения, глубина скролла, длительность.
+
+    Прогон можно продолжить (--resume): готовые контакты пропускаются, упавшие
+    повторяются, пока не исчерпан лимит попыток. По завершённым прогонам
+    видна история пропускной способности (history()).
+    """
+
+    def __init__(self) -> None:
+        pass
+
+    def _connect(self) -> sqlite3.Connection:
+        return get_connection()
+
+    # ---------- схема ----------
+
+    def init_schema(self) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sync_runs (
+                    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                    mode            TEXT NOT NULL,
+                    status          TEXT NOT NULL,
+                    started_at_utc  TEXT NOT NULL,
+                    finished_at_utc TEXT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sync_run_contacts (
+                    run_id           INTEGER NOT NULL REFERENCES sync_runs(id),
+                    contact_username TEXT NOT NULL,
+                    position         INTEGER NOT NULL,
+                    status           TEXT NOT NULL,
+                    attempts         INTEGER NOT NULL DEFAULT 0,
+                    messages_saved   INTEGER NOT NULL DEFAULT 0,
+                    scroll_depth     INTEGER NULL,
+                    duration_seconds REAL NULL,
+                    error            TEXT NULL,
+                    updated_at_utc   TEXT NOT NULL,
+                    PRIMARY KEY (run_id, contact_username)
+                )
+                """
+            )
+            conn.commit()
+
+    # ---------- прогон ----------
+
+    def start_run(self, mode: str, usernames: List[str]) -> int:
+        """
+        Новый прогон: все контакты в состоянии pending в переданном порядке.
+        """
+        now = _now()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO sync_runs (mode, status, started_at_utc) VALUES (?, ?, ?)",
+                (mode, RUN_RUNNING, now),
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO sync_run_contacts (run_id, contact_username, position, status, updated_at_utc)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [(run_id, username, i, PENDING, now) for i, username in enumerate(usernames)],
+            )
+            conn.commit()
+        return run_id
+
+    def latest_unfinished(self) -> Optional[int]:
+        """
+        Последний прогон, который не дошёл до статуса done.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM sync_runs WHERE status != ? ORDER BY id DESC LIMIT 1",
+                (RUN_DONE,),
+            ).fetchone()
+        return row["id"] if row else None
+
+    def resume_run(self, run_id: int, max_attempts: int) -> List[str]:
+        """
+        Готовит прогон к продолжению и возвращает контакты, которые осталось
+        обработать (в исходном порядке): pending, прерванные на середине
+        in_progress и failed, у которых попыток меньше max_attempts.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT id FROM sync_runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Прогон {run_id} не найден")
+            # контакт, на котором оборвался прогон, начинаем заново
+            conn.execute(
+                "UPDATE sync_run_contacts SET status = ?, updated_at_utc = ? WHERE run_id = ? AND status = ?",
+                (PENDING, _now(), run_id, IN_PROGRESS),
+            )
+            conn.execute(
+                "UPDATE sync_runs SET status = ?, finished_at_utc = NULL WHERE id = ?",
+                (RUN_RUNNING, run_id),
+            )
+            rows = conn.execute(
+                """
+                SELECT contact_username
+                FROM sync_run_contacts
+                WHERE run_id = ?
+                  AND (status = ? OR (status = ? AND attempts < ?))
+                ORDER BY position
+                """,
+                (run_id, PENDING, FAILED, max_attempts),
+            ).fetchall()
+            conn.commit()
+        return [r["contact_username"] for r in rows]
+
+    def finish_run(self, run_id: int, interrupted: bool = False) -> str:
+        """
+        Закрывает прогон: done — все контакты готовы, incomplete — остались
+        упавшие или необработанные, interrupted — прервали снаружи.
+        """
+        with self._connect() as conn:
+            left = conn.execute(
+                "SELECT COUNT(*) FROM sync_run_contacts WHERE run_id = ? AND status != ?",
+                (run_id, DONE),
+            ).fetchone()[0]
+            if interrupted:
+                status = RUN_INTERRUPTED
+            else:
+                status = RUN_DONE if left == 0 else RUN_INCOMPLETE
+            conn.execute(
+                "UPDATE sync_runs SET status = ?, finished_at_utc = ? WHERE id = ?",
+                (status, _now(), run_id),
+            )
+            conn.commit()
+        return status
+
+    # ---------- контакты ----------
+
+    def mark_in_progress(self, run_id: int, username: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE sync_run_contacts
+                SET status = ?, attempts = attempts + 1, error = NULL, updated_at_utc = ?
+                WHERE run_id = ? AND contact_username = ?
+                """,
+                (IN_PROGRESS, _now(), run_id, username),
+            )
+            conn.commit()
+
+    def mark_done(
+        self,
+        run_id: int,
+        username: str,
+        messages_saved: int,
+        scroll_depth: Optional[int],
+        duration_seconds: float,
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE sync_run_contacts
+                SET status = ?, messages_saved = messages_saved + ?, scroll_depth = ?,
+                    duration_seconds = ?, error = NULL, updated_at_utc = ?
+                WHERE run_id = ? AND contact_username = ?
+                """,
+                (DONE, messages_saved, scroll_depth, duration_seconds, _now(), run_id, username),
+            )
+            conn.commit()
+
+    def mark_failed(self, run_id: int, username: str, error: str, duration_seconds: float) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE sync_run_contacts
+                SET status = ?, error = ?, duration_seconds = ?, updated_at_utc = ?
+                WHERE run_id = ? AND contact_username = ?
+                """,
+                (FAILED, error[:500], duration_seconds, _now(), run_id, username),
+            )
+            conn.commit()
+
+    # ---------- отчёты ----------
+
+    def history(self, limit: int = 10) -> List[SyncRunSummary]:
+        """
+        Последние прогоны (новые первыми) с итогами по контактам.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT
+                    r.id, r.mode, r.status, r.started_at_utc, r.finished_at_utc,
+                    COUNT(c.contact_username)                              AS total,
+                    COALESCE(SUM(c.status = 'done'), 0)                    AS done,
+                    COALESCE(SUM(c.status = 'failed'), 0)                  AS failed,
+                    COALESCE(SUM(c.messages_saved), 0)                     AS messages,
+                    COALESCE(SUM(c.duration_seconds), 0)                   AS busy
+                FROM sync_runs r
+                LEFT JOIN sync_run_contacts c ON c.run_id = r.id
+                GROUP BY r.id
+                ORDER BY r.id DESC
+                LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+        return [
+            SyncRunSummary(
+                run_id=r["id"],
+                mode=r["mode"],
+                status=r["status"],
+                started_at_utc=r["started_at_utc"],
+                finished_at_utc=r["finished_at_utc"],
+                contacts_total=r["total"],
+                contacts_done=r["done"],
+                contacts_failed=r["failed"],
+                messages_saved=r["messages"],
+                busy_seconds=r["busy"],
+            )
+            for r in rows
+        ]
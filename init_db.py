@@ -3,6 +3,8 @@ from __future__ import annotations
 
 from db.contact_repository import ContactRepository
 from db.message_repository import MessageRepository
+from db.migrations import apply_migrations, current_version
+from db.sync_run_repository import SyncRunRepository
 
 
 def main():
@@ -16,6 +18,12 @@ def main():
     contacts_repo.init_schema()
     print("[INIT] contacts table created/verified.")
 
+    SyncRunRepository().init_schema()
+    print("[INIT] sync_runs tables created/verified.")
+
+    applied = apply_migrations()
+    print(f"[INIT] schema version {current_version()} (applied {len(applied)} migrations).")
+
     print("[INIT] Done.")
 
 
@@ -3,7 +3,7 @@
 from typing import Iterable
 
 from core.models import ContactSnapshot
-from db.contact_repository import ContactRepository
+from db.contact_repository import ContactRepository, UpsertResult
 
 
 class ContactSyncService:
@@ -15,11 +15,9 @@ class ContactSyncService:
     def __init__(self, contact_repo: ContactRepository) -> None:
         self._repo = contact_repo
 
-    def sync_contacts(self, snapshots: Iterable[ContactSnapshot]) -> None:
+    def sync_contacts(self, snapshots: Iterable[ContactSnapshot]) -> UpsertResult:
         """
-        Принимает список ContactSnapshot и сохраняет их в БД.
-        Пока логика простая: upsert по username/full_name.
+        Принимает список ContactSnapshot и сохраняет их в БД одной транзакцией
+        (upsert по username). Возвращает, сколько контактов добавлено / изменено.
         """
-        for snap in snapshots:
-            # Предполагаем, что в ContactRepository есть метод upsert_from_snapshot
-            self._repo.upsert_from_snapshot(snap)
\ No newline at end of file
+        return self._repo.bulk_upsert(list(snapshots))
\ No newline at end of file
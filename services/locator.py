@@ -0,0 +1,144 @@
+# services/locator.py
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+
+# Ближайший прокручиваемый предок элемента — единственная копия этого обхода.
+# arguments: seed (элемент или null), seed selector (если seed не передан),
+#            thumbFallback — искать скроллбар div[data-thumb="1"], если предка нет.
+_JS_RESOLVE_CONTAINER = """
+let el = arguments[0] || (arguments[1] ? document.querySelector(arguments[1]) : null);
+const thumbFallback = arguments[2];
+while (el && el.parentElement) {
+    el = el.parentElement;
+    const style = window.getComputedStyle(el);
+    const oy = style.overflowY;
+    if ((oy === 'auto' || oy === 'scroll') && el.scrollHeight > el.clientHeight) {
+        return el;
+    }
+}
+if (thumbFallback) {
+    const thumb = document.querySelector('div[data-thumb="1"]');
+    if (thumb && thumb.parentElement) {
+        return thumb.parentElement;
+    }
+}
+return null;
+"""
+
+# Дешёвая проверка закэшированного контейнера: всё ещё в документе.
+_JS_IS_CONNECTED = "return arguments[0].isConnected;"
+
+
+@dataclass
+class LocatorTarget:
+    """
+    Что ищем: контейнер — прокручиваемый предок первого элемента по seed_selector.
+    """
+    seed_selector: str
+    thumb_fallback: bool = False
+
+
+@dataclass
+class LocatorStats:
+    hits: int = 0        # закэшированный handle живой
+    misses: int = 0      # кэша не было — искали с нуля
+    stale: int = 0       # handle устарел (Instagram перерисовал DOM) — искали заново
+    not_found: int = 0   # поиск ничего не дал
+
+    def __str__(self) -> str:
+        return f"hit {self.hits}, miss {self.misses}, stale {self.stale}, не найден {self.not_found}"
+
+
+class LocatorService:
+    """
+    Находит и кэширует контейнеры страницы (список диалогов, история чата).
+
+    get() отдаёт закэшированный WebElement, если он ещё в документе (один
+    короткий execute_script), иначе прозрачно ищет контейнер заново.
+    После навигации кэш сбрасывается через invalidate(). Счётчики в stats
+    показывают, как часто Instagram перерисовывает DOM под нами.
+    """
+
+    def __init__(
+        self,
+        driver: WebDriver,
+        targets: Dict[str, LocatorTarget],
+    ) -> None:
+        self._driver = driver
+        self._targets = dict(targets)
+        self._cache: Dict[str, object] = {}
+        self.stats: Dict[str, LocatorStats] = {name: LocatorStats() for name in self._targets}
+
+    # ---------- контейнеры ----------
+
+    def get(self, name: str, seed=None, refresh: bool = False):
+        """
+        Контейнер `name` или None, если найти его не удалось.
+        seed — элемент внутри контейнера, от которого подниматься (если он уже
+        есть у вызывающего кода); refresh=True — не доверять кэшу.
+        """
+        target = self._targets[name]
+        stats = self.stats[name]
+
+        cached = self._cache.get(name)
+        if cached is not None and not refresh:
+            if self._is_connected(cached):
+                stats.hits += 1
+                return cached
+            stats.stale += 1
+        elif cached is not None:
+            stats.stale += 1
+        else:
+            stats.misses += 1
+
+        container = self.scrollable_ancestor(seed, target.seed_selector, target.thumb_fallback)
+        if container is None:
+            stats.not_found += 1
+            self._cache.pop(name, None)
+            return None
+        self._cache[name] = container
+        return container
+
+    def peek(self, name: str):
+        """
+        Закэшированный контейнер без проверки (None, если кэша нет) — для
+        областей поиска, где устаревший handle и так обрабатывается.
+        """
+        return self._cache.get(name)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Сбрасывает кэш контейнера (или всех), например после driver.get / клика в чат.
+        """
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    def scrollable_ancestor(self, element=None, seed_selector: Optional[str] = None, thumb_fallback: bool = False):
+        """
+        Ближайший прокручиваемый предок element (или первого элемента по seed_selector).
+        """
+        try:
+            return self._driver.execute_script(_JS_RESOLVE_CONTAINER, element, seed_selector, thumb_fallback)
+        except StaleElementReferenceException:
+            if element is None or not seed_selector:
+                return None
+            # seed сам устарел — поднимаемся от свежего элемента по селектору
+            return self._driver.execute_script(_JS_RESOLVE_CONTAINER, None, seed_selector, thumb_fallback)
+
+    def _is_connected(self, element) -> bool:
+        try:
+            return bool(self._driver.execute_script(_JS_IS_CONNECTED, element))
+        except StaleElementReferenceException:
+            return False
+
+    def report(self) -> str:
+        return "; ".join(f"{name}: {stats}" for name, stats in self.stats.items())
@@ -0,0 +1,208 @@
+# services/scroll_engine.py
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+
+# Спиннеры подгрузки, которые показывает Instagram (английский + русский интерфейс)
+DEFAULT_SPINNER_SELECTOR = (
+    "[role='progressbar'], "
+    "svg[aria-label='Loading...'], "
+    "svg[aria-label='Загрузка...']"
+)
+
+# Один шаг скролла + ожидание реакции страницы, всё внутри браузера.
+# arguments: container, direction (-1 вверх / +1 вниз), step px,
+#            timeout ms, settle ms, count selector, spinner selector, callback.
+# Ждём, пока:
+#   - вырастет scrollHeight или изменится число элементов (подгрузка),
+#   - исчезнет спиннер, если он был виден,
+# либо до таймаута. Если упёрлись в край и ничего не грузится — ждём весь timeout
+# (именно там Instagram подгружает историю), если просто сдвинулись — только settle.
+_JS_SCROLL_STEP = """
+const container = arguments[0];
+const direction = arguments[1];
+const step = arguments[2];
+const timeoutMs = arguments[3];
+const settleMs = arguments[4];
+const countSelector = arguments[5];
+const spinnerSelector = arguments[6];
+const done = arguments[arguments.length - 1];
+
+function state() {
+    return {
+        top: container.scrollTop,
+        height: container.scrollHeight,
+        client: container.clientHeight,
+        count: countSelector ? container.querySelectorAll(countSelector).length : 0,
+        spinner: spinnerSelector ? !!document.querySelector(spinnerSelector) : false,
+    };
+}
+
+function atEdge(s) {
+    return direction < 0 ? s.top <= 5 : (s.top + s.client) >= (s.height - 5);
+}
+
+const before = state();
+container.scrollTop = container.scrollTop + direction * step;
+const started = performance.now();
+let sawSpinner = false;
+
+function poll() {
+    const now = state();
+    const elapsed = performance.now() - started;
+    sawSpinner = sawSpinner || now.spinner;
+    const loaded = now.height !== before.height || now.count !== before.count;
+    const moved = now.top !== before.top;
+    const waitFull = !moved || atEdge(now);
+
+    let finished = false;
+    if (now.spinner) {
+        finished = elapsed >= timeoutMs;
+    } else if (loaded || sawSpinner) {
+        finished = true;
+    } else {
+        finished = elapsed >= (waitFull ? timeoutMs : settleMs);
+    }
+
+    if (finished) {
+        done({
+            moved: moved,
+            loaded: loaded,
+            at_edge: atEdge(now),
+            timed_out: elapsed >= timeoutMs,
+            elapsed_ms: Math.round(elapsed),
+            client_height: now.client,
+            count: now.count,
+        });
+        return;
+    }
+    setTimeout(poll, 50);
+}
+setTimeout(poll, 0);
+"""
+
+
+# Шаг скролла без ожидания: возвращает положение до/после и текущую высоту.
+_JS_SCROLL_NUDGE = """
+const container = arguments[0];
+const before = container.scrollTop;
+container.scrollTop = before + arguments[1] * arguments[2];
+return {top_before: before, top_after: container.scrollTop, height: container.scrollHeight};
+"""
+
+
+@dataclass
+class ScrollStepResult:
+    moved: bool          # scrollTop действительно сдвинулся
+    loaded: bool         # подгрузился новый контент (scrollHeight / число элементов)
+    at_edge: bool        # после шага упёрлись в верх/низ контейнера
+    timed_out: bool      # страница не отреагировала за timeout
+    elapsed: float       # сколько ждали реакции, секунд
+    step: int            # шаг, которым скроллили, px
+    count: int           # число элементов count_selector после шага
+
+
+class ScrollEngine:
+    """
+    Универсальный скроллер для чатов и списка контактов.
+
+    Вместо фиксированного time.sleep после каждого шага ждёт, пока страница
+    действительно изменится (вырос scrollHeight, изменилось число bubble'ов/карточек,
+    пропал спиннер), но не дольше timeout. Весь шаг — один execute_async_script.
+
+    Шаг адаптивный: если страница отвечает быстро — растёт до clientHeight,
+    если упираемся в таймауты (троттлинг) — уменьшается до min_step.
+    """
+
+    def __init__(
+        self,
+        driver: WebDriver,
+        min_step: int = 150,
+        initial_step: int = 300,
+        timeout: float = 3.0,
+        settle: float = 0.15,
+        fast_threshold: float = 0.5,
+        spinner_selector: str = DEFAULT_SPINNER_SELECTOR,
+    ) -> None:
+        self._driver = driver
+        self._min_step = min_step
+        self._initial_step = initial_step
+        self._timeout = timeout
+        self._settle = settle
+        self._fast_threshold = fast_threshold
+        self._spinner_selector = spinner_selector
+        self._step = initial_step
+
+    def reset(self) -> None:
+        """
+        Сбрасывает адаптивный шаг — вызывать при переходе к новому чату/списку.
+        """
+        self._step = self._initial_step
+
+    def step(
+        self,
+        container,
+        direction: str = "up",
+        count_selector: Optional[str] = None,
+        step: Optional[int] = None,
+    ) -> ScrollStepResult:
+        """
+        Делает один шаг скролла контейнера и ждёт реакции страницы.
+
+        :param direction: "up" (к старым сообщениям) или "down".
+        :param count_selector: CSS-селектор элементов, рост числа которых считается подгрузкой.
+        :param step: фиксированный шаг в px; по умолчанию — текущий адаптивный.
+        StaleElementReferenceException пробрасывается вызывающему коду.
+        """
+        cur_step = step if step is not None else self._step
+        raw = self._driver.execute_async_script(
+            _JS_SCROLL_STEP,
+            container,
+            -1 if direction == "up" else 1,
+            cur_step,
+            int(self._timeout * 1000),
+            int(self._settle * 1000),
+            count_selector,
+            self._spinner_selector,
+        ) or {}
+
+        result = ScrollStepResult(
+            moved=bool(raw.get("moved")),
+            loaded=bool(raw.get("loaded")),
+            at_edge=bool(raw.get("at_edge")),
+            timed_out=bool(raw.get("timed_out")),
+            elapsed=(raw.get("elapsed_ms") or 0) / 1000.0,
+            step=cur_step,
+            count=int(raw.get("count") or 0),
+        )
+
+        if step is None:
+            self._adapt(result, int(raw.get("client_height") or 0))
+        return result
+
+    def nudge(self, container, direction: str = "up", step: Optional[int] = None) -> dict:
+        """
+        Скроллит без ожидания реакции страницы — для конвейера по нескольким
+        вкладкам, где ожиданием служит работа с другими вкладками.
+        Возвращает {top_before, top_after, height}.
+        """
+        return self._driver.execute_script(
+            _JS_SCROLL_NUDGE,
+            container,
+            -1 if direction == "up" else 1,
+            step if step is not None else self._step,
+        ) or {}
+
+    def _adapt(self, result: ScrollStepResult, client_height: int) -> None:
+        max_step = max(client_height, self._min_step)
+        if result.timed_out and result.moved:
+            # страница не успевает подгружать — уменьшаем шаг
+            self._step = max(self._min_step, self._step // 2)
+        elif result.elapsed <= self._fast_threshold:
+            # отвечает быстро — шагаем крупнее, но не больше видимой высоты
+            self._step = min(max_step, self._step * 2)
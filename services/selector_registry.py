@@ -0,0 +1,218 @@
+# services/selector_registry.py
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.webdriver.common.by import By
+
+SELECTOR_STATS_ENV = "MYGRAM_SELECTOR_STATS"
+DEFAULT_STATS_FILE = "selector_stats.json"
+
+# Вес последних попыток в скользящем hit rate: ~20 последних раундов
+_RECENT_ALPHA = 0.1
+
+# Сохраняют статистику несколько клиентов (пул браузеров) — пишем по очереди
+_SAVE_LOCK = threading.Lock()
+
+
+def get_stats_path() -> str:
+    """
+    Файл со статистикой селекторов. Можно переопределить через MYGRAM_SELECTOR_STATS.
+    """
+    env_path = os.getenv(SELECTOR_STATS_ENV)
+    if env_path:
+        return env_path
+    return str(Path(__file__).resolve().parents[1] / DEFAULT_STATS_FILE)
+
+
+@dataclass
+class SelectorStrategy:
+    """
+    Один способ найти элементы страницы: name — стабильное имя для статистики.
+    """
+    name: str
+    by: str
+    value: str
+
+
+@dataclass
+class StrategyStats:
+    attempts: int = 0
+    hits: int = 0
+    found: int = 0          # сколько элементов нашлось за все попадания
+    recent: float = 1.0     # скользящий hit rate, падает первым, когда меняется разметка
+
+    @property
+    def hit_rate(self) -> float:
+        # сглаживание: новая стратегия не проигрывает из-за одной неудачи
+        return (self.hits + 1) / (self.attempts + 2)
+
+
+class SelectorRegistry:
+    """
+    Реестр стратегий поиска элементов по типам страницы ("bubble", "card").
+
+    find() пробует стратегии в порядке hit rate (лучшая — первой), внутри
+    контейнера, если он передан, и переходит к следующей, только если текущая
+    ничего не нашла. Статистика попыток хранится в JSON-файле между запусками;
+    падение скользящего hit rate у лучшей стратегии означает, что Instagram
+    поменял разметку.
+    """
+
+    def __init__(
+        self,
+        driver,
+        strategies: Dict[str, Sequence[SelectorStrategy]],
+        stats_path: Optional[str] = None,
+        autosave_every: int = 50,
+    ) -> None:
+        self._driver = driver
+        self._strategies: Dict[str, List[SelectorStrategy]] = {k: list(v) for k, v in strategies.items()}
+        self._stats_path = stats_path or get_stats_path()
+        self._autosave_every = autosave_every
+        self._finds = 0
+        self._warned: set[Tuple[str, str]] = set()
+
+        self.stats: Dict[str, Dict[str, StrategyStats]] = {
+            page: {s.name: StrategyStats() for s in items} for page, items in self._strategies.items()
+        }
+        self._load()
+        # что уже записано в файл — при сохранении добавляем только разницу
+        self._saved = self._counters()
+
+    # ---------- поиск ----------
+
+    def ordered(self, page: str) -> List[SelectorStrategy]:
+        """
+        Стратегии типа страницы от лучшей к худшей (при равенстве — в порядке объявления).
+        """
+        stats = self.stats[page]
+        items = self._strategies[page]
+        return sorted(items, key=lambda s: (-stats[s.name].hit_rate, items.index(s)))
+
+    def css(self, page: str) -> List[str]:
+        """
+        CSS-стратегии типа страницы в порядке hit rate — для JS-экстракторов.
+        """
+        return [s.value for s in self.ordered(page) if s.by == By.CSS_SELECTOR]
+
+    def find(self, page: str, root=None, record: bool = True) -> Tuple[Optional[str], list]:
+        """
+        Ищет элементы типа page внутри root (WebElement) или во всём документе.
+        Возвращает (имя сработавшей стратегии, элементы) или (None, []).
+        record=False — не учитывать попытку (например, опрос в ожидании загрузки).
+        """
+        if root is None:
+            root = self._driver
+        for strategy in self.ordered(page):
+            try:
+                found = root.find_elements(strategy.by, strategy.value)
+            except StaleElementReferenceException:
+                if root is self._driver:
+                    raise
+                # контейнер перерисовали — ищем по всему документу
+                root = self._driver
+                found = root.find_elements(strategy.by, strategy.value)
+            except Exception:
+                found = []
+            if record:
+                self._record(page, strategy.name, len(found))
+            if found:
+                self._after_find()
+                return strategy.name, found
+        if record:
+            self._after_find()
+        return None, []
+
+    def _record(self, page: str, name: str, found: int) -> None:
+        st = self.stats[page][name]
+        st.attempts += 1
+        hit = 1.0 if found else 0.0
+        st.recent += _RECENT_ALPHA * (hit - st.recent)
+        if found:
+            st.hits += 1
+            st.found += found
+
+        # лучшая по истории стратегия перестала находить — вероятно, новая разметка
+        key = (page, name)
+        if st.attempts >= 20 and st.hit_rate > 0.8 and st.recent < 0.3 and key not in self._warned:
+            self._warned.add(key)
+            print(
+                f"[WARN] Селектор {page}/{name} почти перестал находить элементы "
+                f"(hit rate {st.hit_rate:.0%}, последние раунды {st.recent:.0%}) — возможно, Instagram поменял разметку"
+            )
+
+    def _after_find(self) -> None:
+        self._finds += 1
+        if self._autosave_every and self._finds % self._autosave_every == 0:
+            self.save()
+
+    # ---------- статистика ----------
+
+    def _counters(self) -> Dict[Tuple[str, str], Tuple[int, int, int]]:
+        return {
+            (page, name): (st.attempts, st.hits, st.found)
+            for page, items in self.stats.items()
+            for name, st in items.items()
+        }
+
+    def _load(self) -> None:
+        data = self._read_file()
+        for page, items in data.items():
+            for name, raw in items.items():
+                if page in self.stats and name in self.stats[page]:
+                    self.stats[page][name] = StrategyStats(**raw)
+
+    def _read_file(self) -> Dict[str, Dict[str, dict]]:
+        try:
+            with open(self._stats_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print("[WARN] Не удалось прочитать статистику селекторов:", repr(e))
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self) -> None:
+        """
+        Дописывает в файл прирост счётчиков с прошлого сохранения (файл могли
+        обновить другие клиенты) и заменяет файл атомарно.
+        """
+        with _SAVE_LOCK:
+            data = self._read_file()
+            current = self._counters()
+            for (page, name), (attempts, hits, found) in current.items():
+                s_attempts, s_hits, s_found = self._saved.get((page, name), (0, 0, 0))
+                raw = data.setdefault(page, {}).setdefault(name, asdict(StrategyStats()))
+                raw["attempts"] = raw.get("attempts", 0) + attempts - s_attempts
+                raw["hits"] = raw.get("hits", 0) + hits - s_hits
+                raw["found"] = raw.get("found", 0) + found - s_found
+                raw["recent"] = self.stats[page][name].recent
+
+            tmp_path = self._stats_path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self._stats_path)
+            except OSError as e:
+                print("[WARN] Не удалось сохранить статистику селекторов:", repr(e))
+                return
+            self._saved = current
+
+    def report(self) -> str:
+        parts = []
+        for page in self._strategies:
+            items = ", ".join(
+                f"{s.name} {self.stats[page][s.name].hits}/{self.stats[page][s.name].attempts}"
+                for s in self.ordered(page)
+            )
+            parts.append(f"{page}: {items}")
+        return "; ".join(parts)
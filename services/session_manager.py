@@ -0,0 +1,244 @@
+# services/session_manager.py
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+COOKIES_ENV = "MYGRAM_COOKIES_PATH"
+DEFAULT_COOKIES_FILE = "cookies.json"
+
+# Cookie, без которой Instagram считает сессию анонимной
+SESSION_COOKIE = "sessionid"
+
+# Список диалогов прогрузился: есть хотя бы одна карточка с именем
+INBOX_READY_SELECTOR = "div[role='button'][tabindex='0'] span[title]"
+
+# Cookies сохраняют несколько клиентов (пул браузеров) — пишем по очереди
+_SAVE_LOCK = threading.Lock()
+
+
+def get_cookies_path() -> str:
+    """
+    Файл с сохранёнными cookies. Можно переопределить через MYGRAM_COOKIES_PATH.
+    """
+    env_path = os.getenv(COOKIES_ENV)
+    if env_path:
+        return env_path
+    return str(Path(__file__).resolve().parents[1] / DEFAULT_COOKIES_FILE)
+
+
+@dataclass
+class SessionStats:
+    source: str = ""             # "profile" | "cookies" | "login"
+    inbox_seconds: float = 0.0   # от ensure_session() до первой карточки
+    cookies_saved: bool = False
+
+
+def _cdp_cookie(cookie: dict, fallback_url: str) -> dict:
+    """
+    Cookie в формате driver.get_cookies() -> параметр CDP Network.setCookies.
+    """
+    param = {"name": cookie["name"], "value": cookie["value"], "path": cookie.get("path", "/")}
+    if cookie.get("domain"):
+        param["domain"] = cookie["domain"]
+    else:
+        param["url"] = fallback_url
+    for key in ("secure", "httpOnly"):
+        if key in cookie:
+            param[key] = bool(cookie[key])
+    if cookie.get("sameSite") in ("Strict", "Lax", "None"):
+        param["sameSite"] = cookie["sameSite"]
+    if cookie.get("expiry"):
+        param["expires"] = float(cookie["expiry"])
+    return param
+
+
+class SessionManager:
+    """
+    Поднимает авторизованную сессию Instagram с минимумом навигаций.
+
+    Порядок:
+    1. профиль Chrome (create_driver(profile_dir=...)) уже содержит живую
+       sessionid — проверяем через CDP, не открывая страниц, и сразу идём в Direct;
+    2. иначе cookies из файла ставятся одной CDP-командой (без захода на главную);
+    3. иначе — ручной логин.
+    После входа cookies сохраняются в файл атомарно и только если изменились.
+    Вместо фиксированных sleep ждём первую карточку или редирект на логин.
+    """
+
+    def __init__(
+        self,
+        driver,
+        base_url: str = "https://www.instagram.com",
+        cookies_path: Optional[str] = None,
+        inbox_timeout: int = 60,
+        login_timeout: int = 300,
+    ) -> None:
+        self._driver = driver
+        self._base_url = base_url.rstrip("/")
+        self.cookies_path = cookies_path or get_cookies_path()
+        self._inbox_timeout = inbox_timeout
+        self._login_timeout = login_timeout
+        self.stats = SessionStats()
+
+    # ---------- проверка сессии ----------
+
+    def has_session(self) -> bool:
+        """
+        Дешёвая проверка: в браузере есть непросроченная sessionid для base_url.
+        Страницу не открывает. Без CDP (не Chrome) — False.
+        """
+        try:
+            result = self._driver.execute_cdp_cmd("Network.getCookies", {"urls": [self._base_url + "/"]})
+        except Exception:
+            return False
+        now = time.time()
+        for cookie in result.get("cookies") or []:
+            if cookie.get("name") != SESSION_COOKIE or not cookie.get("value"):
+                continue
+            expires = cookie.get("expires", -1)
+            # -1 — cookie сессии браузера: живёт, пока жив профиль
+            if expires is None or expires < 0 or expires > now:
+                return True
+        return False
+
+    def _read_cookies(self) -> Optional[List[dict]]:
+        try:
+            with open(self.cookies_path, "r", encoding="utf-8") as f:
+                cookies = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print("[WARN] Не удалось прочитать cookies:", repr(e))
+            return None
+        return cookies if isinstance(cookies, list) else None
+
+    def restore_from_file(self) -> bool:
+        """
+        Ставит cookies из файла. Сначала одной командой CDP, без навигации;
+        если CDP недоступен — по одной через add_cookie на главной странице.
+        """
+        cookies = self._read_cookies()
+        if not cookies:
+            return False
+        if not any(c.get("name") == SESSION_COOKIE for c in cookies):
+            print("[INFO] В сохранённых cookies нет sessionid — нужен логин.")
+            return False
+
+        try:
+            params = [_cdp_cookie(c, self._base_url + "/") for c in cookies if c.get("name")]
+            self._driver.execute_cdp_cmd("Network.setCookies", {"cookies": params})
+            return True
+        except Exception as e:
+            print("[DEBUG] CDP Network.setCookies недоступен, ставлю cookies по одной:", repr(e))
+
+        self._driver.get(f"{self._base_url}/")
+        for cookie in cookies:
+            try:
+                self._driver.add_cookie(cookie)
+            except Exception:
+                continue
+        return True
+
+    # ---------- вход ----------
+
+    def open_inbox(self, timeout: Optional[int] = None) -> bool:
+        """
+        Открывает Direct и ждёт первую карточку диалога.
+        False — Instagram отправил на страницу логина (сессия недействительна).
+        """
+        self._driver.get(f"{self._base_url}/direct/inbox/")
+        try:
+            WebDriverWait(self._driver, timeout or self._inbox_timeout).until(
+                lambda d: "/login" in d.current_url or d.find_elements(By.CSS_SELECTOR, INBOX_READY_SELECTOR)
+            )
+        except TimeoutException:
+            if "/login" in self._driver.current_url:
+                return False
+            raise
+        return "/login" not in self._driver.current_url
+
+    def _manual_login(self) -> None:
+        print("[LOGIN] Выполните вход вручную. После логина я сохраню cookies автоматически.")
+        self._driver.get(f"{self._base_url}/accounts/login/")
+        WebDriverWait(self._driver, self._login_timeout).until(
+            lambda d: "/direct" in d.current_url or "/inbox" in d.current_url
+        )
+        if not self.open_inbox():
+            raise RuntimeError("После ручного логина Direct всё равно отправляет на страницу входа")
+
+    def ensure_session(self) -> SessionStats:
+        """
+        Доводит браузер до открытого Direct с авторизацией.
+        """
+        started = time.perf_counter()
+
+        if self.has_session() and self.open_inbox():
+            self.stats.source = "profile"
+        elif self.restore_from_file() and self.open_inbox():
+            self.stats.source = "cookies"
+        else:
+            if os.path.exists(self.cookies_path):
+                print("[INFO] Cookies существуют, но недействительны — нужен логин.")
+            self._manual_login()
+            self.stats.source = "login"
+
+        self.stats.inbox_seconds = time.perf_counter() - started
+        self.stats.cookies_saved = self.save_cookies()
+        print(f"[INFO] Сессия: {self.stats.source}, до первой карточки {self.stats.inbox_seconds:.1f} с")
+        return self.stats
+
+    # ---------- сохранение ----------
+
+    def save_cookies(self) -> bool:
+        """
+        Сохраняет cookies текущей страницы, если они отличаются от сохранённых.
+        Пишет во временный файл и подменяет основной — при падении на середине
+        старый файл остаётся целым. У каждого сохранения свой временный файл,
+        а сравнение и замена идут под _SAVE_LOCK: воркеры пула не затирают
+        друг другу запись.
+        """
+        try:
+            cookies = self._driver.get_cookies()
+        except Exception as e:
+            print("[WARN] Не удалось получить cookies из браузера:", repr(e))
+            return False
+        if not any(c.get("name") == SESSION_COOKIE for c in cookies):
+            # не затираем рабочий файл cookies анонимной сессии
+            return False
+
+        cookies = sorted(cookies, key=lambda c: (c.get("domain", ""), c.get("path", ""), c.get("name", "")))
+        with _SAVE_LOCK:
+            if cookies == self._read_cookies():
+                return False
+
+            cookies_dir = os.path.dirname(self.cookies_path) or "."
+            tmp_path = None
+            try:
+                os.makedirs(cookies_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=cookies_dir, prefix=os.path.basename(self.cookies_path) + ".", suffix=".tmp"
+                )
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(cookies, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.cookies_path)
+            except OSError as e:
+                print("[WARN] Не удалось сохранить cookies:", repr(e))
+                if tmp_path is not None:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                return False
+        return True
@@ -0,0 +1,87 @@
+# tests/conftest.py
+
+from __future__ import annotations
+
+import random
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import pytest
+
+from client.chat_stitcher import ChatStreamStitcher
+from core.models import MessageBatch, MessageSnapshot
+from db.connection import DB_PATH_ENV, close_connections
+
+SCRAPED_AT = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """
+    Пустой файл БД для теста (соединения потока закрываются до и после).
+    """
+    path = str(tmp_path / "mygram.db")
+    close_connections()
+    monkeypatch.setenv(DB_PATH_ENV, path)
+    yield path
+    close_connections()
+
+
+@pytest.fixture
+def db(db_path):
+    """
+    БД со всеми таблицами и миграциями, как после python init_db.py.
+    """
+    import init_db
+
+    init_db.main()
+    return db_path
+
+
+def make_chat(contact: str, texts: List[str], senders: Optional[List[str]] = None) -> List[MessageSnapshot]:
+    """
+    Сообщения чата от старых к новым.
+    """
+    senders = senders or ["contact" if i % 2 else "me" for i in range(len(texts))]
+    return [
+        MessageSnapshot(contact, sender, text, None, SCRAPED_AT)
+        for sender, text in zip(senders, texts)
+    ]
+
+
+def split_rounds(messages: List[MessageSnapshot], rnd: random.Random, max_round: int = 6) -> list:
+    """
+    Раунды сбора, как их копит клиент: от новых к старым, внутри раунда —
+    от старых к новым; ключ bubble'а — "k<позиция в чате>". Бывают и пустые раунды.
+    """
+    rounds = []
+    end = len(messages)
+    while end > 0:
+        start = max(0, end - rnd.randint(0, max_round))
+        rounds.append([(f"k{i}", messages[i]) for i in range(start, end)])
+        end = start
+    return rounds
+
+
+def stream_batches(
+    messages: List[MessageSnapshot],
+    rnd: random.Random,
+    watermark: Optional[List[str]] = None,
+    reached_start: bool = True,
+) -> List[MessageBatch]:
+    """
+    Пачки потокового сбора чата: раунды по одному через ChatStreamStitcher.
+    reached_start=False — messages лишь хвост чата (сбор не дошёл до начала).
+    """
+    stitcher = ChatStreamStitcher(messages[0].contact_username if messages else "", watermark)
+    batches: list = []
+    released = []
+    for round_ in split_rounds(messages, rnd):
+        batches.append(round_)
+        batch = stitcher.release(batches, set())
+        if batch is not None and batch.messages:
+            released.append(batch)
+    batch = stitcher.release(batches, set(), final=True, reached_start=reached_start)
+    if batch is not None and batch.messages:
+        released.append(batch)
+    return released
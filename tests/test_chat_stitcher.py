@@ -0,0 +1,123 @@
+# tests/test_chat_stitcher.py
+
+from __future__ import annotations
+
+import copy
+import random
+
+from client.chat_stitcher import ChatStreamStitcher, iter_chronological
+from core.fingerprint import CONTEXT_DEPTH, assign_fingerprints
+from tests.conftest import make_chat, split_rounds
+
+# маленький алфавит — много повторов подряд и одинаковых контекстов
+_TEXTS = ["ok", "ok", "hi", "a", "b"]
+
+
+def _random_chat(rnd: random.Random):
+    texts = [rnd.choice(_TEXTS) for _ in range(rnd.randint(0, 40))]
+    senders = [rnd.choice(["me", "contact"]) for _ in texts]
+    return make_chat("bob", texts, senders)
+
+
+def _stream(rounds, watermark, drop_keys, reached_start=True):
+    """
+    Прогоняет раунды через ChatStreamStitcher так, как это делает клиент:
+    drop_keys известны только к концу сбора (найден watermark).
+    Возвращает [(ключ, текст, msg_hash)] от старых к новым.
+    """
+    total = sum(len(r) for r in rounds)
+    stitcher = ChatStreamStitcher("bob", watermark)
+    batches: list = []
+    released = []
+    for round_ in rounds:
+        batches.append(round_)
+        batch = stitcher.release(batches, set())
+        if batch is not None:
+            released.append(batch)
+    batch = stitcher.release(batches, drop_keys, final=True, reached_start=reached_start)
+    if batch is not None:
+        released.append(batch)
+
+    out = []
+    for batch in released:
+        # ранг — место от самого нового сообщения сбора
+        out = [
+            (f"k{total - 1 - rank}", m.text, m.msg_hash)
+            for m, rank in zip(batch.messages, batch.ranks)
+        ] + out
+    return [item for item in out if item[0] not in drop_keys]
+
+
+def test_stream_matches_iter_chronological():
+    rnd = random.Random(20)
+    for _ in range(2000):
+        chat = _random_chat(rnd)
+        rounds = split_rounds(chat, rnd)
+        watermark = rnd.choice([None, ["ok", "ok", "hi"], ["a"]])
+        drop_keys = set()
+        if watermark and chat and rnd.random() < 0.5:
+            drop_keys = {f"k{i}" for i in range(rnd.randint(0, len(chat)))}
+        reached_start = rnd.random() < 0.5
+
+        expected_rounds = copy.deepcopy(rounds)
+        keys = {id(m): key for r in expected_rounds for key, m in r}
+        expected = [
+            (keys[id(m)], m.text, m.msg_hash)
+            for m in iter_chronological(expected_rounds, drop_keys, reached_start=reached_start)
+        ]
+
+        assert _stream(copy.deepcopy(rounds), watermark, drop_keys, reached_start) == expected
+
+
+def test_iter_chronological_matches_full_fingerprints():
+    rnd = random.Random(7)
+    chat = _random_chat(random.Random(3)) + make_chat("bob", ["ok"] * 5, ["me"] * 5)
+    reference = copy.deepcopy(chat)
+    assign_fingerprints(reference)
+
+    got = list(iter_chronological(split_rounds(chat, rnd), set()))
+
+    assert [m.msg_hash for m in got] == [m.msg_hash for m in reference]
+    # серия одинаковых сообщений различается номером повтора
+    assert len({m.msg_hash for m in got[-3:]}) == 3
+
+
+def test_stream_ranks_are_contiguous_from_newest():
+    rnd = random.Random(11)
+    chat = make_chat("bob", [f"m{i}" for i in range(30)])
+    stitcher = ChatStreamStitcher("bob")
+    batches: list = []
+    ranks = []
+    firsts = []
+    for round_ in split_rounds(chat, rnd):
+        batches.append(round_)
+        batch = stitcher.release(batches, set())
+        if batch is not None and batch.messages:
+            ranks.extend(batch.ranks)
+            firsts.append(batch.first)
+        # в памяти остаётся только хвост: контекст старейшего отданного и его сосед
+        assert sum(len(b) for b in batches) <= CONTEXT_DEPTH + 1
+    batch = stitcher.release(batches, set(), final=True)
+    ranks.extend(batch.ranks)
+    firsts.append(batch.first)
+
+    assert sorted(ranks) == list(range(30))
+    assert firsts[0] and not any(firsts[1:])
+
+
+def test_partial_collect_hashes_match_deeper_collect():
+    rnd = random.Random(13)
+    for _ in range(500):
+        chat = _random_chat(rnd)
+        full = copy.deepcopy(chat)
+        assign_fingerprints(full)
+        full_hashes = [m.msg_hash for m in full]
+
+        # сбор не дошёл до начала чата: видны только последние depth сообщений
+        depth = rnd.randint(0, len(chat))
+        visible = copy.deepcopy(chat[len(chat) - depth:])
+        got = list(iter_chronological(split_rounds(visible, rnd), set(), reached_start=False))
+
+        # всё отданное — с теми же msg_hash, что и при полном сборе, и на своих местах
+        assert [m.msg_hash for m in got] == full_hashes[len(full_hashes) - len(got):]
+        assert len(got) <= max(0, depth - CONTEXT_DEPTH - 1)
@@ -0,0 +1,104 @@
+# tests/test_contact_card_parser.py
+#
+# Нужен bs4 (lxml — по возможности); без bs4 тесты пропускаются.
+
+from __future__ import annotations
+
+import pytest
+
+pytest.importorskip("bs4")
+
+from client.contact_card_parser import (  # noqa: E402
+    CARD_BACKENDS,
+    HTML_BACKEND_ENV,
+    ContactCardParser,
+    card_key,
+    default_backend,
+    split_cards,
+)
+from tests.conftest import SCRAPED_AT  # noqa: E402
+
+
+def _card(name: str, preview: str, thread_id: str = "", time_label: str = "2h") -> str:
+    link = f'<a href="/direct/t/{thread_id}/">' if thread_id else "<a>"
+    return (
+        f"<div role=\"button\" tabindex=\"0\">{link}"
+        f"<span title=\"{name}\">{name}</span>"
+        f"<span><span>{preview}</span></span>"
+        f"<abbr aria-label=\"{time_label}\">{time_label}</abbr>"
+        "</a></div>"
+    )
+
+
+ALICE = _card("alice", "see you", thread_id="111")
+BOB = _card("bob", "ok", thread_id="222")
+# заметка без времени — не карточка чата
+NOTE = '<div role="button" tabindex="0"><span title="carol">carol</span><span>note</span></div>'
+# недогруженная карточка: имя есть, превью ещё нет
+LOADING = '<div role="button" tabindex="0"><a href="/direct/t/333/"><span title="dave">dave</span><abbr aria-label="1d"></abbr></a></div>'
+
+
+@pytest.fixture(params=sorted(CARD_BACKENDS))
+def parser(request):
+    return ContactCardParser(backend=request.param)
+
+
+def test_parse_cards_fields_and_filtering(parser):
+    contacts = parser.parse_cards([ALICE, NOTE, "", BOB, LOADING], SCRAPED_AT)
+
+    assert [(c.username, c.last_message_preview, c.thread_id) for c in contacts] == [
+        ("alice", "see you", "111"),
+        ("bob", "ok", "222"),
+    ]
+    assert all(c.scraped_at_utc == SCRAPED_AT and c.is_active for c in contacts)
+    assert parser.parsed == 4
+
+
+def test_seen_keys_skip_parsed_cards_but_retry_unparsed(parser):
+    seen: set = set()
+
+    first = parser.parse_cards([ALICE, ALICE, LOADING], SCRAPED_AT, seen_keys=seen)
+    assert [c.username for c in first] == ["alice"]
+    # dave не разобрался — его ключа в seen нет
+    assert seen == {card_key(ALICE)}
+
+    dave = LOADING.replace("<abbr", "<span>hi</span><abbr")
+    second = parser.parse_cards([ALICE, dave, BOB], SCRAPED_AT, seen_keys=seen)
+    assert [(c.username, c.thread_id) for c in second] == [("dave", "333"), ("bob", "222")]
+    assert parser.skipped == 2
+
+
+def test_broken_markup_in_one_card_does_not_lose_the_others(parser):
+    broken = '<div role="button" tabindex="0"><span title="eve">eve</span></div></div><span>'
+
+    contacts = parser.parse_cards([ALICE, broken, BOB], SCRAPED_AT)
+
+    assert [c.username for c in contacts] == ["alice", "bob"]
+
+
+def test_card_key_prefers_thread_link_then_title():
+    assert card_key(ALICE) == "href:/direct/t/111/"
+    assert card_key(NOTE) == "title:carol"
+    assert card_key("<div>x</div>") == "html:<div>x</div>"
+
+
+def test_split_cards_keeps_only_top_level_cards(parser):
+    nested = ALICE.replace("</a></div>", '<div role="button" tabindex="0">menu</div></a></div>')
+    container = f"<div>{nested}<div>{BOB}</div></div>"
+
+    cards = split_cards(container)
+
+    assert len(cards) == 2
+    assert [c.username for c in parser.parse_container(container, SCRAPED_AT)] == ["alice", "bob"]
+
+
+def test_backend_from_env(monkeypatch, capsys):
+    monkeypatch.setenv(HTML_BACKEND_ENV, "html.parser")
+    assert default_backend() == "html.parser"
+
+    monkeypatch.setenv(HTML_BACKEND_ENV, "html5lib-nope")
+    assert default_backend() in CARD_BACKENDS
+    assert "[WARN]" in capsys.readouterr().out
+
+    with pytest.raises(ValueError):
+        ContactCardParser(backend="html5lib-nope")
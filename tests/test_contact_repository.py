@@ -0,0 +1,121 @@
+# tests/test_contact_repository.py
+
+from __future__ import annotations
+
+from dataclasses import replace
+from datetime import timedelta
+
+import pytest
+
+from core.models import ContactSnapshot
+from db.connection import get_connection, transaction
+from db.contact_repository import ContactRepository, UpsertResult
+from db.message_repository import MessageRepository
+from tests.conftest import SCRAPED_AT, make_chat
+
+LATER = SCRAPED_AT + timedelta(hours=1)
+
+
+def _contact(username, preview="hi", thread_id=None, scraped_at=SCRAPED_AT, **fields) -> ContactSnapshot:
+    return ContactSnapshot(
+        username=username,
+        full_name=fields.get("full_name"),
+        profile_url=fields.get("profile_url"),
+        is_active=fields.get("is_active", True),
+        last_message_preview=preview,
+        last_message_at_utc=fields.get("last_message_at_utc"),
+        scraped_at_utc=scraped_at,
+        thread_id=thread_id,
+    )
+
+
+def _scraped_at() -> dict:
+    with get_connection() as conn:
+        rows = conn.execute("SELECT username, scraped_at_utc FROM contacts").fetchall()
+    return {r["username"]: r["scraped_at_utc"] for r in rows}
+
+
+def test_bulk_upsert_counts_and_skips_unchanged_rows(db):
+    repo = ContactRepository()
+    first = repo.bulk_upsert([_contact("alice", thread_id="1"), _contact("bob"), _contact("carol")])
+    assert (first.inserted, first.updated, first.unchanged) == (3, 0, 0)
+
+    second = repo.bulk_upsert(
+        [
+            _contact("alice", thread_id="1", scraped_at=LATER),           # то же самое
+            _contact("bob", preview="new message", scraped_at=LATER),     # новое превью
+            _contact("carol", is_active=False, scraped_at=LATER),         # другой is_active
+            _contact("dave", scraped_at=LATER),                           # новый
+        ]
+    )
+
+    assert (second.inserted, second.updated, second.unchanged) == (1, 2, 1)
+    assert str(second) == "новых 1, обновлено 2, без изменений 1"
+    # неизменённая строка не переписана — scraped_at прежний
+    scraped = _scraped_at()
+    assert scraped["alice"] == SCRAPED_AT.isoformat()
+    assert scraped["bob"] == scraped["carol"] == scraped["dave"] == LATER.isoformat()
+    by_name = {c.username: c for c in repo.list_all()}
+    assert by_name["bob"].last_message_preview == "new message"
+    assert by_name["carol"].is_active is False
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("full_name", "Alice A."),
+        ("profile_url", "https://www.instagram.com/alice/"),
+        ("last_message_at_utc", SCRAPED_AT),
+        ("thread_id", "2"),
+    ],
+)
+def test_every_compared_field_counts_as_change(db, field, value):
+    repo = ContactRepository()
+    repo.bulk_upsert([_contact("alice", thread_id="1")])
+
+    result = repo.bulk_upsert([replace(_contact("alice", thread_id="1"), **{field: value})])
+
+    assert (result.inserted, result.updated, result.unchanged) == (0, 1, 0)
+
+
+def test_missing_thread_id_keeps_known_one(db):
+    repo = ContactRepository()
+    repo.bulk_upsert([_contact("alice", thread_id="1")])
+
+    unchanged = repo.bulk_upsert([_contact("alice")])
+    changed = repo.bulk_upsert([_contact("alice", preview="later")])
+
+    assert unchanged.unchanged == 1 and changed.updated == 1
+    (alice,) = repo.list_all()
+    assert alice.thread_id == "1" and alice.last_message_preview == "later"
+
+
+def test_duplicates_and_empty_usernames(db):
+    repo = ContactRepository()
+
+    result = repo.bulk_upsert([_contact("alice", preview="old"), _contact(None), _contact("alice", preview="new")])
+
+    assert (result.inserted, result.total) == (1, 1)
+    assert [c.last_message_preview for c in repo.list_all()] == ["new"]
+    assert repo.bulk_upsert([]) == UpsertResult()
+
+
+def test_contact_created_by_messages_is_filled_in(db):
+    # чат сохранили раньше списка диалогов — в contacts только username
+    MessageRepository().bulk_insert(make_chat("alice", ["hi"]))
+
+    result = ContactRepository().bulk_upsert([_contact("alice", thread_id="1")])
+
+    assert (result.inserted, result.updated) == (0, 1)
+    (alice,) = ContactRepository().list_all()
+    assert alice.thread_id == "1" and alice.last_message_preview == "hi"
+
+
+def test_upsert_joins_outer_transaction(db):
+    repo = ContactRepository()
+    with pytest.raises(RuntimeError):
+        with transaction():
+            repo.bulk_upsert([_contact("alice")])
+            raise RuntimeError("writer failed")
+
+    assert repo.list_all() == []
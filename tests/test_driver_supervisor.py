@@ -0,0 +1,193 @@
+# tests/test_driver_supervisor.py
+#
+# client.driver_supervisor тянет selenium; без него тесты пропускаются.
+
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException  # noqa: E402
+
+from client.driver_supervisor import DriverSupervisor, SupervisorGaveUp  # noqa: E402
+
+
+class _Process:
+    # pid, которого заведомо нет: psutil не найдёт и не тронет чужие процессы
+    pid = 2 ** 31 - 1
+
+    def __init__(self) -> None:
+        self.killed = threading.Event()
+
+    def poll(self):
+        return 0 if self.killed.is_set() else None
+
+    def kill(self) -> None:
+        self.killed.set()
+
+
+class _Service:
+    def __init__(self) -> None:
+        self.process = _Process()
+
+
+class _Driver:
+    """
+    hang=True — любая команда висит, пока процесс chromedriver не убьют.
+    """
+
+    def __init__(self, hang: bool = False) -> None:
+        self.hang = hang
+        self.service = _Service()
+        self.commands = []
+
+    def execute(self, command, params=None):
+        self.commands.append(command)
+        if self.hang:
+            self.service.process.killed.wait(10)
+            raise WebDriverException("disconnected: not connected to DevTools")
+        return {"value": None}
+
+    @property
+    def current_url(self) -> str:
+        if self.service.process.killed.is_set():
+            raise WebDriverException("chrome not reachable")
+        return "https://www.instagram.com/direct/inbox/"
+
+
+class _Client:
+    def __init__(self, driver: _Driver) -> None:
+        self.driver = driver
+        self.opened = 0
+        self.closed = False
+
+    def _open_direct(self) -> None:
+        self.opened += 1
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class _Drivers:
+    """
+    Фабрика драйверов по списку; None в списке — браузер не поднялся.
+    """
+
+    def __init__(self, *drivers) -> None:
+        self._drivers = list(drivers)
+        self.created = []
+
+    def __call__(self):
+        driver = self._drivers.pop(0)
+        if driver is None:
+            raise WebDriverException("session not created")
+        self.created.append(driver)
+        return driver
+
+
+def _supervisor(drivers: _Drivers, **kwargs) -> DriverSupervisor:
+    return DriverSupervisor(client_factory=_Client, driver_factory=drivers, name="test", **kwargs)
+
+
+def test_lost_session_restarts_browser_and_retries_contact():
+    drivers = _Drivers(_Driver(), _Driver())
+    supervisor = _supervisor(drivers)
+    calls = []
+
+    def fetch(client):
+        calls.append(client)
+        if len(calls) == 1:
+            raise InvalidSessionIdException("invalid session id")
+        return ["m1"]
+
+    try:
+        supervisor.start()
+        assert supervisor.run("alice", fetch) == ["m1"]
+    finally:
+        supervisor.close()
+
+    first, second = drivers.created
+    assert calls[0].driver is first and calls[1].driver is second
+    assert calls[0].closed and calls[1].opened == 1
+    assert first.service.process.killed.is_set()
+    stats = supervisor.stats
+    assert (stats.restarts, stats.crashes, stats.hangs, stats.retries) == (1, 1, 0, 1)
+
+
+def test_error_with_live_session_is_raised_without_restart():
+    drivers = _Drivers(_Driver())
+    supervisor = _supervisor(drivers)
+
+    def fetch(client):
+        raise RuntimeError("chat did not open")
+
+    try:
+        supervisor.start()
+        with pytest.raises(RuntimeError, match="chat did not open"):
+            supervisor.run("alice", fetch)
+        # браузер жив — клиент тот же, перезапуска не было
+        assert supervisor.client is not None
+    finally:
+        supervisor.close()
+
+    assert len(drivers.created) == 1
+    assert supervisor.stats.restarts == 0
+
+
+def test_watchdog_kills_hung_command_and_restarts():
+    drivers = _Drivers(_Driver(hang=True), _Driver())
+    supervisor = _supervisor(drivers, command_timeout=0.2)
+
+    try:
+        supervisor.start()
+        result = supervisor.run("alice", lambda client: client.driver.execute("getPageSource"))
+    finally:
+        supervisor.close()
+
+    hung, fresh = drivers.created
+    assert result == {"value": None}
+    assert hung.service.process.killed.is_set()
+    assert fresh.commands == ["getPageSource"]
+    stats = supervisor.stats
+    assert (stats.restarts, stats.hangs, stats.crashes) == (1, 1, 0)
+    assert stats.lost_seconds >= 0.2
+
+
+def test_session_lost_on_every_attempt_is_raised_after_max_attempts():
+    drivers = _Drivers(_Driver(), _Driver(), _Driver())
+    supervisor = _supervisor(drivers, max_attempts=2)
+
+    def fetch(client):
+        raise InvalidSessionIdException("invalid session id")
+
+    try:
+        supervisor.start()
+        with pytest.raises(InvalidSessionIdException):
+            supervisor.run("alice", fetch)
+    finally:
+        supervisor.close()
+
+    # браузер после последней попытки уже пересоздан для следующего контакта
+    assert len(drivers.created) == 3
+    assert (supervisor.stats.restarts, supervisor.stats.retries) == (2, 1)
+
+
+def test_gives_up_when_browser_does_not_come_back():
+    drivers = _Drivers(_Driver(), None, None)
+    supervisor = _supervisor(drivers, max_restarts=2)
+
+    def fetch(client):
+        raise InvalidSessionIdException("invalid session id")
+
+    try:
+        supervisor.start()
+        with pytest.raises(SupervisorGaveUp):
+            supervisor.run("alice", fetch)
+    finally:
+        supervisor.close()
+
+    assert supervisor.stats.restarts == 2
+    assert "перезапусков 2" in supervisor.report()
@@ -0,0 +1,81 @@
+# tests/test_lean_profile.py
+#
+# Нужны selenium и Chrome; без них тесты пропускаются.
+
+from __future__ import annotations
+
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from client.driver_factory import block_lean_resources, create_driver  # noqa: E402
+from client.selenium_direct import SELF_SENDER_PREFIXES, _JS_EXTRACT_BUBBLES  # noqa: E402
+
+LAYOUT = os.path.join(os.path.dirname(__file__), "fixtures", "layout")
+SENDERS = ["peer", "self", "peer", "self", "peer"]
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, fmt, *args) -> None:
+        pass
+
+
+@pytest.fixture(scope="module")
+def layout_server():
+    handler = functools.partial(_QuietHandler, directory=LAYOUT)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _driver(lean: bool):
+    try:
+        return create_driver(headless=True, lean=lean)
+    except Exception as e:  # нет Chrome / chromedriver
+        pytest.skip(f"Chrome недоступен: {e!r}")
+
+
+def _senders(driver, base_url: str) -> list:
+    driver.get(f"{base_url}/chat.html")
+    container = driver.find_element("id", "history")
+    items = driver.execute_script(_JS_EXTRACT_BUBBLES, container, [], list(SELF_SENDER_PREFIXES))
+    return [item["sender"] for item in items]
+
+
+def _fetch_blocked(driver, url: str) -> bool:
+    return driver.execute_async_script(
+        "const done = arguments[arguments.length - 1];"
+        "fetch(arguments[0]).then(() => done(false), () => done(true));",
+        url,
+    )
+
+
+@pytest.mark.parametrize("lean", [False, True])
+def test_senders_do_not_depend_on_lean_profile(layout_server, lean):
+    driver = _driver(lean)
+    try:
+        assert _senders(driver, layout_server) == SENDERS
+    finally:
+        driver.quit()
+
+
+def test_lean_blocking_applies_to_new_tabs(layout_server):
+    driver = _driver(lean=True)
+    try:
+        driver.get(f"{layout_server}/chat.html")
+        assert _fetch_blocked(driver, f"{layout_server}/font.woff2?v=1")
+
+        driver.switch_to.new_window("tab")
+        block_lean_resources(driver)
+        driver.get(f"{layout_server}/chat.html")
+        assert _fetch_blocked(driver, f"{layout_server}/font.woff2?v=1")
+        assert not _fetch_blocked(driver, f"{layout_server}/chat.html")
+    finally:
+        driver.quit()
@@ -0,0 +1,112 @@
+# tests/test_locator.py
+#
+# services.locator тянет selenium; без него тесты пропускаются.
+
+from __future__ import annotations
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from selenium.common.exceptions import StaleElementReferenceException  # noqa: E402
+
+from services.locator import _JS_IS_CONNECTED, _JS_RESOLVE_CONTAINER, LocatorService, LocatorTarget  # noqa: E402
+
+
+class _Element:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.connected = True
+
+
+class _ScriptedDriver:
+    """
+    Страница из одного контейнера на селектор; rerender() — Instagram перерисовал DOM.
+    """
+
+    def __init__(self, containers: dict) -> None:
+        self._containers = {selector: _Element(name) for selector, name in containers.items()}
+        self.resolves = []
+
+    def rerender(self, selector: str) -> None:
+        old = self._containers[selector]
+        old.connected = False
+        self._containers[selector] = _Element(old.name + "'")
+
+    def execute_script(self, script, *args):
+        if script == _JS_IS_CONNECTED:
+            return args[0].connected
+        assert script == _JS_RESOLVE_CONTAINER
+        seed, selector, thumb_fallback = args
+        self.resolves.append((seed, selector, thumb_fallback))
+        if seed is not None and not seed.connected:
+            raise StaleElementReferenceException("stale seed")
+        return self._containers.get(selector)
+
+
+def _locator(driver: _ScriptedDriver) -> LocatorService:
+    return LocatorService(
+        driver,
+        {
+            "inbox": LocatorTarget("div.card", thumb_fallback=True),
+            "chat": LocatorTarget("div.bubble"),
+        },
+    )
+
+
+def test_cached_container_is_reused_until_dom_rerenders():
+    driver = _ScriptedDriver({"div.card": "inbox", "div.bubble": "chat"})
+    locator = _locator(driver)
+
+    first = locator.get("inbox")
+    assert locator.get("inbox") is first
+    assert first.name == "inbox"
+    assert driver.resolves == [(None, "div.card", True)]
+
+    driver.rerender("div.card")
+    fresh = locator.get("inbox")
+    assert fresh.name == "inbox'"
+    assert locator.peek("inbox") is fresh
+
+    assert (locator.stats["inbox"].hits, locator.stats["inbox"].misses, locator.stats["inbox"].stale) == (1, 1, 1)
+    assert locator.stats["chat"].misses == 0
+
+
+def test_refresh_and_invalidate_search_again():
+    driver = _ScriptedDriver({"div.card": "inbox", "div.bubble": "chat"})
+    locator = _locator(driver)
+    locator.get("inbox")
+    locator.get("chat")
+
+    locator.get("chat", refresh=True)
+    locator.invalidate("inbox")
+    assert locator.peek("inbox") is None and locator.peek("chat") is not None
+    locator.get("inbox")
+    locator.invalidate()
+    assert locator.peek("chat") is None
+
+    assert len(driver.resolves) == 4
+    assert locator.stats["chat"].stale == 1
+    assert locator.stats["inbox"].misses == 2
+
+
+def test_missing_container_is_not_cached():
+    driver = _ScriptedDriver({"div.card": "inbox"})
+    locator = _locator(driver)
+
+    assert locator.get("chat") is None
+    assert locator.get("chat") is None
+    assert locator.stats["chat"].not_found == 2
+    assert "не найден 2" in locator.report()
+
+
+def test_stale_seed_falls_back_to_selector():
+    driver = _ScriptedDriver({"div.bubble": "chat"})
+    locator = _locator(driver)
+    seed = _Element("bubble")
+    seed.connected = False
+
+    assert locator.get("chat", seed=seed).name == "chat"
+    assert driver.resolves == [(seed, "div.bubble", False), (None, "div.bubble", False)]
+    # без селектора подниматься не от чего
+    assert locator.scrollable_ancestor(seed) is None
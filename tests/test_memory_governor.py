@@ -0,0 +1,66 @@
+# tests/test_memory_governor.py
+
+from __future__ import annotations
+
+import copy
+import random
+from types import SimpleNamespace
+
+from client.chat_stitcher import ChatStreamStitcher, iter_chronological
+from client.memory_governor import MemoryGovernor
+from tests.conftest import make_chat, split_rounds
+
+
+def _state(streaming: bool) -> SimpleNamespace:
+    # поля _ChatCollectState, которые читает MemoryGovernor.on_round
+    return SimpleNamespace(
+        batches=[],
+        spool=None,
+        streaming=streaming,
+        rounds=1,
+        chat_container=None,
+        extraction_mode="observer",
+    )
+
+
+def _rounds():
+    # длинная серия одинаковых сообщений: стичер держит её целиком до конца сбора
+    chat = make_chat("bob", ["ok"] * 60 + ["bye"], ["me"] * 61)
+    return split_rounds(chat, random.Random(4))
+
+
+def test_governor_does_not_spill_rounds_owned_by_stream_stitcher():
+    rounds = _rounds()
+    expected = [m.msg_hash for m in iter_chronological(copy.deepcopy(rounds), set())]
+    governor = MemoryGovernor(driver=None, max_buffered=5, sample_every=1000)
+    state = _state(streaming=True)
+    stitcher = ChatStreamStitcher("bob")
+
+    released = []
+    for round_ in rounds:
+        state.batches.append(round_)
+        governor.on_round(state)
+        batch = stitcher.release(state.batches, set())
+        if batch is not None:
+            released = batch.messages + released
+    released = stitcher.release(state.batches, set(), final=True).messages + released
+
+    assert state.spool is None
+    assert governor.stats.peak_buffered > 5
+    assert [m.msg_hash for m in released] == expected
+
+
+def test_governor_spills_buffered_rounds_outside_streaming():
+    rounds = _rounds()
+    expected = [m.msg_hash for m in iter_chronological(copy.deepcopy(rounds), set())]
+    governor = MemoryGovernor(driver=None, max_buffered=5, sample_every=1000)
+    state = _state(streaming=False)
+
+    for round_ in rounds:
+        state.batches.append(round_)
+        governor.on_round(state)
+
+    assert state.spool is not None
+    assert governor.stats.spilled_messages == state.spool.count > 0
+    got = iter_chronological(state.batches, set(), state.spool)
+    assert [m.msg_hash for m in got] == expected
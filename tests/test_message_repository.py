@@ -0,0 +1,124 @@
+# tests/test_message_repository.py
+
+from __future__ import annotations
+
+import random
+
+from client.chat_stitcher import iter_chronological
+from core.models import MessageBatch
+from db.connection import get_connection
+from db.message_repository import SEQ_GAP, MessageRepository
+from tests.conftest import make_chat, split_rounds, stream_batches
+
+
+def _write(repo: MessageRepository, batches) -> int:
+    inserted = 0
+    anchor = None
+    for batch in batches:
+        count, anchor = repo.insert_batch(batch, None if batch.first else anchor)
+        inserted += count
+    return inserted
+
+
+def _max_seq() -> int:
+    with get_connection() as conn:
+        return conn.execute("SELECT MAX(seq) FROM messages").fetchone()[0]
+
+
+def _texts(repo: MessageRepository, contact: str = "bob"):
+    return [m.text for m in repo.list_for_contact(contact)]
+
+
+def test_stream_batches_are_stored_in_chat_order(db):
+    repo = MessageRepository()
+    texts = [f"m{i}" for i in range(50)]
+
+    assert _write(repo, stream_batches(make_chat("bob", texts), random.Random(1))) == 50
+    assert _texts(repo) == texts
+
+
+def test_recollect_aligns_anchor_with_stored_messages(db):
+    repo = MessageRepository()
+    texts = [f"m{i}" for i in range(40)]
+    first = stream_batches(make_chat("bob", texts), random.Random(2))
+    # сбор упал после половины пачек (пачки идут от новых к старым)
+    _write(repo, first[: len(first) // 2])
+    stored = len(_texts(repo))
+
+    # повторный сбор: пришли ещё 5 сообщений, история собрана целиком
+    texts += [f"new{i}" for i in range(5)]
+    inserted = _write(repo, stream_batches(make_chat("bob", texts), random.Random(3)))
+
+    assert _texts(repo) == texts
+    assert inserted == len(texts) - stored
+
+
+def test_partial_then_deeper_collect_has_no_boundary_duplicates(db):
+    repo = MessageRepository()
+    texts = [t for i in range(10) for t in ("ok", "ok", f"m{i}")]
+
+    # сначала неглубокий сбор: видны только последние 12 сообщений
+    tail = make_chat("bob", texts)[-12:]
+    _write(repo, stream_batches(tail, random.Random(6), reached_start=False))
+    # потом полный
+    _write(repo, stream_batches(make_chat("bob", texts), random.Random(7)))
+
+    assert _texts(repo) == texts
+
+
+def test_bulk_insert_deeper_collect_goes_before_stored_tail(db):
+    repo = MessageRepository()
+    texts = [f"m{i}" for i in range(20)]
+    rnd = random.Random(8)
+
+    # неглубокий сбор (вкладки, пул, разбор шардов): последние 8 сообщений
+    tail = make_chat("bob", texts)[-8:]
+    repo.bulk_insert(iter_chronological(split_rounds(tail, rnd), set(), reached_start=False))
+    stored = len(_texts(repo))
+    assert stored and _texts(repo) == texts[-stored:]
+
+    # потом полный — старые сообщения встают перед уже сохранёнными
+    full = iter_chronological(split_rounds(make_chat("bob", texts), rnd), set())
+    assert repo.bulk_insert(full) == len(texts) - stored
+
+    assert _texts(repo) == texts
+    assert repo.get_last_for_contact("bob")["text"] == "m19"
+    assert repo.load_watermarks()["bob"] == ["m17", "m18", "m19"]
+
+
+def test_single_stray_vote_does_not_move_anchor(db):
+    repo = MessageRepository()
+    texts = [f"m{i}" for i in range(20)]
+    _write(repo, stream_batches(make_chat("bob", texts), random.Random(4)))
+    stored = {m.text: m.msg_hash for m in repo.list_for_contact("bob")}
+
+    # новый сбор другой истории: одно сообщение случайно совпало отпечатком
+    # с "m3", остальные — новые
+    fresh = make_chat("bob", ["x0", "x1", "x2", "x3"])
+    for i, m in enumerate(fresh):
+        m.msg_hash = f"fresh:{i}"
+    newest = MessageBatch("bob", fresh[2:], ranks=[1, 0], first=True)
+    inserted, anchor = repo.insert_batch(newest)
+    assert inserted == 2
+
+    fresh[0].msg_hash = stored["m3"]
+    older = MessageBatch("bob", fresh[:2], ranks=[3, 2])
+    inserted, next_anchor = repo.insert_batch(older, anchor)
+
+    assert next_anchor == anchor
+    assert inserted == 1
+    assert _texts(repo)[-3:] == ["x1", "x2", "x3"]
+    assert _texts(repo)[:20] == texts
+
+
+def test_new_history_starts_above_stored(db):
+    repo = MessageRepository()
+    _write(repo, stream_batches(make_chat("bob", ["a", "b", "c"]), random.Random(5)))
+    max_before = _max_seq()
+
+    batch = make_chat("bob", ["d"])
+    batch[0].msg_hash = "d:0"
+    _, anchor = repo.insert_batch(MessageBatch("bob", batch, ranks=[0], first=True))
+
+    assert anchor == max_before + SEQ_GAP
+    assert _texts(repo) == ["a", "b", "c", "d"]
@@ -0,0 +1,69 @@
+# tests/test_message_writer.py
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from db.message_repository import MessageRepository
+from db.message_writer import BackgroundMessageWriter
+from tests.conftest import make_chat, stream_batches
+
+
+class _FailingRepository(MessageRepository):
+    """
+    Репозиторий, у которого не записываются пачки одного контакта.
+    """
+
+    def __init__(self, broken: str) -> None:
+        super().__init__()
+        self._broken = broken
+
+    def insert_batch(self, batch, anchor=None):
+        if batch.contact_username == self._broken:
+            raise RuntimeError("disk I/O error")
+        return super().insert_batch(batch, anchor)
+
+
+def test_writer_saves_contacts_in_order_and_counts_per_contact(db):
+    repo = MessageRepository()
+    writer = BackgroundMessageWriter(repo, max_pending=2).start()
+    chats = {
+        "alice": [f"a{i}" for i in range(30)],
+        "bob": [f"b{i}" for i in range(45)],
+    }
+    try:
+        for contact, texts in chats.items():
+            for batch in stream_batches(make_chat(contact, texts), random.Random(len(texts))):
+                writer.submit(batch)
+            assert writer.drain(contact) == len(texts)
+        # повторный сбор того же — ничего нового
+        for batch in stream_batches(make_chat("bob", chats["bob"]), random.Random(9)):
+            writer.submit(batch)
+        assert writer.drain("bob") == 0
+    finally:
+        writer.close()
+
+    for contact, texts in chats.items():
+        assert [m.text for m in repo.list_for_contact(contact)] == texts
+    assert writer.inserted == 75
+    assert writer.errors == 0
+
+
+def test_writer_reports_failed_batches_and_keeps_running(db):
+    writer = BackgroundMessageWriter(_FailingRepository("bob")).start()
+    try:
+        for batch in stream_batches(make_chat("bob", ["x", "y", "z"]), random.Random(1)):
+            writer.submit(batch)
+        with pytest.raises(RuntimeError):
+            writer.drain("bob")
+
+        for batch in stream_batches(make_chat("alice", ["p", "q"]), random.Random(1)):
+            writer.submit(batch)
+        assert writer.drain("alice") == 2
+    finally:
+        writer.close()
+
+    assert writer.errors >= 1
+    assert [m.text for m in MessageRepository().list_for_contact("bob")] == []
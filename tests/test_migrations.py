@@ -0,0 +1,118 @@
+# tests/test_migrations.py
+
+from __future__ import annotations
+
+import random
+from typing import List
+
+import init_db
+from db.connection import get_connection
+from db.message_repository import LEGACY_HASH_PREFIX, MessageRepository
+from tests.conftest import make_chat, stream_batches
+
+# Схема первой версии (до thread_id, msg_hash, seq и компактной раскладки)
+_BASELINE_SCHEMA = (
+    """
+    CREATE TABLE contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        display_name TEXT,
+        profile_url TEXT,
+        is_active INTEGER DEFAULT 1,
+        last_message_preview TEXT,
+        last_message_at_utc TEXT,
+        scraped_at_utc TEXT
+    )
+    """,
+    """
+    CREATE TABLE messages (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        contact_username TEXT NOT NULL,
+        sender           TEXT NOT NULL,
+        text             TEXT NOT NULL,
+        timestamp_utc    TEXT NULL,
+        scraped_at_utc   TEXT NOT NULL
+    )
+    """,
+)
+
+CHAT = ["hi", "hello", "how are you?", "fine", "and you?", "good", "see you", "bye", "👍"]
+
+
+def _baseline_scrape(contact: str, texts: List[str], run: int) -> None:
+    """
+    Пишет один прогон первой версии сборщика: одно scraped_at_utc на все строки.
+    """
+    scraped_at = f"2024-01-0{run}T10:00:00+00:00"
+    with get_connection() as conn:
+        conn.executemany(
+            """
+            INSERT INTO messages (contact_username, sender, text, timestamp_utc, scraped_at_utc)
+            VALUES (?, ?, ?, NULL, ?)
+            """,
+            [(contact, "contact" if CHAT.index(t) % 2 else "me", t, scraped_at) for t in texts],
+        )
+        conn.commit()
+
+
+def _baseline_db() -> None:
+    with get_connection() as conn:
+        for sql in _BASELINE_SCHEMA:
+            conn.execute(sql)
+        conn.commit()
+
+
+def _texts(contact: str = "bob") -> List[str]:
+    return [m.text for m in MessageRepository().list_for_contact(contact)]
+
+
+def test_repeated_scrapes_collapse_to_one_history(db_path):
+    _baseline_db()
+    for run in (1, 2, 3):
+        _baseline_scrape("bob", CHAT[:4], run)
+
+    init_db.main()
+
+    assert _texts() == CHAT[:4]
+    assert MessageRepository().load_watermarks()["bob"] == CHAT[1:4]
+    assert MessageRepository().get_last_for_contact("bob")["text"] == "fine"
+
+
+def test_overlapping_scrapes_merge_in_chat_order(db_path):
+    _baseline_db()
+    _baseline_scrape("bob", CHAT[:6], 1)
+    # пришли новые сообщения, а верх экрана сдвинулся: у первых строк неполный контекст
+    _baseline_scrape("bob", CHAT[2:9], 2)
+    _baseline_scrape("alice", CHAT[:3], 2)
+    # сбор глубже — снова с начала чата
+    _baseline_scrape("bob", CHAT, 3)
+
+    init_db.main()
+
+    assert _texts() == CHAT
+    assert _texts("alice") == CHAT[:3]
+    with get_connection() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        keys = conn.execute("SELECT COUNT(*) FROM (SELECT DISTINCT contact_id, msg_hash FROM messages)").fetchone()[0]
+    assert rows == keys == len(CHAT) + 3
+
+
+def test_legacy_rows_are_replaced_by_full_rescan(db_path):
+    _baseline_db()
+    # чат длиннее экрана: первая версия писала экраны от нового к старому
+    _baseline_scrape("bob", CHAT[5:] + CHAT[:5], 1)
+
+    init_db.main()
+    repo = MessageRepository()
+    assert repo.legacy_contacts() == {"bob"}
+    assert all(m.msg_hash.startswith(LEGACY_HASH_PREFIX) for m in repo.list_for_contact("bob"))
+
+    # полный пересбор дошёл до начала чата: отпечатки новые, со старыми не совпадают
+    anchor = None
+    for batch in stream_batches(make_chat("bob", CHAT), random.Random(1)):
+        _, anchor = repo.insert_batch(batch, None if batch.first else anchor)
+    assert repo.drop_legacy("bob") == len(CHAT)
+
+    assert _texts() == CHAT
+    assert repo.legacy_contacts() == set()
+    assert repo.load_watermarks()["bob"] == CHAT[-3:]
@@ -0,0 +1,163 @@
+# tests/test_network_capture.py
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+import pytest
+
+from client.network_capture import NetworkCapture, decode_thread_payload
+from client.stub_direct_server import serve
+from tests.conftest import SCRAPED_AT
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "direct")
+THREAD_ID = "340282366841710301"
+# весь записанный чат от старых к новым (media_share без текста пропускается)
+CHAT = ["hi", "hello", "how are you?", "fine", "https://example.com/menu", "see you"]
+
+
+def _page(index: int) -> dict:
+    with open(os.path.join(FIXTURES, THREAD_ID, f"page_{index:03d}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _PerformanceLogDriver:
+    """
+    Драйвер с performance-логом: ответы Direct как их видит CDP.
+    """
+
+    def __init__(self, responses) -> None:
+        self._log = []
+        self._bodies = {}
+        for i, (url, body) in enumerate(responses):
+            request_id = f"req-{i}"
+            self._log.append({"method": "Network.responseReceived", "params": {"requestId": request_id, "response": {"url": url}}})
+            self._log.append({"method": "Network.loadingFinished", "params": {"requestId": request_id}})
+            self._bodies[request_id] = body
+        self.cdp = []
+
+    def get_log(self, kind):
+        assert kind == "performance"
+        entries = [{"message": json.dumps({"message": m})} for m in self._log]
+        self._log = []
+        return entries
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp.append(cmd)
+        if cmd == "Network.getResponseBody":
+            return self._bodies[params["requestId"]]
+        return {}
+
+
+def test_decode_recorded_page_is_oldest_first_with_senders():
+    (page,) = decode_thread_payload(_page(0), "bob", SCRAPED_AT)
+
+    assert page.thread_id == THREAD_ID
+    assert page.has_older is True
+    assert [m.text for _, m in page.messages] == CHAT[3:]
+    assert [m.sender for _, m in page.messages] == ["peer", "self", "peer"]
+    assert [m.sender_id for _, m in page.messages] == ["4242", "1001", "4242"]
+    assert page.messages[0][0] == "31000000000000000000000000000003"
+    assert page.messages[-1][1].timestamp_utc.isoformat() == "2024-05-01T12:01:00+00:00"
+
+
+def test_decode_nested_payload_with_viewer_object():
+    payload = {
+        "data": {
+            "viewer": {"pk": 1001},
+            "thread_by_id": {"thread_id": THREAD_ID, "items": _page(1)["thread"]["items"]},
+        }
+    }
+
+    (page,) = decode_thread_payload(payload, "bob", SCRAPED_AT)
+
+    assert [m.text for _, m in page.messages] == CHAT[:3]
+    assert [m.sender for _, m in page.messages] == ["self", "peer", "self"]
+    assert page.has_older is None
+
+
+def test_network_capture_drains_thread_pages_and_records_them(tmp_path):
+    foreign = _page(1)
+    foreign["thread"]["thread_id"] = "other"
+    driver = _PerformanceLogDriver(
+        [
+            (f"https://www.instagram.com/api/v1/direct_v2/threads/{THREAD_ID}/", {"body": json.dumps(_page(0))}),
+            ("https://www.instagram.com/static/app.js", {"body": "{}"}),
+            ("https://www.instagram.com/api/graphql", {"body": "for (;;);" + json.dumps(_page(1))}),
+            ("https://www.instagram.com/api/graphql", {"body": json.dumps(foreign)}),
+            ("https://www.instagram.com/api/graphql", {"body": "e30=", "base64Encoded": True}),
+        ]
+    )
+    capture = NetworkCapture(driver, record_dir=str(tmp_path))
+
+    pages = capture.drain_thread_pages("bob", SCRAPED_AT, thread_id=THREAD_ID)
+
+    assert [m.text for page in reversed(pages) for _, m in page.messages] == CHAT
+    assert driver.cdp.count("Network.getResponseBody") == 4
+    assert sorted(os.listdir(tmp_path / THREAD_ID)) == ["page_000.json", "page_001.json"]
+    # второй вызов — в логе пусто
+    assert capture.drain_thread_pages("bob", SCRAPED_AT, thread_id=THREAD_ID) == []
+
+
+@contextmanager
+def _stub_server(payload_dir: str):
+    server = serve(payload_dir, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    with _stub_server(FIXTURES) as base:
+        yield base
+
+
+def _get(url: str):
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        return resp.status, resp.read().decode("utf-8")
+
+
+def test_stub_server_replays_recorded_history(stub_server):
+    status, page = _get(f"{stub_server}/direct/t/{THREAD_ID}/")
+    assert status == 200
+    assert 'title="bob"' in page and THREAD_ID in page
+
+    texts = []
+    cursor = 0
+    while True:
+        _, body = _get(f"{stub_server}/api/v1/direct_v2/threads/{THREAD_ID}/?cursor={cursor}")
+        (thread_page,) = decode_thread_payload(json.loads(body), "bob", SCRAPED_AT)
+        texts = [m.text for _, m in thread_page.messages] + texts
+        cursor += 1
+        if thread_page.has_older is False:
+            break
+
+    assert texts == CHAT
+    for url in (
+        f"{stub_server}/api/v1/direct_v2/threads/{THREAD_ID}/?cursor={cursor}",
+        f"{stub_server}/direct/t/unknown/",
+    ):
+        with pytest.raises(urllib.error.HTTPError) as err:
+            _get(url)
+        assert err.value.code == 404
+
+
+def test_stub_server_serves_what_network_capture_recorded(tmp_path):
+    driver = _PerformanceLogDriver(
+        [(f"https://www.instagram.com/api/v1/direct_v2/threads/{THREAD_ID}/", {"body": json.dumps(_page(i))}) for i in (0, 1)]
+    )
+    NetworkCapture(driver, record_dir=str(tmp_path)).drain_thread_pages("bob", SCRAPED_AT)
+
+    with _stub_server(str(tmp_path)) as base:
+        for i in (0, 1):
+            _, body = _get(f"{base}/api/v1/direct_v2/threads/{THREAD_ID}/?cursor={i}")
+            assert json.loads(body) == _page(i)
@@ -0,0 +1,136 @@
+# tests/test_selector_registry.py
+#
+# services.selector_registry тянет selenium; без него тесты пропускаются.
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from selenium.common.exceptions import StaleElementReferenceException  # noqa: E402
+from selenium.webdriver.common.by import By  # noqa: E402
+
+from services.selector_registry import SELECTOR_STATS_ENV, SelectorRegistry, SelectorStrategy, get_stats_path  # noqa: E402
+
+STRATEGIES = {
+    "bubble": [
+        SelectorStrategy("old", By.CSS_SELECTOR, "div.old-bubble"),
+        SelectorStrategy("new", By.CSS_SELECTOR, "div.new-bubble"),
+        SelectorStrategy("xpath", By.XPATH, "//div[@dir='auto']"),
+    ]
+}
+
+
+class _Page:
+    """
+    find_elements по значению селектора: сколько элементов сейчас на странице.
+    """
+
+    def __init__(self, counts: dict, stale: bool = False) -> None:
+        self.counts = counts
+        self.stale = stale
+        self.queries = []
+
+    def find_elements(self, by, value):
+        self.queries.append(value)
+        if self.stale:
+            raise StaleElementReferenceException("container re-rendered")
+        return ["el"] * self.counts.get(value, 0)
+
+
+def _registry(page: _Page, tmp_path, autosave_every: int = 0) -> SelectorRegistry:
+    return SelectorRegistry(page, STRATEGIES, stats_path=str(tmp_path / "stats.json"), autosave_every=autosave_every)
+
+
+def test_best_hit_rate_strategy_is_tried_first(tmp_path):
+    page = _Page({"div.new-bubble": 3, "//div[@dir='auto']": 5})
+    registry = _registry(page, tmp_path)
+
+    # при равенстве — порядок объявления
+    assert [s.name for s in registry.ordered("bubble")] == ["old", "new", "xpath"]
+    assert registry.find("bubble") == ("new", ["el"] * 3)
+    assert page.queries == ["div.old-bubble", "div.new-bubble"]
+
+    page.queries.clear()
+    assert registry.find("bubble")[0] == "new"
+    assert page.queries == ["div.new-bubble"]
+    assert [s.name for s in registry.ordered("bubble")] == ["new", "xpath", "old"]
+    # JS-экстракторам — только CSS, в том же порядке
+    assert registry.css("bubble") == ["div.new-bubble", "div.old-bubble"]
+    assert registry.report() == "bubble: new 2/2, xpath 0/0, old 0/1"
+
+
+def test_unrecorded_find_does_not_change_order(tmp_path):
+    page = _Page({"div.new-bubble": 1})
+    registry = _registry(page, tmp_path)
+
+    registry.find("bubble", record=False)
+    registry.find("bubble", record=False)
+
+    assert all(st.attempts == 0 for st in registry.stats["bubble"].values())
+    assert [s.name for s in registry.ordered("bubble")] == ["old", "new", "xpath"]
+
+
+def test_stale_container_falls_back_to_document(tmp_path):
+    driver = _Page({"div.old-bubble": 2})
+    registry = _registry(driver, tmp_path)
+    container = _Page({}, stale=True)
+
+    assert registry.find("bubble", root=container) == ("old", ["el", "el"])
+    assert container.queries == ["div.old-bubble"]
+    assert driver.queries == ["div.old-bubble"]
+
+
+def test_stats_from_several_clients_add_up_and_order_next_run(tmp_path):
+    first = _registry(_Page({"div.new-bubble": 1}), tmp_path)
+    second = _registry(_Page({"div.new-bubble": 2}), tmp_path)
+    for registry in (first, second):
+        registry.find("bubble")
+        registry.find("bubble")
+    first.save()
+    second.save()
+    # повторное сохранение без новых попыток ничего не удваивает
+    second.save()
+
+    with open(tmp_path / "stats.json", encoding="utf-8") as f:
+        saved = json.load(f)["bubble"]
+    assert (saved["new"]["attempts"], saved["new"]["hits"], saved["new"]["found"]) == (4, 4, 6)
+    assert (saved["old"]["attempts"], saved["old"]["hits"]) == (2, 0)
+
+    # следующий запуск сразу начинает с лучшей стратегии
+    page = _Page({"div.new-bubble": 1})
+    assert _registry(page, tmp_path).find("bubble")[0] == "new"
+    assert page.queries == ["div.new-bubble"]
+
+
+def test_autosave_every_n_finds(tmp_path):
+    registry = _registry(_Page({"div.old-bubble": 1}), tmp_path, autosave_every=3)
+
+    registry.find("bubble")
+    registry.find("bubble")
+    assert not (tmp_path / "stats.json").exists()
+    registry.find("bubble")
+    assert (tmp_path / "stats.json").exists()
+
+
+def test_warns_once_when_best_strategy_stops_matching(tmp_path, capsys):
+    strategies = {"card": [SelectorStrategy("card", By.CSS_SELECTOR, "div.card")]}
+    page = _Page({"div.card": 1})
+    registry = SelectorRegistry(page, strategies, stats_path=str(tmp_path / "stats.json"), autosave_every=0)
+    for _ in range(100):
+        registry.find("card")
+    assert "[WARN]" not in capsys.readouterr().out
+
+    page.counts.clear()
+    for _ in range(20):
+        registry.find("card")
+
+    assert capsys.readouterr().out.count("[WARN] Селектор card/card") == 1
+
+
+def test_stats_path_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv(SELECTOR_STATS_ENV, str(tmp_path / "custom.json"))
+    assert get_stats_path() == str(tmp_path / "custom.json")
@@ -0,0 +1,146 @@
+# tests/test_sync_pool.py
+#
+# client.sync_pool тянет selenium (через driver_factory); без него тесты пропускаются.
+
+from __future__ import annotations
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from client.sync_pool import ResultWriter, SyncWorkerPool, WorkStealingQueue, _WriteJob  # noqa: E402
+from core.models import ContactSnapshot  # noqa: E402
+from db.connection import get_connection  # noqa: E402
+from db.contact_repository import ContactRepository  # noqa: E402
+from db.message_repository import MessageRepository  # noqa: E402
+from db.sync_run_repository import DONE, FAILED, PENDING, SyncRunRepository  # noqa: E402
+from tests.conftest import SCRAPED_AT, make_chat  # noqa: E402
+
+
+def _contacts(*usernames: str) -> list:
+    return [ContactSnapshot(u, None, None, True, None, None, SCRAPED_AT) for u in usernames]
+
+
+def _names(items) -> list:
+    return [c.username for c in items]
+
+
+def _run_states(run_id: int) -> dict:
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT contact_username, status, attempts, error FROM sync_run_contacts WHERE run_id = ?",
+            (run_id,),
+        ).fetchall()
+    return {r["contact_username"]: (r["status"], r["attempts"], r["error"]) for r in rows}
+
+
+class _BrokenMessages(MessageRepository):
+    def bulk_insert(self, messages):
+        raise RuntimeError("disk I/O error")
+
+
+def test_queue_deals_round_robin_and_steals_from_longest_tail():
+    work = WorkStealingQueue(_contacts("a", "b", "c", "d", "e"), workers=2)
+
+    # своя очередь — с начала
+    assert work.get(1).username == "b"
+    assert work.get(1).username == "d"
+    # своя пуста — крадём с конца самой длинной (a, c, e)
+    assert work.get(1).username == "e"
+    assert work.stolen == 1
+    assert _names(work.remaining()) == ["a", "c"]
+
+    # вернувшийся контакт воркер возьмёт первым
+    contact = work.get(0)
+    work.put_back(0, contact)
+    assert work.get(0).username == "a"
+    assert work.get(0).username == "c"
+    assert work.get(0) is None and work.get(1) is None
+
+
+def test_queue_counts_failures_per_contact_across_workers():
+    work = WorkStealingQueue(_contacts("poison", "ok"), workers=2, max_attempts=2)
+    poison = work.get(0)
+
+    # первая неудача — в конец очереди, откуда его заберёт другой воркер
+    assert work.fail(0, poison) is True
+    assert work.get(1).username == "ok"
+    assert work.get(1).username == "poison"
+    # вторая, уже в другом воркере, — контакт выбывает
+    assert work.fail(1, poison) is False
+    assert work.remaining() == []
+
+
+def test_result_writer_checkpoints_in_submit_order(db):
+    runs = SyncRunRepository()
+    run_id = runs.start_run("pool", ["alice", "bob", "carol"])
+    alice, bob, carol = _contacts("alice", "bob", "carol")
+    contacts_repo = ContactRepository()
+    contacts_repo.upsert_from_snapshot(alice)
+    writer = ResultWriter(contacts_repo, MessageRepository(), runs, run_id)
+    writer.start()
+    try:
+        writer.mark_in_progress("alice")
+        writer.submit(_WriteJob(alice, "t-alice", make_chat("alice", ["a0", "a1", "a2"]), scroll_depth=3))
+        writer.mark_in_progress("bob")
+        writer.mark_failed("bob", "TimeoutException()", 1.5)
+    finally:
+        writer.close()
+
+    assert writer.inserted == 3 and writer.errors == 0
+    assert [m.text for m in MessageRepository().list_for_contact("alice")] == ["a0", "a1", "a2"]
+    assert _run_states(run_id) == {
+        "alice": (DONE, 1, None),
+        "bob": (FAILED, 1, "TimeoutException()"),
+        "carol": (PENDING, 0, None),
+    }
+    assert [c.thread_id for c in contacts_repo.list_all() if c.username == "alice"] == ["t-alice"]
+
+
+def test_result_writer_marks_contact_failed_when_write_fails(db):
+    runs = SyncRunRepository()
+    run_id = runs.start_run("pool", ["alice", "bob"])
+    alice, bob = _contacts("alice", "bob")
+    writer = ResultWriter(ContactRepository(), _BrokenMessages(), runs, run_id)
+    writer.start()
+    try:
+        writer.mark_in_progress("alice")
+        writer.submit(_WriteJob(alice, None, make_chat("alice", ["a0"]), duration_seconds=2.0))
+        writer.mark_in_progress("bob")
+        # пустой сбор в БД не пишет — отметка done всё равно ставится
+        writer.submit(_WriteJob(bob, None, []))
+    finally:
+        writer.close()
+
+    states = _run_states(run_id)
+    assert states["alice"][0] == FAILED and "disk I/O error" in states["alice"][2]
+    assert states["bob"] == (DONE, 1, None)
+    assert writer.errors == 1 and writer.inserted == 0
+
+
+def test_result_writer_without_run_only_writes_messages(db):
+    (alice,) = _contacts("alice")
+    writer = ResultWriter(ContactRepository(), MessageRepository())
+    writer.start()
+    try:
+        writer.mark_in_progress("alice")
+        writer.submit(_WriteJob(alice, None, make_chat("alice", ["a0", "a1"])))
+        writer.mark_failed("alice", "ignored", 0.0)
+    finally:
+        writer.close()
+
+    assert writer.inserted == 2 and writer.errors == 0
+
+
+def test_pool_leaves_contacts_when_no_browser_starts(db):
+    def no_browser(**kwargs):
+        raise RuntimeError("chrome not found")
+
+    contacts = _contacts("a", "b", "c")
+    pool = SyncWorkerPool(workers=2, driver_factory=no_browser, max_restarts=0)
+
+    stats = pool.run(contacts, ContactRepository(), MessageRepository())
+
+    assert [s.alive for s in stats] == [False, False]
+    assert all("chrome not found" in s.error for s in stats)
+    assert sorted(_names(pool.leftover)) == ["a", "b", "c"]
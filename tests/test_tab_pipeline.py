@@ -0,0 +1,138 @@
+# tests/test_tab_pipeline.py
+#
+# Конвейер вкладок InstagramDirectClient.fetch_messages_pipelined без браузера:
+# вкладки — записная книжка драйвера, сбор чата — заданное число раундов.
+# client.selenium_direct тянет selenium; без него тесты пропускаются.
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from selenium.common.exceptions import NoSuchWindowException  # noqa: E402
+
+from client.selenium_direct import InstagramDirectClient  # noqa: E402
+from core.models import ContactSnapshot  # noqa: E402
+from tests.conftest import SCRAPED_AT, make_chat  # noqa: E402
+
+
+class _TabbedDriver:
+    """
+    Только то, что нужно конвейеру: вкладки, переключение и закрытие.
+    """
+
+    def __init__(self) -> None:
+        self.handles = ["home"]
+        self.current_window_handle = "home"
+        self.closed = []
+        self.switch_to = self
+
+    def new_window(self, kind: str) -> None:
+        handle = f"tab-{len(self.handles)}"
+        self.handles.append(handle)
+        self.current_window_handle = handle
+
+    def window(self, handle: str) -> None:
+        if handle not in self.handles:
+            raise NoSuchWindowException(handle)
+        self.current_window_handle = handle
+
+    def close(self) -> None:
+        self.handles.remove(self.current_window_handle)
+        self.closed.append(self.current_window_handle)
+
+
+@dataclass
+class _Chat:
+    contact_username: str
+    handle: str
+    rounds_left: int
+    rounds: int = 0
+    done: bool = False
+
+
+class _ScriptedClient(InstagramDirectClient):
+    """
+    Чат контакта собирается за rounds[username] раундов; None — чат не открылся;
+    crash_on — имя контакта, на раунде которого падает вкладка.
+    """
+
+    def __init__(self, driver: _TabbedDriver, rounds: dict, crash_on: str = "") -> None:
+        super().__init__(driver)
+        self._rounds = rounds
+        self._crash_on = crash_on
+        self.log = []
+
+    def _start_tab_chat(self, contact, max_scrolls, extraction_mode, watermarks):
+        rounds = self._rounds[contact.username]
+        if rounds is None:
+            return None
+        return _Chat(contact.username, self._driver.current_window_handle, rounds)
+
+    def _chat_collect_round(self, state, wait=True):
+        assert wait is False
+        # раунд идёт во вкладке своего чата
+        assert self._driver.current_window_handle == state.handle
+        if state.contact_username == self._crash_on:
+            raise NoSuchWindowException(state.handle)
+        self.log.append(state.contact_username)
+        state.rounds += 1
+        state.rounds_left -= 1
+        state.done = state.rounds_left <= 0
+
+    def _finish_chat_collect(self, state):
+        return make_chat(state.contact_username, [f"{state.contact_username}{i}" for i in range(state.rounds)])
+
+    def fetch_messages_for_contact(self, username, **kwargs):
+        self.log.append(f"{username}:single")
+        return make_chat(username, [f"{username}-single"])
+
+
+def _contacts(*usernames: str) -> list:
+    return [ContactSnapshot(u, None, None, True, None, None, SCRAPED_AT, thread_id=f"t-{u}") for u in usernames]
+
+
+def _collect(client: _ScriptedClient, contacts: list, tabs: int) -> tuple:
+    started = []
+    results = {}
+    for contact, messages in client.fetch_messages_pipelined(
+        contacts, tabs=tabs, min_tab_interval=0, on_start=lambda c: started.append(c.username)
+    ):
+        results[contact.username] = None if messages is None else [m.text for m in messages]
+    return started, results
+
+
+def test_tabs_interleave_chats_and_refill_freed_tabs():
+    driver = _TabbedDriver()
+    client = _ScriptedClient(driver, {"long": 4, "short": 1, "broken": None, "late": 2})
+
+    started, results = _collect(client, _contacts("long", "short", "broken", "late"), tabs=2)
+
+    assert started == ["long", "short", "broken", "late"]
+    assert results == {
+        "long": ["long0", "long1", "long2", "long3"],
+        "short": ["short0"],
+        "broken": None,
+        "late": ["late0", "late1"],
+    }
+    # короткий чат не ждёт длинного; освободившуюся вкладку занимает следующий контакт
+    assert client.log == ["long", "short", "long", "long", "late", "long", "late"]
+    # вкладки закрыты, драйвер вернулся в исходную
+    assert driver.handles == ["home"] and driver.current_window_handle == "home"
+    assert sorted(driver.closed) == ["tab-1", "tab-2"]
+
+
+def test_crashed_tab_finishes_contacts_in_home_tab_once():
+    driver = _TabbedDriver()
+    client = _ScriptedClient(driver, {"a": 3, "b": 3, "c": 1}, crash_on="b")
+
+    started, results = _collect(client, _contacts("a", "b", "c"), tabs=2)
+
+    # a и b уже были во вкладках — их попытка засчитана один раз
+    assert started == ["a", "b", "c"]
+    assert results == {"a": ["a-single"], "b": ["b-single"], "c": ["c-single"]}
+    assert client.log == ["a", "a:single", "b:single", "c:single"]
+    assert driver.current_window_handle == "home"